@@ -1,14 +1,16 @@
 import httpx
 import urllib3
 from fastapi import HTTPException
-import re
 import os
+from Modules.digest import check_config_write
 from Modules.logger import init_logger
+from Modules.proxmox_client import PROXMOX_BASE_URL
+from Modules.pve_config import free_slots, parse_config
+from Modules.profiles import disk_options, get_profile, join_options, volume_format
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-PROXMOX_BASE_URL = "https://pve.home.lab:8006/api2/json"
 
-async def activate_unused_disk(node: str, vmid: int, unused_key: str, target_controller: str, csrf_token: str, ticket: str, log_file: str) -> dict:
+async def activate_unused_disk(node: str, vmid: int, unused_key: str, target_controller: str, csrf_token: str, ticket: str, log_file: str, digest: str = None, profile: str = None) -> dict:
     logger = init_logger(log_file, __name__)
     logger.info(f"Activating unused disk {unused_key} for VM {vmid} on node {node}")
 
@@ -30,25 +32,26 @@ async def activate_unused_disk(node: str, vmid: int, unused_key: str, target_con
         config = config_resp.json().get("data", {})
         logger.info(f"Current VM config: {config}")
 
-        if unused_key not in config:
-            available = [k for k in config if k.startswith("unused")]
+        parsed = parse_config(config)
+        unused = next((u for u in parsed.unused if u.key == unused_key), None)
+        if unused is None:
+            available = [u.key for u in parsed.unused]
             logger.error(f"Unused disk '{unused_key}' not found. Available: {available}")
             raise HTTPException(status_code=404, detail=f"Unused disk '{unused_key}' not found. Available: {available}")
 
-        volume_path = config[unused_key].strip()
+        volume_path = unused.volid
         logger.info(f"Volume path for {unused_key}: {volume_path}")
 
-        used_slots = [
-            int(m.group()) for k in config
-            if k.startswith(target_controller) and (m := re.search(r'\d+$', k))
-        ]
-        slot = 0
-        while slot in used_slots:
-            slot += 1
-        target_key = f"{target_controller}{slot}"
-        disk_value = f"file={volume_path},media=disk,format=qcow2,ssd=1"
+        try:
+            target_key = free_slots(config, target_controller)[0]
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        # The volume already exists, so keep its format; block volumes have none in the name and Proxmox detects raw
+        options = disk_options(get_profile(profile), target_controller, volume_format(volume_path))
+        disk_value = f"file={volume_path},media=disk,{join_options(options)}"
 
-        payload = {target_key: disk_value}
+        # Guard the slot choice with the digest of the config it was made from
+        payload = {target_key: disk_value, "digest": digest or config.get("digest")}
         logger.info(f"Payload for activating disk: {payload}")
 
         resp = await client.post(
@@ -58,6 +61,7 @@ async def activate_unused_disk(node: str, vmid: int, unused_key: str, target_con
             data=payload,
         )
         logger.info(f"Response from activating disk: {resp.text}")
+        check_config_write(resp.status_code, resp.text, logger)
 
         if resp.status_code != 200:
             logger.error(f"Failed to activate disk {unused_key} for VM {vmid}: {resp.text}")
@@ -1,52 +1,77 @@
 import httpx
 import urllib3
 from fastapi import HTTPException
+from typing import Dict, List, Optional
+from Modules.digest import DIGEST_MISMATCH_MARKER, check_config_write
 from Modules.logger import init_logger
+from Modules.pve_config import free_slots
+from Modules.profiles import disk_format, disk_options, get_profile, join_options
+from Modules.proxmox_client import PROXMOX_BASE_URL
 import os
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-PROXMOX_BASE_URL = "https://pve.home.lab:8006/api2/json"
 
-# Function to add a disk to a VM
-def add_disk(node: str, vmid: int, req, csrf_token: str, ticket: str, log_file: str) -> str:
+# Retries when another writer changed the config between our read and write
+MAX_ALLOCATION_ATTEMPTS = 3
+
+
+def disk_value(req, storage_type: Optional[str] = None) -> str:
+    # Format follows the storage (raw on block storages), the rest comes from the disk's profile
+    controller = req.controller or "scsi"
+    options = disk_options(get_profile(req.profile), controller, disk_format(storage_type, req.format))
+    return f"{req.storage}:{req.size},media=disk,size={req.size}G,{join_options(options)}"
+
+
+# Function to add several disks to a VM in one config write
+def add_disks(node: str, vmid: int, reqs: List, csrf_token: str, ticket: str, log_file: str, digest: Optional[str] = None, storage_types: Optional[Dict[str, str]] = None) -> dict:
     logger = init_logger(log_file, __name__)
+    storage_types = storage_types or {}
 
     headers = {"CSRFPreventionToken": csrf_token}
     cookies = {"PVEAuthCookie": ticket}
+    config_url = f"{PROXMOX_BASE_URL}/nodes/{node}/qemu/{vmid}/config"
+
+    # A caller-supplied digest means "fail if changed"; otherwise re-read and re-allocate
+    attempts = 1 if digest else MAX_ALLOCATION_ATTEMPTS
+    for attempt in range(1, attempts + 1):
+        config_resp = httpx.get(config_url, headers=headers, cookies=cookies, verify=False)
+        if config_resp.status_code != 200:
+            logger.error(f"Failed to get VM config for VM {vmid} on node {node}: {config_resp.text}")
+            raise HTTPException(status_code=config_resp.status_code, detail="Failed to get VM config")
 
-    config_resp = httpx.get(
-        f"{PROXMOX_BASE_URL}/nodes/{node}/qemu/{vmid}/config",
-        headers=headers,
-        cookies=cookies,
-        verify=False,
-    )
-    if config_resp.status_code != 200:
-        logger.error(f"Failed to get VM config for VM {vmid} on node {node}: {config_resp.text}")
-        raise HTTPException(status_code=config_resp.status_code, detail="Failed to get VM config")
-
-    config = config_resp.json().get("data", {})
-    logger.info(f"Current VM config: {config}")
-
-    slot = 1
-    while f"scsi{slot}" in config:
-        slot += 1
-
-    disk_id = f"scsi{slot}"
-    logger.info(f"Adding disk {disk_id} to VM {vmid} on node {node}")
-
-    value = f"{req.storage}:{req.size},format=qcow2,media=disk,size={req.size}G,ssd=1"
-    payload = {disk_id: value}
-    logger.info(f"Payload for adding disk: {payload}")
-
-    response = httpx.post(
-        f"{PROXMOX_BASE_URL}/nodes/{node}/qemu/{vmid}/config",
-        data=payload,
-        headers=headers,
-        cookies=cookies,
-        verify=False,
-    )
-    logger.info(f"Response from adding disk: {response.text}")
-    if response.status_code != 200:
-        raise HTTPException(status_code=response.status_code, detail=response.text)
-
-    return response.json().get("data", "Disk added")
+        config = config_resp.json().get("data", {})
+        logger.info(f"Current VM config: {config}")
+
+        # Allocate every slot in one pass; slot 0 of scsi is left for the boot disk
+        payload = {}
+        by_controller = {}
+        for req in reqs:
+            by_controller.setdefault(req.controller or "scsi", []).append(req)
+        for controller, group in by_controller.items():
+            try:
+                slots = free_slots(config, controller, len(group), start=1 if controller == "scsi" else 0)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            for disk_id, req in zip(slots, group):
+                payload[disk_id] = disk_value(req, storage_types.get(req.storage))
+        keys = list(payload)
+        payload["digest"] = digest or config.get("digest")
+        logger.info(f"Adding disks {keys} to VM {vmid} on node {node}; payload: {payload}")
+
+        response = httpx.post(config_url, data=payload, headers=headers, cookies=cookies, verify=False)
+        logger.info(f"Response from adding disks: {response.text}")
+        if response.status_code != 200 and DIGEST_MISMATCH_MARKER in response.text and attempt < attempts:
+            logger.warning(f"Config of VM {vmid} changed during slot allocation, retrying ({attempt}/{attempts})")
+            continue
+        check_config_write(response.status_code, response.text, logger)
+        if response.status_code != 200:
+            raise HTTPException(status_code=response.status_code, detail=response.text)
+
+        return {"keys": keys, "upid": response.json().get("data")}
+
+
+# Function to add a disk to a VM
+def add_disk(node: str, vmid: int, req, csrf_token: str, ticket: str, log_file: str, digest: str = None, storage_types: Optional[Dict[str, str]] = None) -> str:
+    # The single-disk route always used the scsi bus
+    req = req.model_copy(update={"controller": "scsi"})
+    return add_disks(node, vmid, [req], csrf_token, ticket, log_file, digest, storage_types)["upid"] or "Disk added"
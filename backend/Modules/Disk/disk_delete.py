@@ -1,142 +1,132 @@
 import httpx
 import urllib3
-import time
+import asyncio
 from urllib.parse import quote
+from typing import Dict, List, Optional
 from fastapi import HTTPException
+from Modules.digest import check_config_write
 from Modules.logger import init_logger
+from Modules.pve_config import parse_config
+from Modules.proxmox_client import PROXMOX_BASE_URL
+from Modules.services.task_service import wait_for_task
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-PROXMOX_BASE_URL = "https://pve.home.lab:8006/api2/json"
 
-def delete_disk(node: str, vmid: int, disk_key: str, csrf_token: str, ticket: str, log_file: str) -> dict:
+VOLUME_DELETE_TIMEOUT = 120.0
+
+
+async def delete_disks(node: str, vmid: int, disk_keys: List[str], csrf_token: str, ticket: str, log_file: str, digest: Optional[str] = None) -> dict:
+    """
+    Detach one or more disks, destroy their volumes and drop any unusedN
+    entries still pointing at them. Each step waits on the actual task or
+    config state, and every config change is a single write.
+    """
     logger = init_logger(log_file, __name__)
-    logger.info(f"Attempting to delete disk '{disk_key}' from VM {vmid} on node {node}")
+    disk_keys = list(dict.fromkeys(disk_keys))
+    logger.info(f"Attempting to delete disks {disk_keys} from VM {vmid} on node {node}")
 
     headers = {"CSRFPreventionToken": csrf_token}
     cookies = {"PVEAuthCookie": ticket}
+    config_url = f"{PROXMOX_BASE_URL}/nodes/{node}/qemu/{vmid}/config"
+
+    async with httpx.AsyncClient(verify=False, timeout=30.0) as client:
+        async def get_config() -> dict:
+            resp = await client.get(config_url, headers=headers, cookies=cookies)
+            if resp.status_code != 200:
+                logger.error(f"Failed to get VM config for VM {vmid} on node {node}: {resp.text}")
+                raise HTTPException(status_code=resp.status_code, detail="Failed to get VM config")
+            return resp.json().get("data", {})
+
+        async def put_config(data: Dict[str, str]) -> httpx.Response:
+            resp = await client.put(config_url, data=data, headers=headers, cookies=cookies)
+            check_config_write(resp.status_code, resp.text, logger)
+            return resp
+
+        # Step 1: Resolve every requested key to its volume
+        config = await get_config()
+        parsed = parse_config(config)
+        volumes = {}
+        for key in disk_keys:
+            entry = parsed.disk(key) or next((u for u in parsed.unused if u.key == key), None)
+            if entry is None:
+                logger.error(f"Disk {key} not found in VM {vmid} config")
+                raise HTTPException(status_code=404, detail=f"Disk {key} not found")
+            if not entry.storage or not entry.volume:
+                logger.error(f"Failed to parse volid from disk value: {config.get(key)}")
+                raise HTTPException(status_code=400, detail=f"Failed to parse volid: {config.get(key)}")
+            volumes[key] = entry
+        logger.info(f"Resolved volumes to delete: { {k: v.volid for k, v in volumes.items()} }")
+
+        # Step 2: Detach everything in one synchronous config write
+        detach_data = {"delete": ",".join(disk_keys)}
+        if digest:
+            detach_data["digest"] = digest
+        detach_resp = await put_config(detach_data)
+        if detach_resp.status_code != 200:
+            logger.error(f"Failed to detach disks {disk_keys} from VM {vmid}: {detach_resp.text}")
+            raise HTTPException(status_code=detach_resp.status_code, detail=f"Failed to detach disk: {detach_resp.text}")
+        logger.info(f"Detached disks {disk_keys} from VM {vmid}")
+
+        # Step 3: Destroy the volumes concurrently and wait for their tasks
+        async def destroy(entry) -> Optional[str]:
+            volume_url = f"{PROXMOX_BASE_URL}/nodes/{node}/storage/{entry.storage}/content/{quote(entry.volume, safe='')}"
+            resp = await client.delete(volume_url, params={"destroy": "1"}, headers=headers, cookies=cookies)
+            logger.info(f"Response from deleting volume {entry.volid}: {resp.status_code} - {resp.text}")
+            if resp.status_code not in [200, 204]:
+                # If destroy fails, try without destroy parameter as fallback
+                logger.warning(f"Deletion of {entry.volid} with destroy parameter failed, trying without...")
+                resp = await client.delete(volume_url, headers=headers, cookies=cookies)
+                logger.info(f"Fallback response: {resp.status_code} - {resp.text}")
+                if resp.status_code not in [200, 204]:
+                    return f"Failed to delete volume: {resp.text}"
+
+            upid = resp.json().get("data") if resp.status_code == 200 else None
+            if isinstance(upid, str) and upid.startswith("UPID:"):
+                try:
+                    task = await wait_for_task(client, node, upid, headers, cookies, timeout=VOLUME_DELETE_TIMEOUT)
+                except HTTPException as e:
+                    return e.detail
+                if task.get("exitstatus") != "OK":
+                    return f"Volume delete task failed: {task.get('exitstatus')}"
+            logger.info(f"Deleted volume {entry.volid}")
+            return None
+
+        errors = dict(zip(volumes, await asyncio.gather(*(destroy(v) for v in volumes.values()))))
+
+        # Step 4: Drop lingering unusedN entries for the deleted volumes in one write
+        deleted = [v for k, v in volumes.items() if errors[k] is None]
+        final_config = await get_config()
+        unused_to_delete = [
+            u.key for u in parse_config(final_config).unused
+            if any(u.volid == v.volid or u.volume == v.volume for v in deleted)
+        ]
+        logger.info(f"Unused disk entries to clean up: {unused_to_delete}")
+        if unused_to_delete:
+            cleanup_resp = await put_config({"delete": ",".join(unused_to_delete)})
+            if cleanup_resp.status_code != 200:
+                # Don't fail the whole operation if unused cleanup fails, but log it
+                logger.warning(f"Failed to remove unused disks {unused_to_delete}: {cleanup_resp.text}")
+            else:
+                logger.info(f"Removed lingering unused disk config: {unused_to_delete}")
+
+    failed = {k: e for k, e in errors.items() if e}
+    for key, error in failed.items():
+        logger.error(f"Failed to delete volume for {key}: {error}")
+
+    return {
+        "success": not failed,
+        "message": f"Disks {', '.join(disk_keys)} detached, {len(deleted)} volume(s) deleted, and unused entries cleaned",
+        "results": {k: {"volid": v.volid, "error": errors[k]} for k, v in volumes.items()},
+    }
 
-    config_resp = httpx.get(
-        f"{PROXMOX_BASE_URL}/nodes/{node}/qemu/{vmid}/config",
-        headers=headers,
-        cookies=cookies,
-        verify=False,
-    )
-    logger.info(f"Response from getting VM config: {config_resp.text}")
-    if config_resp.status_code != 200:
-        logger.error(f"Failed to get VM config for VM {vmid} on node {node}: {config_resp.text}")
-        raise HTTPException(status_code=config_resp.status_code, detail="Failed to get VM config")
-
-    config = config_resp.json().get("data", {})
-    disk_value = config.get(disk_key)
-    logger.info(f"Disk value for {disk_key}: {disk_value}")
-
-    if not disk_value:
-        logger.error(f"Disk {disk_key} not found in VM {vmid} config")
-        raise HTTPException(status_code=404, detail=f"Disk {disk_key} not found")
-
-    try:
-        full_volid = disk_value.split(",")[0].strip()
-        storage, filename = full_volid.split(":", 1)  # Split only on first colon
-        # URL encode the filename for the API call
-        filename_encoded = quote(filename, safe='')
-
-    except Exception as e:
-        logger.error(f"Failed to parse volid from disk value: {disk_value}, error: {e}")
-        raise HTTPException(status_code=400, detail=f"Failed to parse volid: {disk_value}")
-
-    logger.info(f"Resolved volume to delete: {full_volid} (storage: {storage}, filename: {filename})")
-
-    # Step 1: Detach disk from VM config
-    detach_resp = httpx.put(
-        f"{PROXMOX_BASE_URL}/nodes/{node}/qemu/{vmid}/config",
-        data={"delete": disk_key},
-        headers=headers,
-        cookies=cookies,
-        verify=False,
-    )
-
-    if detach_resp.status_code != 200:
-        logger.error(f"Failed to detach disk {disk_key} from VM {vmid}: {detach_resp.text}")
-        raise HTTPException(status_code=detach_resp.status_code, detail=f"Failed to detach disk: {detach_resp.text}")
-
-    logger.info(f"Detached disk {disk_key} from VM {vmid}")
-
-    # Step 2: Wait a moment for Proxmox to process the detach
-    time.sleep(0.5)
-
-    # Step 3: Delete the volume from storage
-    # Use destroy parameter to ensure complete removal
-    delete_resp = httpx.delete(
-        f"{PROXMOX_BASE_URL}/nodes/{node}/storage/{storage}/content/{filename_encoded}",
-        params={"destroy": "1"},  # Use destroy parameter for complete removal
-        headers=headers,
-        cookies=cookies,
-        verify=False,
-    )
-    logger.info(f"Response from deleting volume: {delete_resp.status_code} - {delete_resp.text}")
-
-    if delete_resp.status_code not in [200, 204]:
-        # If destroy fails, try without destroy parameter as fallback
-        logger.warning(f"Deletion with destroy parameter failed, trying without...")
-        fallback_resp = httpx.delete(
-            f"{PROXMOX_BASE_URL}/nodes/{node}/storage/{storage}/content/{filename_encoded}",
-            headers=headers,
-            cookies=cookies,
-            verify=False,
-        )
-        logger.info(f"Fallback response: {fallback_resp.status_code} - {fallback_resp.text}")
-        
-        if fallback_resp.status_code not in [200, 204]:
-            logger.error(f"Failed to delete volume {filename} from storage {storage}: {fallback_resp.text}")
-            raise HTTPException(status_code=fallback_resp.status_code, detail=f"Failed to delete volume: {fallback_resp.text}")
-    
-    logger.info(f"Deleted volume {filename} from storage {storage}")
-
-    # Step 4: Clean up any unused entries that Proxmox might have created
-    # Wait a bit for Proxmox to update the config
-    time.sleep(0.5)
-    
-    final_config_resp = httpx.get(
-        f"{PROXMOX_BASE_URL}/nodes/{node}/qemu/{vmid}/config",
-        headers=headers,
-        cookies=cookies,
-        verify=False,
-    )
-    logger.info(f"Response from refreshing VM config: {final_config_resp.text}")
-    if final_config_resp.status_code != 200:
-        logger.error(f"Failed to refresh VM config after deleting disk {disk_key}: {final_config_resp.text}")
-        raise HTTPException(status_code=final_config_resp.status_code, detail="Failed to refresh VM config")
-
-    final_config = final_config_resp.json().get("data", {})
-    logger.info(f"Final VM config after deletion: {final_config}")
-
-    # Find all unused entries that reference this volume (by volid or filename)
-    unused_to_delete = []
-    for k, v in final_config.items():
-        if k.startswith("unused"):
-            # Check if this unused entry references our deleted volume
-            if full_volid in str(v) or filename in str(v):
-                unused_to_delete.append(k)
-    
-    logger.info(f"Unused disk entries to clean up: {unused_to_delete}")
-
-    # Remove all unused entries related to this disk
-    for unused_key in unused_to_delete:
-        logger.info(f"Cleaning up lingering config entry: {unused_key}")
-        cleanup_resp = httpx.put(
-            f"{PROXMOX_BASE_URL}/nodes/{node}/qemu/{vmid}/config",
-            data={"delete": unused_key},
-            headers=headers,
-            cookies=cookies,
-            verify=False,
-        )
-        if cleanup_resp.status_code != 200:
-            logger.warning(f"Failed to remove unused disk {unused_key}: {cleanup_resp.text}")
-            # Don't fail the whole operation if unused cleanup fails, but log it
-        else:
-            logger.info(f"Removed lingering unused disk config: {unused_key}")
 
+async def delete_disk(node: str, vmid: int, disk_key: str, csrf_token: str, ticket: str, log_file: str, digest: Optional[str] = None) -> dict:
+    result = await delete_disks(node, vmid, [disk_key], csrf_token, ticket, log_file, digest)
+    error = result["results"][disk_key]["error"]
+    if error:
+        raise HTTPException(status_code=500, detail=error)
+    volume = result["results"][disk_key]["volid"].split(":", 1)[-1]
     return {
         "success": True,
-        "message": f"Disk {disk_key} detached, volume {filename} deleted, and unused entries cleaned",
+        "message": f"Disk {disk_key} detached, volume {volume} deleted, and unused entries cleaned",
     }
@@ -1,16 +1,19 @@
 import requests
 from fastapi import HTTPException
-import os, re, time
+import os, time
+from Modules.digest import check_config_write
 from Modules.logger import init_logger
+from Modules.pve_config import GIB, parse_config
+from Modules.proxmox_client import PROXMOX_BASE_URL
 
-def expand_disk(node, vmid, disk_key, target_size_gb, csrf_token, ticket, log_file):
+def expand_disk(node, vmid, disk_key, target_size_gb, csrf_token, ticket, log_file, digest=None, catalog=None):
     logger = init_logger(log_file, __name__)
     logger.info(f"Expanding disk {disk_key} to {target_size_gb}GB for VM {vmid} on {node}")
 
     if target_size_gb > 80:
         raise HTTPException(status_code=400, detail="Maximum disk size is 80 GB")
 
-    base_url = os.getenv("PROXMOX_API", "https://pve.home.lab:8006/api2/json")
+    base_url = os.getenv("PROXMOX_API", PROXMOX_BASE_URL)
     verify_ssl = os.getenv("VERIFY_SSL", "false").lower().startswith("t")
     headers = {
         "CSRFPreventionToken": csrf_token,
@@ -18,20 +21,25 @@ def expand_disk(node, vmid, disk_key, target_size_gb, csrf_token, ticket, log_fi
     }
 
     # Get current size from Proxmox directly
-    def get_current_size():
+    def get_current_disk():
         config_url = f"{base_url}/nodes/{node}/qemu/{vmid}/config"
         r_cfg = requests.get(config_url, headers=headers, verify=verify_ssl)
         if r_cfg.status_code != 200:
             raise HTTPException(status_code=r_cfg.status_code, detail=r_cfg.text)
-        data = r_cfg.json().get("data", {})
-        match = re.search(r"size=(\d+)", data.get(disk_key, ""))
-        if not match:
+        disk = parse_config(r_cfg.json().get("data", {})).disk(disk_key)
+        if disk is None or disk.size is None:
             raise HTTPException(status_code=404, detail=f"Could not determine current size for {disk_key}")
-        return int(match.group(1))
+        return disk
+
+    def get_current_size():
+        return get_current_disk().size_gb
 
-    current_size_gb = get_current_size()
+    disk = get_current_disk()
+    current_size_gb = disk.size_gb
     if target_size_gb <= current_size_gb:
         raise HTTPException(status_code=400, detail="New size must be greater than current size")
+    if catalog and disk.storage:
+        catalog.check_capacity(node, disk.storage, (target_size_gb - current_size_gb) * GIB, csrf_token, ticket)
 
     logger.info(f"Current size: {current_size_gb}GB, Target size: {target_size_gb}GB")
     resize_url = f"{base_url}/nodes/{node}/qemu/{vmid}/resize"
@@ -42,8 +50,13 @@ def expand_disk(node, vmid, disk_key, target_size_gb, csrf_token, ticket, log_fi
             "disk": disk_key,
             "size": "+1G"
         }
+        if digest:
+            # Only the first step can be guarded; each resize bumps the digest
+            params["digest"] = digest
+            digest = None
         logger.info(f"Resizing {disk_key} by +1G (from {current_size_gb}GB)")
         r = requests.put(resize_url, params=params, headers=headers, verify=verify_ssl)
+        check_config_write(r.status_code, r.text, logger)
         if r.status_code != 200:
             logger.error(f"Resize failed: {r.text}")
             raise HTTPException(status_code=r.status_code, detail=r.text)
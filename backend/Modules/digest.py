@@ -0,0 +1,41 @@
+from fastapi import HTTPException
+from typing import Optional
+
+# Proxmox rejects a config write whose `digest` no longer matches with this message
+DIGEST_MISMATCH_MARKER = "file changed by other user"
+
+
+def make_etag(digest: Optional[str], status: Optional[str] = None) -> Optional[str]:
+    # The status is folded in because the config payload carries it too
+    if not digest:
+        return None
+    return f'"{digest}-{status}"' if status else f'"{digest}"'
+
+
+def digest_from_etag(etag: Optional[str]) -> Optional[str]:
+    # Accepts a bare digest, a quoted ETag or a weak W/"..." ETag
+    if not etag:
+        return None
+    value = etag.strip()
+    if value.startswith("W/"):
+        value = value[2:]
+    value = value.strip('"')
+    return value.split("-", 1)[0] or None
+
+
+def etag_matches(if_none_match: Optional[str], etag: Optional[str]) -> bool:
+    if not if_none_match or not etag:
+        return False
+    candidates = [c.strip() for c in if_none_match.split(",")]
+    if "*" in candidates:
+        return True
+    bare = etag.strip('"')
+    return any(c.removeprefix("W/").strip('"') == bare for c in candidates)
+
+
+def check_config_write(status_code: int, text: str, logger=None):
+    # Map a digest mismatch to 412 so callers can refetch and retry
+    if status_code != 200 and DIGEST_MISMATCH_MARKER in text:
+        if logger:
+            logger.warning(f"Config digest mismatch: {text}")
+        raise HTTPException(status_code=412, detail="VM config was modified concurrently; refresh and retry")
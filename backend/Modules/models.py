@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Literal, Optional
+from typing import List, Literal, Optional
 
 class LoginRequest(BaseModel):
     username: str
@@ -14,6 +14,10 @@ class VMCreateRequest(BaseModel):
     cpus: int
     ram: int
     source: Literal["ISO", "template", "disk"]  # restrict to known sources if you like
+    iso: str = "local:iso/ubuntu-22.04.3-live-server-amd64.iso"
+    storage: str = "local-lvm"
+    disk_size: int = 32  # GB
+    profile: Optional[str] = None  # performance profile, see Modules.profiles
 
 class VMUpdateRequest(BaseModel):
     name: Optional[str] = None
@@ -25,17 +29,113 @@ class VMCloneRequest(BaseModel):
     Request body for cloning a VM.
     - name: name of the new VM
     - full: whether to perform a full clone (True) or a linked clone (False)
-    - target: node to create the clone on
+    - target: node to create the clone on, or "auto" to let the placement service choose
     - storage: (optional) custom storage ID for the clone
+    - profile: (optional) performance profile applied to the clone once it exists
+    - newid: (optional) VMID for the clone, next free one by default
     """
     name: str
     full: bool = False
     target: str
     storage: Optional[str] = None
+    profile: Optional[str] = None
+    newid: Optional[int] = None
 
 class VMDiskAddRequest(BaseModel):
     controller: str
     bus: int
     size: int
     storage: str
-    format: Optional[str] = "qcow2"
+    format: Optional[str] = "qcow2"  # ignored on block storages, which only hold raw volumes
+    profile: Optional[str] = None
+
+class VMDisksAddRequest(BaseModel):
+    """
+    Request body for adding several disks in one config write.
+    Slots are allocated by the backend; each disk's `bus` is ignored.
+    """
+    disks: List[VMDiskAddRequest]
+
+class OrphanReclaimRequest(BaseModel):
+    """
+    Volumes from the last orphan scan to delete.
+    - force: also delete volumes whose owner VM has snapshots that may still use them
+    """
+    volids: List[str]
+    force: bool = False
+
+class FleetSnapshotRequest(BaseModel):
+    """
+    Snapshot every VM matching all given selectors (vmids, tag, pool).
+    - snapname: defaults to fleet_<timestamp>
+    """
+    vmids: Optional[List[int]] = None
+    tag: Optional[str] = None
+    pool: Optional[str] = None
+    snapname: Optional[str] = None
+    description: str = ""
+    vmstate: int = 0
+
+class RetentionPolicy(BaseModel):
+    """
+    Keep the newest `keep_last` snapshots plus the newest one per day for
+    `keep_daily` days; only snapshots whose name starts with `prefix` are pruned.
+    """
+    name: str
+    vmids: Optional[List[int]] = None
+    tag: Optional[str] = None
+    pool: Optional[str] = None
+    prefix: str = "fleet_"
+    keep_last: int = 5
+    keep_daily: int = 7
+
+class FleetExecRequest(BaseModel):
+    """
+    Run a command through the guest agent on every VM matching all given
+    selectors (vmids, tag, pool), at most `concurrency` at a time.
+    - command: program and arguments, e.g. ["systemctl", "restart", "nginx"]
+    """
+    vmids: Optional[List[int]] = None
+    tag: Optional[str] = None
+    pool: Optional[str] = None
+    command: List[str]
+    input_data: Optional[str] = None
+    timeout: float = 60.0
+    concurrency: int = 10
+
+class PlacementSpec(BaseModel):
+    cores: int
+    memory: int  # MiB
+    disk: int = 0  # GB
+    storage: Optional[str] = None
+    exclude: Optional[List[str]] = None
+
+class PlacementRequest(BaseModel):
+    """
+    VMs to place in one batch; each is scored against the nodes with the
+    earlier ones already counted, so a batch spreads across the cluster.
+    - reserve: hold the chosen capacity briefly for follow-up create/clone calls
+    """
+    vms: List[PlacementSpec]
+    reserve: bool = False
+
+class BackupRequest(BaseModel):
+    """
+    Run vzdump for every VM matching all given selectors (vmids, tag, pool).
+    - bwlimit: per-backup read limit in KiB/s
+    """
+    vmids: Optional[List[int]] = None
+    tag: Optional[str] = None
+    pool: Optional[str] = None
+    storage: str
+    mode: Literal["snapshot", "suspend", "stop"] = "snapshot"
+    compress: Literal["zstd", "lzo", "gzip", "0"] = "zstd"
+    bwlimit: Optional[int] = None
+
+class BalloonBounds(BaseModel):
+    """
+    Per-VM limits for the memory manager, in MiB; unset values fall back to
+    the config's `balloon` (minimum) and `memory` (maximum).
+    """
+    min_mib: Optional[int] = None
+    max_mib: Optional[int] = None
@@ -0,0 +1,202 @@
+from Modules.logger import init_logger
+from fastapi import HTTPException
+from typing import Any, AsyncIterator, Dict, List, Optional, Set
+import contextlib
+import asyncio
+import httpx
+import os
+
+PROXMOX_HOST = os.getenv("PROXMOX_HOST", "pve.home.lab")
+PROXMOX_PORT = os.getenv("PROXMOX_PORT", "8006")
+VERIFY_SSL = os.getenv("VERIFY_SSL", "false").lower().startswith("t")
+
+
+def api_url(host: str, port: str = PROXMOX_PORT) -> str:
+    return f"https://{host}:{port}/api2/json"
+
+
+PROXMOX_BASE_URL = api_url(PROXMOX_HOST)
+
+# Endpoint health: consecutive transport failures before an endpoint leaves rotation
+MAX_FAILURES = 2
+HEALTH_INTERVAL = 10.0
+HEALTH_TIMEOUT = 3.0
+
+
+class ProxmoxClientPool:
+    """
+    Keeps one pooled httpx.AsyncClient per API endpoint, so repeated calls to the
+    same node reuse TCP/TLS connections instead of opening a client per request.
+    """
+
+    def __init__(self, timeout: float = 10.0, max_connections: int = 20):
+        self.timeout = timeout
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self.clients: Dict[str, httpx.AsyncClient] = {}
+
+    def client(self, base_url: str = PROXMOX_BASE_URL) -> httpx.AsyncClient:
+        client = self.clients.get(base_url)
+        if client is None or client.is_closed:
+            # Waiting for a free pooled connection is not an upstream timeout
+            timeout = httpx.Timeout(self.timeout, pool=None)
+            client = httpx.AsyncClient(verify=VERIFY_SSL, timeout=timeout, limits=self.limits)
+            self.clients[base_url] = client
+        return client
+
+    async def close(self, base_url: Optional[str] = None):
+        targets = [base_url] if base_url else list(self.clients)
+        for url in targets:
+            client = self.clients.pop(url, None)
+            if client is not None:
+                await client.aclose()
+
+
+class Endpoint:
+    __slots__ = ("url", "node", "healthy", "outstanding", "failures", "last_error")
+
+    def __init__(self, url: str, node: Optional[str] = None):
+        self.url = url
+        self.node = node
+        self.healthy = True
+        self.outstanding = 0
+        self.failures = 0
+        self.last_error: Optional[str] = None
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+
+class EndpointSet:
+    """
+    Every cluster member's pveproxy can answer cluster-wide API calls. Reads are
+    spread over the healthy endpoints by least outstanding requests, node-scoped
+    calls prefer the owning node, and endpoints that fail are taken out of
+    rotation until a health check succeeds again.
+    """
+
+    def __init__(self, pool: ProxmoxClientPool, log_file: str, seeds: Optional[List[str]] = None):
+        self.pool = pool
+        self.logger = init_logger(log_file, __name__)
+        hosts = seeds or [h.strip() for h in os.getenv("PROXMOX_ENDPOINTS", PROXMOX_HOST).split(",") if h.strip()]
+        self.endpoints: Dict[str, Endpoint] = {}
+        for host in hosts:
+            url = host if host.startswith("https://") else api_url(host)
+            self.endpoints[url] = Endpoint(url)
+
+    def update_nodes(self, nodes: List[Dict[str, Any]], answered_by: Optional[str] = None):
+        # Called after cluster discovery so node-scoped calls can find their owner. The endpoint
+        # that answered is the "local" node, so a seeded hostname is not added again by its IP
+        for entry in nodes:
+            endpoint = self.endpoints.get(answered_by) if entry.get("local") else None
+            endpoint = (
+                endpoint
+                or next((e for e in self.endpoints.values() if e.node == entry["name"]), None)
+                or self.endpoints.get(entry["api_url"])
+            )
+            if endpoint is None:
+                endpoint = self.endpoints[entry["api_url"]] = Endpoint(entry["api_url"], entry["name"])
+            endpoint.node = entry["name"]
+            # One endpoint per node
+            for url, other in list(self.endpoints.items()):
+                if other is not endpoint and other.node == entry["name"]:
+                    del self.endpoints[url]
+            if not entry.get("online", True):
+                endpoint.healthy = False
+
+    def endpoint_for(self, url: str) -> Optional[str]:
+        # The endpoint a full request URL went to
+        return next((base for base in self.endpoints if url.startswith(base)), None)
+
+    def pick(self, node: Optional[str] = None, exclude: Optional[Set[str]] = None) -> Endpoint:
+        exclude = exclude or set()
+        healthy = [e for e in self.endpoints.values() if e.healthy and e.url not in exclude]
+        if node:
+            owner = next((e for e in healthy if e.node == node), None)
+            if owner is not None:
+                return owner
+        # With nothing healthy, still try something rather than failing outright
+        candidates = healthy or [e for e in self.endpoints.values() if e.url not in exclude] or list(self.endpoints.values())
+        return min(candidates, key=lambda e: e.outstanding)
+
+    def mark_failure(self, endpoint: Endpoint, error: str, threshold: int = MAX_FAILURES):
+        endpoint.failures += 1
+        endpoint.last_error = error
+        if endpoint.healthy and endpoint.failures >= threshold:
+            endpoint.healthy = False
+            self.logger.warning(f"Endpoint {endpoint.url} removed from rotation: {error}")
+
+    def mark_success(self, endpoint: Endpoint):
+        endpoint.failures = 0
+        if not endpoint.healthy:
+            self.logger.info(f"Endpoint {endpoint.url} back in rotation")
+        endpoint.healthy = True
+
+    @contextlib.asynccontextmanager
+    async def lease(self, node: Optional[str] = None, exclude: Optional[Set[str]] = None) -> AsyncIterator[Endpoint]:
+        endpoint = self.pick(node, exclude)
+        endpoint.outstanding += 1
+        try:
+            yield endpoint
+        except httpx.TransportError as e:
+            self.mark_failure(endpoint, str(e))
+            raise
+        finally:
+            endpoint.outstanding -= 1
+
+    def client(self, endpoint: Endpoint) -> httpx.AsyncClient:
+        return self.pool.client(endpoint.url)
+
+    async def request(self, method: str, path: str, node: Optional[str] = None, **kwargs) -> httpx.Response:
+        # Transport failures fail over to the next endpoint; once bytes may have
+        # reached the server only reads are retried
+        is_read = method.upper() == "GET"
+        tried: Set[str] = set()
+        last_error: Optional[Exception] = None
+        while len(tried) < len(self.endpoints):
+            try:
+                async with self.lease(node, tried) as endpoint:
+                    tried.add(endpoint.url)
+                    response = await self.client(endpoint).request(method, f"{endpoint.url}{path}", **kwargs)
+                    self.mark_success(endpoint)
+                    return response
+            except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+                # Nothing was sent, so even writes can safely go elsewhere
+                last_error = e
+            except httpx.TransportError as e:
+                if not is_read:
+                    raise
+                last_error = e
+        if last_error is None:
+            raise HTTPException(status_code=503, detail="No Proxmox API endpoint available")
+        raise last_error
+
+    async def authorize(
+        self, csrf_token: str, ticket: str, path: str = "/version", node: Optional[str] = None,
+        params: Optional[Dict[str, Any]] = None,
+    ) -> Any:
+        # One authenticated read proving the caller's ticket (and privileges on `path`)
+        # before shared, cached state is served or changed on its behalf
+        if not ticket:
+            raise HTTPException(status_code=401, detail="Missing ticket")
+        response = await self.request(
+            "GET", path, node=node, params=params,
+            headers={"CSRFPreventionToken": csrf_token}, cookies={"PVEAuthCookie": ticket},
+        )
+        if response.status_code != 200:
+            raise HTTPException(status_code=response.status_code, detail=f"Proxmox rejected the credentials: {response.text}")
+        return response.json().get("data")
+
+    async def check(self, endpoint: Endpoint):
+        # Any HTTP answer (401 included) proves pveproxy is up
+        try:
+            response = await self.pool.client(endpoint.url).get(f"{endpoint.url}/version", timeout=HEALTH_TIMEOUT)
+            if response.status_code >= 500:
+                raise httpx.HTTPError(f"HTTP {response.status_code}")
+            self.mark_success(endpoint)
+        except httpx.HTTPError as e:
+            self.mark_failure(endpoint, str(e) or type(e).__name__, threshold=1)
+
+    async def run_health_checks(self, interval: float = HEALTH_INTERVAL):
+        while True:
+            await asyncio.gather(*(self.check(e) for e in list(self.endpoints.values())))
+            await asyncio.sleep(interval)
@@ -0,0 +1,239 @@
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+import re
+
+DRIVE_CONTROLLERS = ("ide", "sata", "scsi", "virtio")
+# Slots per bus: ide0-3, sata0-5, scsi0-30, virtio0-15
+DRIVE_SLOTS = {"ide": 4, "sata": 6, "scsi": 31, "virtio": 16}
+NIC_MODELS = ("virtio", "e1000", "e1000e", "rtl8139", "vmxnet3", "i82551", "i82557b", "i82559er", "ne2k_isa", "ne2k_pci", "pcnet")
+
+_DRIVE_KEY = re.compile(r"^(ide|sata|scsi|virtio)(\d+)$")
+_NIC_KEY = re.compile(r"^net(\d+)$")
+_UNUSED_KEY = re.compile(r"^unused(\d+)$")
+_SIZE = re.compile(r"^(\d+(?:\.\d+)?)([KMGT]?)$")
+_UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+
+GIB = 1024**3
+_CACHE_SIZE = 2048
+
+
+def parse_size(text: Optional[str]) -> Optional[int]:
+    # PVE sizes are "32G", "512M", "1T" or plain bytes
+    if not text:
+        return None
+    m = _SIZE.match(text.strip().upper())
+    if not m:
+        return None
+    return int(float(m.group(1)) * _UNITS[m.group(2)])
+
+
+def format_size(size: Optional[int]) -> Optional[str]:
+    # Inverse of parse_size, choosing the largest unit that divides evenly
+    if size is None:
+        return None
+    for unit in ("T", "G", "M", "K"):
+        if size and size % _UNITS[unit] == 0:
+            return f"{size // _UNITS[unit]}{unit}"
+    return str(size)
+
+
+def split_volid(volid: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+    # "local-lvm:vm-100-disk-0" -> ("local-lvm", "vm-100-disk-0"); absolute paths have no storage
+    if not volid or ":" not in volid:
+        return None, volid
+    storage, volume = volid.split(":", 1)
+    return storage, volume
+
+
+def _split_options(value: str) -> Tuple[List[str], Dict[str, str]]:
+    bare: List[str] = []
+    options: Dict[str, str] = {}
+    for part in value.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "=" in part:
+            k, v = part.split("=", 1)
+            options[k] = v
+        else:
+            bare.append(part)
+    return bare, options
+
+
+class DiskEntry:
+    __slots__ = ("key", "controller", "index", "volid", "storage", "volume",
+                 "size", "size_text", "format", "media", "options")
+
+    def __init__(self, key: str, controller: str, index: int, volid: Optional[str],
+                 size_text: Optional[str], fmt: Optional[str], media: str, options: Dict[str, str]):
+        self.key = key
+        self.controller = controller
+        self.index = index
+        self.volid = volid
+        self.storage, self.volume = split_volid(volid)
+        self.size_text = size_text
+        self.size = parse_size(size_text)
+        self.format = fmt
+        self.media = media
+        self.options = options
+
+    @property
+    def is_cdrom(self) -> bool:
+        return self.media == "cdrom"
+
+    @property
+    def size_gb(self) -> Optional[int]:
+        return self.size // GIB if self.size is not None else None
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+
+class NicEntry:
+    __slots__ = ("key", "index", "model", "mac", "bridge", "tag", "firewall", "options")
+
+    def __init__(self, key: str, index: int, model: Optional[str], mac: Optional[str], options: Dict[str, str]):
+        self.key = key
+        self.index = index
+        self.model = model
+        self.mac = mac.upper() if mac else None
+        self.bridge = options.get("bridge")
+        self.tag = int(options["tag"]) if options.get("tag", "").isdigit() else None
+        self.firewall = options.get("firewall") == "1"
+        self.options = options
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+
+class UnusedEntry:
+    __slots__ = ("key", "index", "volid", "storage", "volume")
+
+    def __init__(self, key: str, index: int, volid: str):
+        self.key = key
+        self.index = index
+        self.volid = volid
+        self.storage, self.volume = split_volid(volid)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+
+class ParsedConfig:
+    __slots__ = ("digest", "disks", "nics", "unused")
+
+    def __init__(self, digest: Optional[str], disks: List[DiskEntry], nics: List[NicEntry], unused: List[UnusedEntry]):
+        self.digest = digest
+        self.disks = disks
+        self.nics = nics
+        self.unused = unused
+
+    @property
+    def data_disks(self) -> List[DiskEntry]:
+        return [d for d in self.disks if not d.is_cdrom]
+
+    def disk(self, key: str) -> Optional[DiskEntry]:
+        return next((d for d in self.disks if d.key == key), None)
+
+    def volids(self) -> List[str]:
+        return [d.volid for d in self.data_disks if d.volid] + [u.volid for u in self.unused]
+
+
+@lru_cache(maxsize=_CACHE_SIZE)
+def parse_drive(key: str, value: str) -> Optional[DiskEntry]:
+    m = _DRIVE_KEY.match(key)
+    if not m or not isinstance(value, str):
+        return None
+    bare, options = _split_options(value)
+    volid = options.pop("file", None) or (bare[0] if bare else None)
+    return DiskEntry(
+        key, m.group(1), int(m.group(2)), volid,
+        options.get("size"), options.get("format"), options.get("media", "disk"), options,
+    )
+
+
+@lru_cache(maxsize=_CACHE_SIZE)
+def parse_nic(key: str, value: str) -> Optional[NicEntry]:
+    m = _NIC_KEY.match(key)
+    if not m or not isinstance(value, str):
+        return None
+    bare, options = _split_options(value)
+    model = mac = None
+    for name in NIC_MODELS:
+        if name in options:
+            model, mac = name, options.pop(name)
+            break
+    if model is None:
+        model = options.pop("model", None) or (bare[0] if bare else None)
+        mac = options.pop("macaddr", None)
+    return NicEntry(key, int(m.group(1)), model, mac, options)
+
+
+def parse_unused(key: str, value: str) -> Optional[UnusedEntry]:
+    m = _UNUSED_KEY.match(key)
+    if not m or not isinstance(value, str):
+        return None
+    return UnusedEntry(key, int(m.group(1)), value.split(",")[0].strip())
+
+
+_parsed_by_digest: "OrderedDict[str, ParsedConfig]" = OrderedDict()
+
+
+def parse_config(config: Dict[str, Any]) -> ParsedConfig:
+    """
+    Parse the disk, NIC and unused-volume entries of a VM config.
+    Results are memoized by the config digest, so an unchanged VM is parsed once.
+    """
+    digest = config.get("digest")
+    if digest and digest in _parsed_by_digest:
+        _parsed_by_digest.move_to_end(digest)
+        return _parsed_by_digest[digest]
+
+    disks: List[DiskEntry] = []
+    nics: List[NicEntry] = []
+    unused: List[UnusedEntry] = []
+    for key, value in config.items():
+        if not isinstance(value, str):
+            continue
+        if key.startswith("net"):
+            entry = parse_nic(key, value)
+            if entry:
+                nics.append(entry)
+        elif key.startswith("unused"):
+            entry = parse_unused(key, value)
+            if entry:
+                unused.append(entry)
+        elif key.startswith(DRIVE_CONTROLLERS):
+            entry = parse_drive(key, value)
+            if entry:
+                disks.append(entry)
+
+    sort_key = lambda e: (getattr(e, "controller", ""), e.index)
+    parsed = ParsedConfig(digest, sorted(disks, key=sort_key), sorted(nics, key=sort_key), sorted(unused, key=sort_key))
+
+    if digest:
+        _parsed_by_digest[digest] = parsed
+        if len(_parsed_by_digest) > _CACHE_SIZE:
+            _parsed_by_digest.popitem(last=False)
+    return parsed
+
+
+def free_slots(config: Dict[str, Any], controller: str, count: int = 1, start: int = 0) -> List[str]:
+    # Allocate `count` unused "<controller>N" keys in one pass over the config;
+    # ValueError for an unknown controller or a full bus
+    if controller not in DRIVE_SLOTS:
+        raise ValueError(f"Unknown controller '{controller}'. Available: {list(DRIVE_CONTROLLERS)}")
+    used = {
+        int(key[len(controller):]) for key in config
+        if key.startswith(controller) and key[len(controller):].isdigit()
+    }
+    slots: List[str] = []
+    index = start
+    while len(slots) < count:
+        if index >= DRIVE_SLOTS[controller]:
+            raise ValueError(f"Not enough free {controller} slots: {count} needed, {controller}0-{DRIVE_SLOTS[controller] - 1} available")
+        if index not in used:
+            slots.append(f"{controller}{index}")
+        index += 1
+    return slots
@@ -2,6 +2,7 @@ from fastapi import APIRouter, Depends
 from fastapi.responses import RedirectResponse
 from Modules.services.vnc_service import VNCService
 from Modules.services.vm_service import VMService
+from Modules.proxmox_client import PROXMOX_BASE_URL
 import os
 
 router = APIRouter()
@@ -45,7 +46,7 @@ async def get_console(
         session.verify = False
         session.cookies.set("PVEAuthCookie", ticket_decoded)
 
-        config_url = f"https://pve.home.lab:8006/api2/json/nodes/{node}/qemu/{vmid}/config"
+        config_url = f"{PROXMOX_BASE_URL}/nodes/{node}/qemu/{vmid}/config"
         response = session.get(config_url)
 
         if response.status_code == 200:
@@ -1,8 +1,21 @@
 from Modules.logger import init_logger
-from typing import Any
+from Modules.proxmox_client import PROXMOX_BASE_URL, EndpointSet
+from .task_service import wait_for_task
+from fastapi import HTTPException
+from typing import Any, AsyncIterator, Dict, List, Optional
+import asyncio
 import httpx
+import time
 
-PROXMOX_BASE_URL = "https://pve.home.lab:8006/api2/json"
+EXEC_CONCURRENCY = 10
+EXEC_TIMEOUT = 60.0
+# exec-status polling starts fast for quick commands and backs off for long ones
+EXEC_POLL_MIN = 0.1
+EXEC_POLL_MAX = 2.0
+READY_TIMEOUT = 180.0
+# A booting guest needs seconds, so readiness probes back off further than exec polling
+READY_POLL_MIN = 0.5
+READY_POLL_MAX = 5.0
 
 
 class AgentService:
@@ -11,10 +24,11 @@ class AgentService:
         self.logger = init_logger(log_file, __name__)
 
     async def execute_agent_command(
-        self, client: httpx.AsyncClient, node: str, vmid: int, command: str, csrf_token: str, ticket: str
+        self, client: httpx.AsyncClient, node: str, vmid: int, command: str, csrf_token: str, ticket: str,
+        api_url: str = PROXMOX_BASE_URL,
     ) -> Any:
         self.logger.info(f"Executing agent command '{command}' on VMID {vmid}")
-        url = f"{PROXMOX_BASE_URL}/nodes/{node}/qemu/{vmid}/agent"
+        url = f"{api_url}/nodes/{node}/qemu/{vmid}/agent"
         headers = {"CSRFPreventionToken": csrf_token}
         cookies = {"PVEAuthCookie": ticket}
 
@@ -32,8 +46,150 @@ class AgentService:
             self.logger.error(f"Agent command '{command}' failed: {e}")
             return None
 
-    async def get_ip_addresses(self, client: httpx.AsyncClient, node: str, vmid: int, csrf_token: str, ticket: str) -> str:
-        result = await self.execute_agent_command(client, node, vmid, "network-get-interfaces", csrf_token, ticket)
+    async def get_ip_addresses(
+        self, client: httpx.AsyncClient, node: str, vmid: int, csrf_token: str, ticket: str, api_url: str = PROXMOX_BASE_URL
+    ) -> str:
+        result = await self.execute_agent_command(client, node, vmid, "network-get-interfaces", csrf_token, ticket, api_url)
+        return self.format_ip_addresses(result)
+
+    async def get_fsinfo(
+        self, client: httpx.AsyncClient, node: str, vmid: int, csrf_token: str, ticket: str, api_url: str = PROXMOX_BASE_URL
+    ) -> str:
+        result = await self.execute_agent_command(client, node, vmid, "get-fsinfo", csrf_token, ticket, api_url)
+        return self.format_fsinfo(result)
+
+    async def guest_exec(
+        self, client: httpx.AsyncClient, node: str, vmid: int, command: List[str], csrf_token: str, ticket: str,
+        input_data: Optional[str] = None, timeout: float = EXEC_TIMEOUT, api_url: str = PROXMOX_BASE_URL,
+    ) -> Dict[str, Any]:
+        self.logger.info(f"Running guest-exec {command} on VMID {vmid}")
+        url = f"{api_url}/nodes/{node}/qemu/{vmid}/agent"
+        headers = {"CSRFPreventionToken": csrf_token}
+        cookies = {"PVEAuthCookie": ticket}
+        result: Dict[str, Any] = {"vmid": vmid, "node": node, "exitcode": None, "stdout": "", "stderr": "", "error": None}
+        started = time.monotonic()
+
+        try:
+            data: Dict[str, Any] = {"command": command}
+            if input_data is not None:
+                data["input-data"] = input_data
+            response = await client.post(f"{url}/exec", data=data, headers=headers, cookies=cookies)
+            response.raise_for_status()
+            pid = response.json()["data"]["pid"]
+
+            delay = EXEC_POLL_MIN
+            while True:
+                await asyncio.sleep(delay)
+                response = await client.get(f"{url}/exec-status", params={"pid": pid}, headers=headers, cookies=cookies)
+                response.raise_for_status()
+                status = response.json().get("data", {})
+                if status.get("exited"):
+                    break
+                if time.monotonic() - started > timeout:
+                    result["error"] = f"Still running after {timeout:.0f}s (pid {pid})"
+                    break
+                delay = min(delay * 2, EXEC_POLL_MAX)
+
+            result["exitcode"] = status.get("exitcode")
+            # Proxmox already decodes the agent's base64 output
+            result["stdout"] = status.get("out-data", "")
+            result["stderr"] = status.get("err-data", "")
+            result["truncated"] = bool(status.get("out-truncated") or status.get("err-truncated"))
+        except (httpx.HTTPError, KeyError, TypeError) as e:
+            self.logger.error(f"guest-exec on VMID {vmid} failed: {e}")
+            result["error"] = str(e)
+
+        result["duration"] = round(time.monotonic() - started, 3)
+        return result
+
+    async def run_fleet_exec(
+        self, endpoints: EndpointSet, vms: List[Dict[str, Any]], command: List[str], csrf_token: str, ticket: str,
+        input_data: Optional[str] = None, timeout: float = EXEC_TIMEOUT, concurrency: int = EXEC_CONCURRENCY,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        # Yields each VM's result as soon as it finishes, not in selection order
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def run(vm: Dict[str, Any]) -> Dict[str, Any]:
+            async with semaphore:
+                if vm.get("status") != "running":
+                    return {"vmid": vm["vmid"], "node": vm["node"], "exitcode": None, "error": "VM is not running"}
+                async with endpoints.lease(vm["node"]) as endpoint:
+                    result = await self.guest_exec(
+                        endpoints.client(endpoint), vm["node"], vm["vmid"], command, csrf_token, ticket,
+                        input_data, timeout, endpoint.url,
+                    )
+                result["name"] = vm.get("name")
+                return result
+
+        self.logger.info(f"Running {command} on {len(vms)} VMs, {concurrency} at a time")
+        for finished in asyncio.as_completed([run(vm) for vm in vms]):
+            yield await finished
+
+    async def wait_until_ready(
+        self, client: httpx.AsyncClient, node: str, vmid: int, upid: Any, csrf_token: str, ticket: str,
+        timeout: float = READY_TIMEOUT, api_url: str = PROXMOX_BASE_URL,
+    ) -> Dict[str, Any]:
+        # Follow the start/reboot task, then probe guest-ping until the agent answers and reports its interfaces
+        headers = {"CSRFPreventionToken": csrf_token}
+        cookies = {"PVEAuthCookie": ticket}
+        started = time.monotonic()
+        deadline = started + timeout
+
+        if isinstance(upid, str) and upid.startswith("UPID:"):
+            task = await wait_for_task(client, node, upid, headers, cookies, timeout=timeout, api_url=api_url)
+            if task.get("exitstatus") != "OK":
+                raise HTTPException(status_code=500, detail=f"Task failed: {task.get('exitstatus')}")
+            self.logger.info(f"Task {upid} finished, waiting for guest agent on VMID {vmid}")
+
+        url = f"{api_url}/nodes/{node}/qemu/{vmid}/agent"
+        agent_up = False
+        ips: List[str] = []
+        delay = READY_POLL_MIN
+        while time.monotonic() + delay < deadline:
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, READY_POLL_MAX)
+            if not agent_up:
+                try:
+                    response = await client.post(f"{url}/ping", headers=headers, cookies=cookies)
+                except httpx.HTTPError:
+                    continue
+                if response.status_code != 200:
+                    continue
+                agent_up = True
+                self.logger.info(f"Guest agent on VMID {vmid} answered after {time.monotonic() - started:.1f}s")
+                # DHCP usually follows within a second or two of the agent starting
+                delay = READY_POLL_MIN
+            interfaces = await self.execute_agent_command(client, node, vmid, "network-get-interfaces", csrf_token, ticket, api_url)
+            ips = self.list_ip_addresses(interfaces)
+            # A guest without addresses (static setup pending, no NIC) is still ready; don't wait out the deadline
+            if interfaces is not None:
+                break
+
+        if not agent_up:
+            raise HTTPException(status_code=504, detail=f"Guest agent on VMID {vmid} did not answer within {timeout:.0f}s")
+        return {
+            "vmid": vmid,
+            "upid": upid,
+            "agent": agent_up,
+            "ip_addresses": ips,
+            "ip": ips[0] if ips else None,
+            "elapsed": round(time.monotonic() - started, 3),
+        }
+
+    def list_ip_addresses(self, result: Any) -> List[str]:
+        # Routable guest addresses, IPv4 first; loopback and link-local are skipped
+        if not isinstance(result, dict) or "result" not in result:
+            return []
+        ips = [
+            ip
+            for iface in result["result"]
+            for ip in iface.get("ip-addresses", [])
+            if not ip.get("ip-address", "").startswith(("127.", "::1", "fe80:", "169.254."))
+        ]
+        ips.sort(key=lambda ip: ip.get("ip-address-type") != "ipv4")
+        return [ip["ip-address"] for ip in ips]
+
+    def format_ip_addresses(self, result: Any) -> str:
         if isinstance(result, dict) and "result" in result:
             net = result["result"]
             ips = [
@@ -45,8 +201,9 @@ class AgentService:
             return ", ".join(ips) if ips else "No IPv4"
         return "N/A"
 
-    async def get_fsinfo(self, client: httpx.AsyncClient, node: str, vmid: int, csrf_token: str, ticket: str) -> str:
-        result = await self.execute_agent_command(client, node, vmid, "get-fsinfo", csrf_token, ticket)
+    def format_fsinfo(self, result: Any) -> str:
+        if isinstance(result, dict) and "result" in result:
+            result = result["result"]
         if isinstance(result, list):
             try:
                 return ", ".join(
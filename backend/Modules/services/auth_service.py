@@ -4,9 +4,7 @@ import logging
 import urllib3
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 from Modules.logger import init_logger
-
-
-PROXMOX_BASE_URL = "https://pve.home.lab:8006/api2/json"
+from Modules.proxmox_client import PROXMOX_BASE_URL
 
 
 class AuthService:
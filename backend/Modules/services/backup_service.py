@@ -0,0 +1,273 @@
+from Modules.logger import init_logger
+from Modules.proxmox_client import EndpointSet
+from .task_registry import TaskRegistry
+from .lock_manager import VMLockManager
+from .cluster_service import ClusterService
+from .fleet_snapshot_service import FleetJob
+from fastapi import HTTPException
+from typing import Any, Dict, List, Optional, Set
+import threading
+import itertools
+import asyncio
+import sqlite3
+import time
+import re
+
+STORAGE_CONCURRENCY = 2
+BACKUP_TIMEOUT = 6 * 3600.0
+TASK_LOG_LIMIT = 5000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS backups (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    upid TEXT,
+    vmid INTEGER NOT NULL,
+    node TEXT NOT NULL,
+    storage TEXT NOT NULL,
+    mode TEXT,
+    status TEXT NOT NULL,
+    error TEXT,
+    archive TEXT,
+    size INTEGER,
+    duration REAL,
+    throughput REAL,
+    queued_at REAL NOT NULL,
+    started_at REAL,
+    ended_at REAL
+);
+CREATE INDEX IF NOT EXISTS backups_vmid ON backups (vmid);
+CREATE INDEX IF NOT EXISTS backups_storage ON backups (storage, started_at);
+"""
+
+_ARCHIVE = re.compile(r"creating (?:vzdump )?archive '([^']+)'")
+_ARCHIVE_SIZE = re.compile(r"archive file size: ([\d.]+)\s*([KMGT]?)i?B", re.IGNORECASE)
+_UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+
+
+def parse_vzdump_log(lines: List[str]) -> Dict[str, Any]:
+    # vzdump reports the archive path and its final size in the task log
+    info: Dict[str, Any] = {"archive": None, "size": None}
+    for line in lines:
+        m = _ARCHIVE.search(line)
+        if m:
+            info["archive"] = m.group(1)
+        m = _ARCHIVE_SIZE.search(line)
+        if m:
+            info["size"] = int(float(m.group(1)) * _UNITS[m.group(2).upper()])
+    return info
+
+
+class StorageQueue:
+    """FIFO slots for one backup storage; the limit can change while work is queued."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.running = 0
+        self.waiting = 0
+        self.condition = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self.condition:
+            self.waiting += 1
+            try:
+                await self.condition.wait_for(lambda: self.running < self.limit)
+            finally:
+                self.waiting -= 1
+            self.running += 1
+
+    async def __aexit__(self, *exc):
+        async with self.condition:
+            self.running -= 1
+            self.condition.notify_all()
+
+    async def set_limit(self, limit: int):
+        async with self.condition:
+            self.limit = limit
+            self.condition.notify_all()
+
+    def as_dict(self) -> Dict[str, int]:
+        return {"limit": self.limit, "running": self.running, "waiting": self.waiting}
+
+
+class BackupService:
+    """
+    Runs vzdump for sets of VMs, queued per backup storage with a concurrency
+    limit and optional bandwidth cap. Each run's UPID, duration, archive size
+    and throughput are recorded so the schedule can be fitted to the backup window.
+    """
+
+    def __init__(
+        self, log_file: str, db_path: str, endpoints: EndpointSet, cluster: ClusterService,
+        registry: TaskRegistry, locks: VMLockManager,
+    ):
+        self.log_file = log_file
+        self.logger = init_logger(log_file, __name__)
+        self.endpoints = endpoints
+        self.cluster = cluster
+        self.registry = registry
+        self.locks = locks
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(SCHEMA)
+        self.queues: Dict[str, StorageQueue] = {}
+        self.jobs: Dict[int, FleetJob] = {}
+        self.ids = itertools.count(1)
+
+    def queue(self, storage: str) -> StorageQueue:
+        if storage not in self.queues:
+            self.queues[storage] = StorageQueue(STORAGE_CONCURRENCY)
+        return self.queues[storage]
+
+    async def set_storage_limit(self, storage: str, limit: int) -> Dict[str, int]:
+        await self.queue(storage).set_limit(limit)
+        self.logger.info(f"Backup concurrency for storage {storage} set to {limit}")
+        return self.queue(storage).as_dict()
+
+    def _update(self, run_id: int, **fields):
+        columns = ", ".join(f"{k} = ?" for k in fields)
+        with self.lock, self.db:
+            self.db.execute(f"UPDATE backups SET {columns} WHERE id = ?", (*fields.values(), run_id))
+
+    def list_runs(
+        self, vmid: Optional[int] = None, storage: Optional[str] = None, status: Optional[str] = None,
+        limit: int = 100, offset: int = 0,
+    ) -> List[Dict[str, Any]]:
+        clauses, params = [], []
+        for column, value in (("vmid", vmid), ("storage", storage), ("status", status)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self.lock:
+            rows = self.db.execute(
+                f"SELECT * FROM backups {where} ORDER BY queued_at DESC LIMIT ? OFFSET ?",
+                (*params, limit, offset),
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    async def _task_log(self, node: str, upid: str, csrf_token: str, ticket: str) -> List[str]:
+        response = await self.endpoints.request(
+            "GET", f"/nodes/{node}/tasks/{upid}/log", node=node, params={"limit": TASK_LOG_LIMIT},
+            headers={"CSRFPreventionToken": csrf_token}, cookies={"PVEAuthCookie": ticket},
+        )
+        if response.status_code != 200:
+            return []
+        return [entry.get("t", "") for entry in response.json().get("data", [])]
+
+    async def _final_status(self, node: str, upid: str, csrf_token: str, ticket: str) -> Optional[Dict[str, Any]]:
+        # Read with the caller's own ticket; if it expired meanwhile the outcome stays unknown, not failed
+        try:
+            response = await self.endpoints.request(
+                "GET", f"/nodes/{node}/tasks/{upid}/status", node=node,
+                headers={"CSRFPreventionToken": csrf_token}, cookies={"PVEAuthCookie": ticket},
+            )
+        except Exception as e:
+            self.logger.warning(f"Could not read the final status of {upid}: {e}")
+            return None
+        if response.status_code != 200:
+            self.logger.warning(f"Could not read the final status of {upid}: {response.status_code} {response.text}")
+            return None
+        return response.json().get("data")
+
+    async def _backup_one(
+        self, vm: Dict[str, Any], storage: str, mode: str, compress: str, bwlimit: Optional[int],
+        csrf_token: str, ticket: str, result: Dict[str, Any],
+    ):
+        node, vmid = vm["node"], vm["vmid"]
+        with self.lock, self.db:
+            run_id = self.db.execute(
+                "INSERT INTO backups (vmid, node, storage, mode, status, queued_at) VALUES (?, ?, ?, ?, 'queued', ?)",
+                (vmid, node, storage, mode, time.time()),
+            ).lastrowid
+        result["run_id"] = run_id
+
+        data: Dict[str, Any] = {"vmid": vmid, "storage": storage, "mode": mode, "compress": compress}
+        if bwlimit:
+            data["bwlimit"] = bwlimit  # KiB/s
+        # Storage slot first, then the VM lock so the backup does not collide with snapshot work on the VM
+        async with self.queue(storage), self.locks.hold(vmid, "vzdump"):
+            result["status"] = "running"
+            started = time.time()
+            self._update(run_id, status="running", started_at=started)
+            try:
+                response = await self.endpoints.request(
+                    "POST", f"/nodes/{node}/vzdump", node=node, data=data,
+                    headers={"CSRFPreventionToken": csrf_token}, cookies={"PVEAuthCookie": ticket},
+                )
+                if response.status_code != 200:
+                    raise HTTPException(status_code=response.status_code, detail=f"vzdump failed to start: {response.text}")
+                upid = response.json().get("data")
+                result["upids"].append(upid)
+                self._update(run_id, upid=upid)
+                self.registry.record(upid, csrf_token, ticket, vmid)
+                task = await self.registry.wait(upid, timeout=BACKUP_TIMEOUT)
+            except HTTPException as e:
+                self._update(run_id, status="failed", error=e.detail, ended_at=time.time())
+                raise
+            except Exception as e:
+                # Transport errors too, or the run row would stay "running" forever
+                self._update(run_id, status="failed", error=str(e), ended_at=time.time())
+                raise
+
+        if task is None or task["status"] == "running":
+            # The local store only knows what the poller could see; ask Proxmox before calling it a failure
+            task = await self._final_status(node, upid, csrf_token, ticket)
+            if task is None or task.get("status") == "running":
+                error = "Still running" if task else "Outcome unknown: the task status could not be read"
+                self._update(run_id, status="unknown", error=error)
+                result.update(status="unknown", error=error)
+                return
+
+        ended = time.time()
+        duration = (task["endtime"] - task["starttime"]) if task.get("endtime") else ended - started
+        try:
+            log = await self._task_log(node, upid, csrf_token, ticket)
+        except Exception as e:
+            self.logger.warning(f"Could not read the log of {upid}: {e}")
+            log = []
+        info = parse_vzdump_log(log)
+        throughput = info["size"] / duration if info["size"] and duration else None
+        ok = task["exitstatus"] == "OK"
+        self._update(
+            run_id, status="done" if ok else "failed", error=None if ok else task["exitstatus"],
+            archive=info["archive"], size=info["size"], duration=duration, throughput=throughput, ended_at=ended,
+        )
+        result.update(duration=duration, size=info["size"], throughput=throughput)
+        if not ok:
+            raise HTTPException(status_code=500, detail=f"Backup failed: {task['exitstatus']}")
+
+    async def backup(
+        self, csrf_token: str, ticket: str, storage: str,
+        vmids: Optional[List[int]] = None, tag: Optional[str] = None, pool: Optional[str] = None,
+        mode: str = "snapshot", compress: str = "zstd", bwlimit: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        vms = await self.cluster.select_vms(csrf_token, ticket, vmids, tag, pool)
+        job = FleetJob(next(self.ids), "backup", vms)
+        self.logger.info(f"Backing up {len(vms)} VMs to {storage} ({mode}, bwlimit={bwlimit})")
+
+        async def run_one(vm: Dict[str, Any]):
+            result = job.results[vm["vmid"]]
+            try:
+                await self._backup_one(vm, storage, mode, compress, bwlimit, csrf_token, ticket, result)
+                if result["status"] != "unknown":
+                    result["status"] = "done"
+            except HTTPException as e:
+                result["status"], result["error"] = "failed", e.detail
+            except Exception as e:
+                result["status"], result["error"] = "failed", str(e)
+
+        async def run_all():
+            await asyncio.gather(*(run_one(vm) for vm in vms))
+            job.finished_at = time.time()
+            self.logger.info(f"Backup job {job.id} to {storage} finished: {job.as_dict()['counts']}")
+
+        job.task = asyncio.create_task(run_all())
+        self.jobs[job.id] = job
+        return dict(job.as_dict(), storage=storage)
+
+    def get_job(self, job_id: int, visible: Optional[Set[int]] = None) -> Dict[str, Any]:
+        job = self.jobs.get(job_id)
+        if job is None or (visible is not None and not visible & job.results.keys()):
+            raise HTTPException(status_code=404, detail=f"Backup job {job_id} not found")
+        return job.as_dict(visible)
@@ -0,0 +1,138 @@
+from Modules.logger import init_logger
+from Modules.proxmox_client import PROXMOX_BASE_URL
+from Modules.pve_config import GIB
+from fastapi import HTTPException
+from typing import Any, Dict, List, Optional
+import requests
+import urllib3
+import time
+
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+STORAGE_TTL = 30.0
+# Content listings are only re-fetched when the storage's usage moved, or after this long
+CONTENT_TTL = 300.0
+
+
+class CatalogService:
+    """
+    Cached index of storages, their free capacity and their content (ISOs,
+    container templates, images) per node, so requests can be validated locally
+    before Proxmox starts a task. Entries are kept per ticket, since what
+    Proxmox lists depends on the caller's privileges.
+    """
+
+    def __init__(self, log_file: str):
+        self.session = requests.Session()
+        self.session.verify = False
+
+        self.log_file = log_file
+        self.logger = init_logger(log_file, __name__)
+        # (ticket, node) -> {"fetched_at": float, "storages": {storage_id: entry}}
+        self.storages: Dict[tuple, Dict[str, Any]] = {}
+        # (ticket, node, storage_id) -> {"fetched_at": float, "used": int, "items": [...]}
+        self.contents: Dict[tuple, Dict[str, Any]] = {}
+
+    def _get(self, path: str, csrf_token: str, ticket: str, params: Optional[dict] = None) -> Any:
+        # Cookie per request: callers run this from worker threads with different tickets
+        response = self.session.get(
+            f"{PROXMOX_BASE_URL}{path}",
+            params=params,
+            headers={"CSRFPreventionToken": csrf_token},
+            cookies={"PVEAuthCookie": ticket},
+        )
+        if response.status_code != 200:
+            self.logger.error(f"Catalog request {path} failed: {response.status_code} {response.text}")
+            raise HTTPException(status_code=response.status_code, detail=f"Failed to fetch {path}")
+        return response.json().get("data", [])
+
+    def get_storages(self, node: str, csrf_token: str, ticket: str, refresh: bool = False) -> Dict[str, Dict[str, Any]]:
+        cached = self.storages.get((ticket, node))
+        if not refresh and cached and time.monotonic() - cached["fetched_at"] < STORAGE_TTL:
+            return cached["storages"]
+
+        self.logger.info(f"Refreshing storage catalog for node {node}")
+        storages = {
+            entry["storage"]: {
+                "storage": entry["storage"],
+                "type": entry.get("type"),
+                "content": entry.get("content", "").split(",") if entry.get("content") else [],
+                "shared": bool(entry.get("shared", 0)),
+                "active": bool(entry.get("active", 0)),
+                "enabled": bool(entry.get("enabled", 1)),
+                "total": entry.get("total", 0),
+                "used": entry.get("used", 0),
+                "avail": entry.get("avail", 0),
+            }
+            for entry in self._get(f"/nodes/{node}/storage", csrf_token, ticket)
+        }
+        now = time.monotonic()
+        # Expired tickets' entries are dropped as new ones come in
+        for key in [k for k, v in self.storages.items() if now - v["fetched_at"] >= STORAGE_TTL]:
+            del self.storages[key]
+        self.storages[(ticket, node)] = {"fetched_at": now, "storages": storages}
+        return storages
+
+    def get_storage(self, node: str, storage: str, csrf_token: str, ticket: str) -> Dict[str, Any]:
+        storages = self.get_storages(node, csrf_token, ticket)
+        if storage not in storages:
+            raise HTTPException(status_code=404, detail=f"Storage '{storage}' does not exist on node {node}")
+        return storages[storage]
+
+    def get_content(
+        self, node: str, storage: str, csrf_token: str, ticket: str,
+        content: Optional[str] = None, refresh: bool = False,
+    ) -> List[Dict[str, Any]]:
+        info = self.get_storage(node, storage, csrf_token, ticket)
+        key = (ticket, node, storage)
+        cached = self.contents.get(key)
+        fresh = (
+            cached is not None
+            and cached["used"] == info["used"]
+            and time.monotonic() - cached["fetched_at"] < CONTENT_TTL
+        )
+        if refresh or not fresh:
+            self.logger.info(f"Refreshing content listing of {storage} on node {node}")
+            items = self._get(f"/nodes/{node}/storage/{storage}/content", csrf_token, ticket)
+            now = time.monotonic()
+            for old in [k for k, v in self.contents.items() if now - v["fetched_at"] >= CONTENT_TTL]:
+                del self.contents[old]
+            cached = self.contents[key] = {"fetched_at": now, "used": info["used"], "items": items}
+        items = cached["items"]
+        return [item for item in items if item.get("content") == content] if content else items
+
+    def find_content(self, node: str, content: str, csrf_token: str, ticket: str) -> List[Dict[str, Any]]:
+        found = []
+        for storage, info in self.get_storages(node, csrf_token, ticket).items():
+            if content in info["content"] and info["active"]:
+                found.extend(self.get_content(node, storage, csrf_token, ticket, content))
+        return found
+
+    def invalidate(self, node: str, storage: Optional[str] = None):
+        # Called after the backend itself changed a storage, so the next lookup re-reads it
+        for key in [k for k in self.storages if k[1] == node]:
+            del self.storages[key]
+        for key in [k for k in self.contents if k[1] == node and (storage is None or k[2] == storage)]:
+            del self.contents[key]
+
+    def check_capacity(self, node: str, storage: str, size_bytes: int, csrf_token: str, ticket: str) -> Dict[str, Any]:
+        info = self.get_storage(node, storage, csrf_token, ticket)
+        if not info["enabled"] or not info["active"]:
+            raise HTTPException(status_code=400, detail=f"Storage '{storage}' is not active on node {node}")
+        if "images" not in info["content"]:
+            raise HTTPException(status_code=400, detail=f"Storage '{storage}' does not hold VM disk images")
+        if size_bytes > info["avail"]:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Storage '{storage}' has {info['avail'] / GIB:.1f} GB free, {size_bytes / GIB:.1f} GB requested",
+            )
+        return info
+
+    def check_volume(self, node: str, volid: str, csrf_token: str, ticket: str) -> Dict[str, Any]:
+        storage = volid.split(":", 1)[0]
+        # A miss may just be a stale listing, so look once more with a fresh one
+        for refresh in (False, True):
+            for item in self.get_content(node, storage, csrf_token, ticket, refresh=refresh):
+                if item.get("volid") == volid:
+                    return item
+        raise HTTPException(status_code=404, detail=f"Volume '{volid}' not found on storage '{storage}'")
@@ -0,0 +1,119 @@
+from Modules.logger import init_logger
+from Modules.proxmox_client import PROXMOX_BASE_URL, EndpointSet, api_url
+from .vm_service import VMService
+from fastapi import HTTPException
+from typing import Any, Dict, List, Optional
+import asyncio
+import time
+
+NODE_CACHE_TTL = 60.0
+NODE_TIMEOUT = 15.0
+
+
+class ClusterService:
+    def __init__(self, log_file: str, endpoints: EndpointSet):
+        self.log_file = log_file
+        self.logger = init_logger(log_file, __name__)
+        self.endpoints = endpoints
+        self.vm_service = VMService(log_file)
+        self.nodes: List[Dict[str, Any]] = []
+        self.nodes_fetched_at = 0.0
+
+    async def get_nodes(self, csrf_token: str, ticket: str, refresh: bool = False) -> List[Dict[str, Any]]:
+        if not refresh and self.nodes and time.monotonic() - self.nodes_fetched_at < NODE_CACHE_TTL:
+            return self.nodes
+
+        self.logger.info("Discovering cluster nodes")
+        response = await self.endpoints.request(
+            "GET",
+            "/cluster/status",
+            headers={"CSRFPreventionToken": csrf_token},
+            cookies={"PVEAuthCookie": ticket},
+        )
+        if response.status_code != 200:
+            self.logger.error(f"Failed to fetch cluster status: {response.text}")
+            raise HTTPException(status_code=response.status_code, detail="Failed to fetch cluster status")
+
+        self.nodes = [
+            {
+                "name": entry["name"],
+                "ip": entry.get("ip"),
+                "online": bool(entry.get("online", 0)),
+                "local": bool(entry.get("local", 0)),
+                # Talk to each node's own pveproxy rather than funnelling everything through one host
+                "api_url": api_url(entry["ip"]) if entry.get("ip") else PROXMOX_BASE_URL,
+            }
+            for entry in response.json().get("data", [])
+            if entry.get("type") == "node"
+        ]
+        self.nodes_fetched_at = time.monotonic()
+        self.endpoints.update_nodes(self.nodes, self.endpoints.endpoint_for(str(response.url)))
+        self.logger.info(f"Discovered nodes: {[n['name'] for n in self.nodes]}")
+        return self.nodes
+
+    async def node_api_url(self, node: str, csrf_token: str, ticket: str) -> str:
+        for entry in await self.get_nodes(csrf_token, ticket):
+            if entry["name"] == node:
+                return entry["api_url"]
+        return PROXMOX_BASE_URL
+
+    async def select_vms(
+        self, csrf_token: str, ticket: str,
+        vmids: Optional[List[int]] = None, tag: Optional[str] = None, pool: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        # Fleet operations target every QEMU VM matching all given selectors
+        if not vmids and not tag and not pool:
+            raise HTTPException(status_code=400, detail="Select VMs by vmids, tag or pool")
+        response = await self.endpoints.request(
+            "GET",
+            "/cluster/resources",
+            params={"type": "vm"},
+            headers={"CSRFPreventionToken": csrf_token},
+            cookies={"PVEAuthCookie": ticket},
+        )
+        if response.status_code != 200:
+            self.logger.error(f"Failed to fetch cluster resources: {response.text}")
+            raise HTTPException(status_code=response.status_code, detail="Failed to fetch cluster resources")
+        selected = [
+            r for r in response.json().get("data", [])
+            if r.get("type") == "qemu" and not r.get("template")
+            and (not vmids or r["vmid"] in vmids)
+            and (not tag or tag in (r.get("tags") or "").split(";"))
+            and (not pool or r.get("pool") == pool)
+        ]
+        if not selected:
+            raise HTTPException(status_code=404, detail="No VMs match the selection")
+        return sorted(selected, key=lambda r: r["vmid"])
+
+    async def get_all_vms(self, csrf_token: str, ticket: str) -> Dict[str, Any]:
+        nodes = await self.get_nodes(csrf_token, ticket)
+
+        async def fetch_node(entry: Dict[str, Any]):
+            name = entry["name"]
+            if not entry["online"]:
+                return name, {"vms": [], "error": "Node offline"}
+            try:
+                # Prefers the node's own endpoint, falling back to any healthy member
+                async with self.endpoints.lease(name) as endpoint:
+                    vms = await asyncio.wait_for(
+                        self.vm_service.get_vms(
+                            name, csrf_token, ticket, strict=True,
+                            api_url=endpoint.url, client=self.endpoints.client(endpoint),
+                        ),
+                        NODE_TIMEOUT,
+                    )
+            except asyncio.TimeoutError:
+                self.logger.warning(f"Listing VMs on node {name} timed out after {NODE_TIMEOUT}s")
+                return name, {"vms": [], "error": f"Timed out after {NODE_TIMEOUT}s"}
+            except Exception as e:
+                self.logger.warning(f"Listing VMs on node {name} failed: {e}")
+                return name, {"vms": [], "error": str(e)}
+            for vm in vms:
+                vm["node"] = name
+            return name, {"vms": vms, "error": None}
+
+        results = dict(await asyncio.gather(*(fetch_node(entry) for entry in nodes)))
+        return {
+            "vms": [vm for result in results.values() for vm in result["vms"]],
+            "nodes": results,
+        }
@@ -1,28 +1,74 @@
-from Modules.Disk.disk_add import add_disk
-from Modules.Disk.disk_delete import delete_disk
+from Modules.Disk.disk_add import add_disk, add_disks
+from Modules.Disk.disk_delete import delete_disk, delete_disks
 from Modules.Disk.disk_activate import activate_unused_disk
 from Modules.Disk.disk_expand import expand_disk
 from Modules.logger import init_logger
+from Modules.pve_config import GIB
+from fastapi import HTTPException
 
 
 class DiskService:
-    def __init__(self, log_file):
+    def __init__(self, log_file, catalog=None):
         self.log_file = log_file
         self.logger = init_logger(log_file, __name__)
+        self.catalog = catalog
 
-    def add_disk(self, node, vmid, req, csrf_token, ticket):
+    def _check_capacity(self, node, reqs, csrf_token, ticket):
+        if not self.catalog:
+            return
+        per_storage = {}
+        for req in reqs:
+            per_storage[req.storage] = per_storage.get(req.storage, 0) + req.size * GIB
+        for storage, size in per_storage.items():
+            self.catalog.check_capacity(node, storage, size, csrf_token, ticket)
+
+    def _storage_types(self, node, storages, csrf_token, ticket):
+        # Storage type decides the disk format; unknown without a catalog, which keeps the requested one
+        types = {}
+        if not self.catalog:
+            return types
+        for storage in set(storages):
+            try:
+                types[storage] = self.catalog.get_storage(node, storage, csrf_token, ticket).get("type")
+            except HTTPException:
+                continue
+        return types
+
+    def _invalidate(self, node):
+        if self.catalog:
+            self.catalog.invalidate(node)
+
+    def add_disk(self, node, vmid, req, csrf_token, ticket, digest=None):
         self.logger.info(f"Adding disk to VM {vmid} on node {node}")
-        return add_disk(node, vmid, req, csrf_token, ticket, self.log_file)
+        self._check_capacity(node, [req], csrf_token, ticket)
+        types = self._storage_types(node, [req.storage], csrf_token, ticket)
+        result = add_disk(node, vmid, req, csrf_token, ticket, self.log_file, digest, types)
+        self._invalidate(node)
+        return result
+
+    def add_disks(self, node, vmid, reqs, csrf_token, ticket, digest=None):
+        self.logger.info(f"Adding {len(reqs)} disks to VM {vmid} on node {node}")
+        self._check_capacity(node, reqs, csrf_token, ticket)
+        types = self._storage_types(node, [req.storage for req in reqs], csrf_token, ticket)
+        result = add_disks(node, vmid, reqs, csrf_token, ticket, self.log_file, digest, types)
+        self._invalidate(node)
+        return result
         
-    def delete_disk(self, node, vmid, disk_key, csrf_token, ticket):
+    async def delete_disk(self, node, vmid, disk_key, csrf_token, ticket, digest=None):
         self.logger.info(f"Deleting disk {disk_key} from VM {vmid} on node {node}")
-        return delete_disk(node, vmid, disk_key, csrf_token, ticket, self.log_file)
+        return await delete_disk(node, vmid, disk_key, csrf_token, ticket, self.log_file, digest)
+
+    async def delete_disks(self, node, vmid, disk_keys, csrf_token, ticket, digest=None):
+        self.logger.info(f"Deleting disks {disk_keys} from VM {vmid} on node {node}")
+        return await delete_disks(node, vmid, disk_keys, csrf_token, ticket, self.log_file, digest)
 
-    async def activate_unused_disk(self, node, vmid, unused_key, target_controller, csrf_token, ticket):
+    async def activate_unused_disk(self, node, vmid, unused_key, target_controller, csrf_token, ticket, digest=None, profile=None):
         self.logger.info(f"Activating unused disk {unused_key} for VM {vmid} on node {node}")
-        return await activate_unused_disk(node, vmid, unused_key, target_controller, csrf_token, ticket, self.log_file)
+        return await activate_unused_disk(node, vmid, unused_key, target_controller, csrf_token, ticket, self.log_file, digest, profile)
     
-    def expand_disk(self, node, vmid, disk_key, new_size_gb, csrf_token, ticket):
+    def expand_disk(self, node, vmid, disk_key, new_size_gb, csrf_token, ticket, digest=None):
         self.logger.info(f"Expanding disk {disk_key} for VM {vmid} on node {node} to {new_size_gb} GB")
-        return expand_disk(node, vmid, disk_key, new_size_gb, csrf_token, ticket, self.log_file)
+        result = expand_disk(node, vmid, disk_key, new_size_gb, csrf_token, ticket, self.log_file, digest, self.catalog)
+        self._invalidate(node)
+        return result
     
\ No newline at end of file
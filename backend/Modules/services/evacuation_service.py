@@ -0,0 +1,192 @@
+from Modules.logger import init_logger
+from Modules.proxmox_client import EndpointSet
+from Modules.pve_config import parse_config
+from .task_registry import TaskRegistry
+from .lock_manager import VMLockManager
+from .placement_service import PlacementService
+from .fleet_snapshot_service import FleetJob
+from fastapi import HTTPException
+from typing import Any, Dict, Optional, Set
+import itertools
+import asyncio
+import time
+
+MIGRATION_CONCURRENCY = 2
+CONFIG_CONCURRENCY = 8
+MIGRATION_TIMEOUT = 4 * 3600.0
+MAX_RETRIES = 2
+MAX_JOBS = 50
+RETRY_DELAY = 15.0
+
+
+class EvacuationService:
+    """
+    Drains a node by migrating every VM to targets chosen by the placement
+    service, a few at a time, with an optional per-migration bandwidth limit.
+    Failed migrations are retried on a different target.
+    """
+
+    def __init__(
+        self, log_file: str, endpoints: EndpointSet, placement: PlacementService,
+        registry: TaskRegistry, locks: VMLockManager,
+    ):
+        self.log_file = log_file
+        self.logger = init_logger(log_file, __name__)
+        self.endpoints = endpoints
+        self.placement = placement
+        self.registry = registry
+        self.locks = locks
+        self.jobs: Dict[int, FleetJob] = {}
+        self.ids = itertools.count(1)
+
+    async def _request(self, method: str, path: str, csrf_token: str, ticket: str, node: Optional[str] = None, **kwargs) -> Any:
+        response = await self.endpoints.request(
+            method, path, node=node,
+            headers={"CSRFPreventionToken": csrf_token}, cookies={"PVEAuthCookie": ticket}, **kwargs,
+        )
+        if response.status_code != 200:
+            raise HTTPException(status_code=response.status_code, detail=f"{method} {path} failed: {response.text}")
+        return response.json().get("data")
+
+    async def _locate(self, vmid: int, csrf_token: str, ticket: str) -> Dict[str, Any]:
+        resources = await self._request("GET", "/cluster/resources", csrf_token, ticket, params={"type": "vm"})
+        for r in resources:
+            if r.get("vmid") == vmid:
+                return r
+        raise HTTPException(status_code=404, detail=f"VM {vmid} not found")
+
+    async def _settle(self, vm: Dict[str, Any], csrf_token: str, ticket: str) -> Dict[str, Any]:
+        # A timed-out or dropped attempt may still be migrating: wait out any task on the VM, then report where it is
+        current = await self._locate(vm["vmid"], csrf_token, ticket)
+        active = await self._request(
+            "GET", f"/nodes/{current['node']}/tasks", csrf_token, ticket, node=current["node"],
+            params={"vmid": vm["vmid"], "source": "active"},
+        )
+        for task in active or []:
+            self.registry.record(task["upid"], csrf_token, ticket, vm["vmid"])
+            finished = await self.registry.wait(task["upid"], timeout=MIGRATION_TIMEOUT)
+            if finished is None or finished["status"] == "running":
+                raise HTTPException(status_code=504, detail=f"Task {task['upid']} on VM {vm['vmid']} is still running")
+        return await self._locate(vm["vmid"], csrf_token, ticket) if active else current
+
+    async def _migrate(
+        self, node: str, vm: Dict[str, Any], target: str, local_disks: bool,
+        bwlimit: Optional[int], csrf_token: str, ticket: str, result: Dict[str, Any],
+    ):
+        data: Dict[str, Any] = {"target": target}
+        if vm.get("status") == "running":
+            data["online"] = 1
+        if local_disks:
+            data["with-local-disks"] = 1
+        if bwlimit:
+            data["bwlimit"] = bwlimit  # KiB/s
+        async with self.locks.hold(vm["vmid"], "migrate"):
+            upid = await self._request("POST", f"/nodes/{node}/qemu/{vm['vmid']}/migrate", csrf_token, ticket, node=node, data=data)
+            result["upids"].append(upid)
+            self.registry.record(upid, csrf_token, ticket, vm["vmid"])
+            task = await self.registry.wait(upid, timeout=MIGRATION_TIMEOUT)
+        if task is None or task["status"] == "running":
+            raise HTTPException(status_code=504, detail=f"Migration task {upid} did not finish in time")
+        if task["exitstatus"] != "OK":
+            raise HTTPException(status_code=500, detail=f"Migration to {target} failed: {task['exitstatus']}")
+
+    async def evacuate(
+        self, node: str, csrf_token: str, ticket: str, concurrency: int = MIGRATION_CONCURRENCY,
+        bwlimit: Optional[int] = None, max_retries: int = MAX_RETRIES, include_stopped: bool = True,
+    ) -> Dict[str, Any]:
+        resources = await self._request("GET", "/cluster/resources", csrf_token, ticket, params={"type": "vm"})
+        vms = [
+            r for r in resources
+            if r.get("type") == "qemu" and r.get("node") == node and not r.get("template")
+            and (include_stopped or r.get("status") == "running")
+        ]
+        if not vms:
+            raise HTTPException(status_code=404, detail=f"No VMs to migrate off node {node}")
+
+        config_limit = asyncio.Semaphore(CONFIG_CONCURRENCY)
+
+        async def fetch_config(vm: Dict[str, Any]) -> Dict[str, Any]:
+            async with config_limit:
+                return await self._request("GET", f"/nodes/{node}/qemu/{vm['vmid']}/config", csrf_token, ticket, node=node)
+
+        configs = await asyncio.gather(*(fetch_config(vm) for vm in vms))
+        storage_info = {
+            r["storage"]: bool(r.get("shared"))
+            for r in await self._request("GET", f"/nodes/{node}/storage", csrf_token, ticket, node=node)
+        }
+        specs, local = [], {}
+        for vm, config in zip(vms, configs):
+            storages = sorted({d.storage for d in parse_config(config).data_disks if d.storage})
+            local[vm["vmid"]] = any(not storage_info.get(s, False) for s in storages)
+            # Local disks are copied to the same storage id on the target, so it must exist there
+            specs.append({
+                "cores": int(config.get("cores", 1)) * int(config.get("sockets", 1)),
+                "memory": int(config.get("memory", 512)),
+                "storages": storages,
+                "exclude": [node],
+            })
+        # Planned as one batch so the drained VMs spread over the remaining nodes
+        placements = await self.placement.place(specs, csrf_token, ticket)
+
+        job = FleetJob(next(self.ids), "evacuate", vms)
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+        self.logger.info(f"Evacuating {len(vms)} VMs from node {node}, {concurrency} at a time, bwlimit={bwlimit}")
+
+        async def run_one(vm: Dict[str, Any], spec: Dict[str, Any], target: str):
+            result = job.results[vm["vmid"]]
+            result.update(target=target, attempts=0)
+            failed_targets = [node]
+            source = node
+            async with semaphore:
+                while True:
+                    result["attempts"] += 1
+                    result["status"] = "running"
+                    try:
+                        await self._migrate(source, vm, target, local[vm["vmid"]], bwlimit, csrf_token, ticket, result)
+                        result["status"], result["error"] = "done", None
+                        return
+                    except Exception as e:
+                        detail = e.detail if isinstance(e, HTTPException) else str(e)
+                        self.logger.warning(f"Migrating VM {vm['vmid']} to {target} failed (attempt {result['attempts']}): {detail}")
+                        result["error"] = detail
+                    if result["attempts"] > max_retries:
+                        result["status"] = "failed"
+                        return
+                    await asyncio.sleep(RETRY_DELAY * result["attempts"])
+                    try:
+                        current = await self._settle(vm, csrf_token, ticket)
+                    except Exception as e:
+                        result["status"] = "failed"
+                        result["error"] = e.detail if isinstance(e, HTTPException) else str(e)
+                        return
+                    if current["node"] != node:
+                        # The earlier attempt got there after all
+                        result.update(status="done", error=None, target=current["node"])
+                        return
+                    source = current["node"]
+                    vm = dict(vm, status=current.get("status"))
+                    failed_targets.append(target)
+                    try:
+                        target = await self.placement.choose(csrf_token, ticket, **dict(spec, exclude=failed_targets))
+                    except HTTPException:
+                        # Nowhere else to go; try the same target again
+                        failed_targets.pop()
+                    result["target"] = target
+
+        async def run_all():
+            await asyncio.gather(*(run_one(vm, spec, p["node"]) for vm, spec, p in zip(vms, specs, placements)))
+            job.finished_at = time.time()
+            self.logger.info(f"Evacuation {job.id} of node {node} finished: {job.as_dict()['counts']}")
+
+        job.task = asyncio.create_task(run_all())
+        self.jobs[job.id] = job
+        for old in sorted(self.jobs)[:-MAX_JOBS]:
+            if self.jobs[old].finished_at is not None:
+                del self.jobs[old]
+        return dict(job.as_dict(), node=node)
+
+    def get_job(self, job_id: int, visible: Optional[Set[int]] = None) -> Dict[str, Any]:
+        job = self.jobs.get(job_id)
+        if job is None or (visible is not None and not visible & job.results.keys()):
+            raise HTTPException(status_code=404, detail=f"Evacuation {job_id} not found")
+        return job.as_dict(visible)
@@ -0,0 +1,153 @@
+from Modules.logger import init_logger
+from Modules.proxmox_client import EndpointSet
+from .vm_service import VMService
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set
+import asyncio
+import json
+import os
+
+POLL_INTERVAL = float(os.getenv("VM_EVENTS_INTERVAL", "5"))
+KEEPALIVE_INTERVAL = 15.0
+QUEUE_SIZE = 100
+
+
+class NodeWatcher:
+    """
+    One upstream poller per node. Every poll is diffed against the previous
+    snapshot and only the changed fields are fanned out to subscribers.
+    """
+
+    def __init__(self, node: str, vm_service: VMService, endpoints: EndpointSet, logger, on_idle: Callable[[str], None]):
+        self.node = node
+        self.vm_service = vm_service
+        self.endpoints = endpoints
+        self.logger = logger
+        self.on_idle = on_idle
+        self.subscribers: Set[asyncio.Queue] = set()
+        self.needs_snapshot: Set[asyncio.Queue] = set()
+        self.snapshot: Optional[Dict[int, Dict[str, Any]]] = None
+        self.credentials = ("", "")
+        self.task: Optional[asyncio.Task] = None
+
+    def subscribe(self, csrf_token: str, ticket: str) -> asyncio.Queue:
+        # Callers authorize first, so the newest subscriber's ticket is both valid and the freshest
+        self.credentials = (csrf_token, ticket)
+        queue: asyncio.Queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self.subscribers.add(queue)
+        if self.snapshot is not None:
+            self._send(queue, "snapshot", {"vms": list(self.snapshot.values())})
+        else:
+            self.needs_snapshot.add(queue)
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._run())
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self.subscribers.discard(queue)
+        self.needs_snapshot.discard(queue)
+        if not self.subscribers:
+            if self.task:
+                self.task.cancel()
+            self.on_idle(self.node)
+
+    def _send(self, queue: asyncio.Queue, event: str, payload: Any):
+        try:
+            queue.put_nowait((event, payload))
+        except asyncio.QueueFull:
+            # Slow consumer: drop its backlog and resync it with a fresh snapshot next round
+            while not queue.empty():
+                queue.get_nowait()
+            self.needs_snapshot.add(queue)
+
+    def _broadcast(self, events: List[tuple]):
+        snapshot_payload = {"vms": list(self.snapshot.values())}
+        for queue in list(self.subscribers):
+            if queue in self.needs_snapshot:
+                self.needs_snapshot.discard(queue)
+                self._send(queue, "snapshot", snapshot_payload)
+                continue
+            for event, payload in events:
+                self._send(queue, event, payload)
+
+    @staticmethod
+    def diff(previous: Dict[int, Dict[str, Any]], current: Dict[int, Dict[str, Any]]) -> List[tuple]:
+        events = []
+        for vmid, vm in current.items():
+            old = previous.get(vmid)
+            if old is None:
+                events.append(("added", {"vm": vm}))
+                continue
+            changes = {k: v for k, v in vm.items() if old.get(k) != v}
+            if changes:
+                events.append(("update", {"vmid": vmid, "changes": changes}))
+        for vmid in previous.keys() - current.keys():
+            events.append(("removed", {"vmid": vmid}))
+        return events
+
+    async def _run(self):
+        self.logger.info(f"Starting VM event poller for node {self.node}")
+        try:
+            while self.subscribers:
+                csrf_token, ticket = self.credentials
+                try:
+                    async with self.endpoints.lease(self.node) as endpoint:
+                        vms = await self.vm_service.get_vms(
+                            self.node, csrf_token, ticket, strict=True,
+                            api_url=endpoint.url, client=self.endpoints.client(endpoint),
+                        )
+                except Exception as e:
+                    # Keep the last good snapshot; a transient failure must not look like every VM vanished
+                    self.logger.warning(f"VM event poll failed for node {self.node}: {e}")
+                else:
+                    current = {vm["vmid"]: vm for vm in vms}
+                    events = self.diff(self.snapshot, current) if self.snapshot is not None else []
+                    self.snapshot = current
+                    if events or self.needs_snapshot:
+                        self._broadcast(events)
+                await asyncio.sleep(POLL_INTERVAL)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.logger.info(f"Stopped VM event poller for node {self.node}")
+
+
+class EventService:
+    def __init__(self, log_file: str, endpoints: EndpointSet):
+        self.log_file = log_file
+        self.logger = init_logger(log_file, __name__)
+        self.endpoints = endpoints
+        self.vm_service = VMService(log_file)
+        self.watchers: Dict[str, NodeWatcher] = {}
+
+    def _watcher(self, node: str) -> NodeWatcher:
+        if node not in self.watchers:
+            self.watchers[node] = NodeWatcher(node, self.vm_service, self.endpoints, self.logger, self._drop_watcher)
+        return self.watchers[node]
+
+    def _drop_watcher(self, node: str):
+        self.watchers.pop(node, None)
+
+    async def authorize(self, node: str, csrf_token: str, ticket: str):
+        # The stream serves a shared snapshot, so prove the caller may list this node's VMs
+        # before it is sent anything or its ticket replaces the poller's
+        await self.endpoints.authorize(csrf_token, ticket, f"/nodes/{node}/qemu", node=node)
+
+    async def stream(
+        self, node: str, csrf_token: str, ticket: str, is_disconnected: Callable[[], Awaitable[bool]]
+    ) -> AsyncIterator[str]:
+        self.logger.info(f"Client subscribed to VM events on node {node}")
+        watcher = self._watcher(node)
+        queue = watcher.subscribe(csrf_token, ticket)
+        try:
+            while True:
+                try:
+                    event, payload = await asyncio.wait_for(queue.get(), KEEPALIVE_INTERVAL)
+                except asyncio.TimeoutError:
+                    if await is_disconnected():
+                        break
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+        finally:
+            self.logger.info(f"Client unsubscribed from VM events on node {node}")
+            watcher.unsubscribe(queue)
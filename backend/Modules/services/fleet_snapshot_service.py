@@ -0,0 +1,239 @@
+from Modules.logger import init_logger
+from Modules.proxmox_client import EndpointSet
+from Modules.pve_config import parse_config
+from .task_registry import TaskRegistry
+from .lock_manager import VMLockManager
+from .snapshot_service import SnapshotTreeCache
+from .cluster_service import ClusterService
+from fastapi import HTTPException
+from typing import Any, Dict, List, Optional, Set, Tuple
+from datetime import datetime, timedelta
+import contextlib
+import itertools
+import asyncio
+import time
+
+# Snapshots running or being deleted at once on one storage
+PER_STORAGE_LIMIT = 2
+SNAPSHOT_TIMEOUT = 1800.0
+RETENTION_INTERVAL = 3600.0
+MAX_JOBS = 50
+
+
+def retention_plan(snapshots: List[Dict[str, Any]], keep_last: int, keep_daily: int, now: Optional[float] = None) -> List[Dict[str, Any]]:
+    """
+    Return the snapshots to delete: everything except the newest `keep_last`
+    and the newest snapshot of each of the last `keep_daily` days.
+    """
+    ordered = sorted(snapshots, key=lambda s: s.get("snaptime") or 0, reverse=True)
+    keep = {s["name"] for s in ordered[:keep_last]}
+
+    cutoff = datetime.fromtimestamp(now or time.time()).date() - timedelta(days=keep_daily)
+    days_kept = set()
+    for snap in ordered:
+        day = datetime.fromtimestamp(snap.get("snaptime") or 0).date()
+        if day > cutoff and day not in days_kept:
+            days_kept.add(day)
+            keep.add(snap["name"])
+    return [s for s in ordered if s["name"] not in keep]
+
+
+class FleetJob:
+    __slots__ = ("id", "kind", "created_at", "finished_at", "results", "task")
+
+    def __init__(self, job_id: int, kind: str, vms: List[Dict[str, Any]]):
+        self.id = job_id
+        self.kind = kind
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.results: Dict[int, Dict[str, Any]] = {
+            vm["vmid"]: {"node": vm["node"], "name": vm.get("name"), "status": "queued", "upids": [], "error": None}
+            for vm in vms
+        }
+        self.task: Optional[asyncio.Task] = None
+
+    def as_dict(self, visible: Optional[Set[int]] = None) -> Dict[str, Any]:
+        # visible: the VMs the caller may see; others are left out of results and counts
+        results = {vmid: r for vmid, r in self.results.items() if visible is None or vmid in visible}
+        counts: Dict[str, int] = {}
+        for result in results.values():
+            counts[result["status"]] = counts.get(result["status"], 0) + 1
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "done": self.finished_at is not None,
+            "counts": counts,
+            "results": results,
+        }
+
+
+class FleetSnapshotService:
+    """
+    Snapshots or prunes many VMs at once, selected by VMID, tag or pool.
+    Work is throttled per storage, serialized per VM through the lock manager,
+    and every UPID is tracked in the task registry until it completes.
+    """
+
+    def __init__(
+        self, log_file: str, endpoints: EndpointSet, cluster: ClusterService, registry: TaskRegistry,
+        locks: VMLockManager, trees: Optional[SnapshotTreeCache] = None,
+    ):
+        self.log_file = log_file
+        self.logger = init_logger(log_file, __name__)
+        self.endpoints = endpoints
+        self.cluster = cluster
+        self.registry = registry
+        self.locks = locks
+        self.trees = trees
+        self.storage_limits: Dict[str, asyncio.Semaphore] = {}
+        self.jobs: Dict[int, FleetJob] = {}
+        self.ids = itertools.count(1)
+        self.policies: Dict[str, Dict[str, Any]] = {}
+        # Background pruning needs a live ticket; the most recent one seen is kept in memory only
+        self.credentials: Optional[Tuple[str, str]] = None
+
+    async def _request(self, method: str, path: str, csrf_token: str, ticket: str, node: Optional[str] = None, **kwargs) -> Any:
+        response = await self.endpoints.request(
+            method, path, node=node,
+            headers={"CSRFPreventionToken": csrf_token}, cookies={"PVEAuthCookie": ticket}, **kwargs,
+        )
+        if response.status_code != 200:
+            raise HTTPException(status_code=response.status_code, detail=f"{method} {path} failed: {response.text}")
+        return response.json().get("data")
+
+    def _storage_limit(self, storage: str) -> asyncio.Semaphore:
+        if storage not in self.storage_limits:
+            self.storage_limits[storage] = asyncio.Semaphore(PER_STORAGE_LIMIT)
+        return self.storage_limits[storage]
+
+    @contextlib.asynccontextmanager
+    async def _throttle(self, vm: Dict[str, Any], operation: str, csrf_token: str, ticket: str):
+        config = await self._request("GET", f"/nodes/{vm['node']}/qemu/{vm['vmid']}/config", csrf_token, ticket, node=vm["node"])
+        storages = sorted({d.storage for d in parse_config(config).data_disks if d.storage})
+        async with contextlib.AsyncExitStack() as stack:
+            # Storage slots first (in sorted order, so VMs spanning several storages cannot deadlock),
+            # then the VM lock, as backups do: a VM never sits locked while waiting for a busy storage
+            for storage in storages:
+                await stack.enter_async_context(self._storage_limit(storage))
+            await stack.enter_async_context(self.locks.hold(vm["vmid"], operation))
+            yield
+
+    async def _run_task(self, vm: Dict[str, Any], result: Dict[str, Any], upid: str, csrf_token: str, ticket: str):
+        result["upids"].append(upid)
+        self.registry.record(upid, csrf_token, ticket, vm["vmid"])
+        if self.trees is not None:
+            self.trees.invalidate(vm["vmid"], upid)
+        task = await self.registry.wait(upid, timeout=SNAPSHOT_TIMEOUT)
+        if task is None or task["status"] == "running":
+            raise HTTPException(status_code=504, detail=f"Task {upid} did not finish in time")
+        if task["exitstatus"] != "OK":
+            raise HTTPException(status_code=500, detail=f"Task {upid} failed: {task['exitstatus']}")
+
+    def _start(self, kind: str, vms: List[Dict[str, Any]], worker) -> FleetJob:
+        job = FleetJob(next(self.ids), kind, vms)
+
+        async def run_one(vm: Dict[str, Any]):
+            result = job.results[vm["vmid"]]
+            try:
+                await worker(vm, result)
+                result["status"] = "done"
+            except HTTPException as e:
+                result["status"], result["error"] = "failed", e.detail
+            except Exception as e:
+                result["status"], result["error"] = "failed", str(e)
+
+        async def run_all():
+            await asyncio.gather(*(run_one(vm) for vm in vms))
+            job.finished_at = time.time()
+            self.logger.info(f"Fleet job {job.id} ({kind}) finished: {job.as_dict()['counts']}")
+
+        job.task = asyncio.create_task(run_all())
+        self.jobs[job.id] = job
+        for old in sorted(self.jobs)[:-MAX_JOBS]:
+            if self.jobs[old].finished_at is not None:
+                del self.jobs[old]
+        return job
+
+    def get_job(self, job_id: int, visible: Optional[Set[int]] = None) -> Dict[str, Any]:
+        job = self.jobs.get(job_id)
+        if job is None or (visible is not None and not visible & job.results.keys()):
+            raise HTTPException(status_code=404, detail=f"Fleet job {job_id} not found")
+        return job.as_dict(visible)
+
+    async def snapshot(
+        self, csrf_token: str, ticket: str,
+        vmids: Optional[List[int]] = None, tag: Optional[str] = None, pool: Optional[str] = None,
+        snapname: Optional[str] = None, description: str = "", vmstate: int = 0,
+    ) -> Dict[str, Any]:
+        vms = await self.cluster.select_vms(csrf_token, ticket, vmids, tag, pool)
+        self.credentials = (csrf_token, ticket)
+        snapname = snapname or f"fleet_{time.strftime('%Y%m%d_%H%M%S')}"
+        self.logger.info(f"Fleet snapshot '{snapname}' of {len(vms)} VMs")
+
+        async def worker(vm: Dict[str, Any], result: Dict[str, Any]):
+            async with self._throttle(vm, "snapshot", csrf_token, ticket):
+                result["status"] = "running"
+                upid = await self._request(
+                    "POST", f"/nodes/{vm['node']}/qemu/{vm['vmid']}/snapshot", csrf_token, ticket, node=vm["node"],
+                    data={"snapname": snapname, "description": description, "vmstate": str(vmstate)},
+                )
+                await self._run_task(vm, result, upid, csrf_token, ticket)
+
+        return self._start("snapshot", vms, worker).as_dict()
+
+    async def prune(self, policy: Dict[str, Any], csrf_token: str, ticket: str, dry_run: bool = False) -> Dict[str, Any]:
+        vms = await self.cluster.select_vms(csrf_token, ticket, policy.get("vmids"), policy.get("tag"), policy.get("pool"))
+        self.credentials = (csrf_token, ticket)
+        prefix = policy.get("prefix") or ""
+
+        async def worker(vm: Dict[str, Any], result: Dict[str, Any]):
+            path = f"/nodes/{vm['node']}/qemu/{vm['vmid']}/snapshot"
+            snapshots = await self._request("GET", path, csrf_token, ticket, node=vm["node"])
+            managed = [s for s in snapshots if s["name"] != "current" and s["name"].startswith(prefix)]
+            doomed = retention_plan(managed, policy["keep_last"], policy["keep_daily"])
+            result["delete"] = [s["name"] for s in doomed]
+            if dry_run or not doomed:
+                return
+            async with self._throttle(vm, "delsnapshot", csrf_token, ticket):
+                result["status"] = "running"
+                # Proxmox locks the VM per snapshot delete, so these run one after another
+                for snap in doomed:
+                    upid = await self._request("DELETE", f"{path}/{snap['name']}", csrf_token, ticket, node=vm["node"])
+                    await self._run_task(vm, result, upid, csrf_token, ticket)
+
+        return self._start("prune", vms, worker).as_dict()
+
+    async def set_policy(self, policy: Dict[str, Any], csrf_token: str, ticket: str) -> Dict[str, Any]:
+        # Only a ticket Proxmox accepts is kept for background pruning
+        await self.endpoints.authorize(csrf_token, ticket, "/cluster/resources")
+        self.credentials = (csrf_token, ticket)
+        self.policies[policy["name"]] = policy
+        self.logger.info(f"Retention policy '{policy['name']}' set: {policy}")
+        return policy
+
+    def delete_policy(self, name: str):
+        if self.policies.pop(name, None) is None:
+            raise HTTPException(status_code=404, detail=f"Retention policy '{name}' not found")
+
+    async def run(self, interval: float = RETENTION_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            if not self.credentials:
+                continue
+            csrf_token, ticket = self.credentials
+            for policy in list(self.policies.values()):
+                try:
+                    job = await self.prune(policy, csrf_token, ticket)
+                    await self.jobs[job["id"]].task
+                except HTTPException as e:
+                    if e.status_code == 401:
+                        # Tickets expire after two hours; wait for the next API call to bring a fresh one
+                        if self.credentials == (csrf_token, ticket):
+                            self.credentials = None
+                        self.logger.warning("Retention runs paused: the stored ticket has expired")
+                        break
+                    self.logger.warning(f"Retention run for policy '{policy['name']}' failed: {e.detail}")
+                except Exception as e:
+                    self.logger.warning(f"Retention run for policy '{policy['name']}' failed: {e}")
@@ -0,0 +1,112 @@
+from Modules.logger import init_logger
+from typing import Any, AsyncIterator, Awaitable, Deque, Dict, List, Optional, Set
+from collections import deque
+import contextlib
+import itertools
+import asyncio
+import time
+
+# Upper bound on how long a finished request keeps the VM locked while its task runs
+TASK_HOLD_TIMEOUT = 1800.0
+
+
+class LockEntry:
+    __slots__ = ("id", "vmid", "operation", "enqueued_at", "started_at", "ready", "hold")
+
+    def __init__(self, entry_id: int, vmid: int, operation: str):
+        self.id = entry_id
+        self.vmid = vmid
+        self.operation = operation
+        self.enqueued_at = time.time()
+        self.started_at: Optional[float] = None
+        self.ready = asyncio.Event()
+        self.hold: Optional[Awaitable[Any]] = None
+
+    def release_after(self, awaitable: Awaitable[Any]):
+        # Keep the VM locked until e.g. the Proxmox task this operation started has finished
+        self.hold = awaitable
+
+    def as_dict(self, position: int) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "vmid": self.vmid,
+            "operation": self.operation,
+            "position": position,
+            "running": position == 0,
+            "enqueued_at": self.enqueued_at,
+            "started_at": self.started_at,
+        }
+
+
+class VMLockManager:
+    """
+    Serializes conflicting operations per VMID in FIFO order so they do not
+    collide on the Proxmox config lock; operations on different VMs run in parallel.
+    """
+
+    def __init__(self, log_file: str):
+        self.log_file = log_file
+        self.logger = init_logger(log_file, __name__)
+        self.queues: Dict[int, Deque[LockEntry]] = {}
+        self.ids = itertools.count(1)
+        # Strong references, or the loop may collect a pending release and leave the VM locked
+        self.release_tasks: Set[asyncio.Task] = set()
+
+    def _enqueue(self, vmid: int, operation: str) -> LockEntry:
+        entry = LockEntry(next(self.ids), vmid, operation)
+        queue = self.queues.setdefault(vmid, deque())
+        queue.append(entry)
+        if len(queue) == 1:
+            entry.ready.set()
+        else:
+            self.logger.info(f"Operation '{operation}' on VM {vmid} queued at position {len(queue) - 1}")
+        return entry
+
+    def _release(self, entry: LockEntry):
+        queue = self.queues.get(entry.vmid)
+        if not queue:
+            return
+        was_head = queue[0] is entry
+        with contextlib.suppress(ValueError):
+            queue.remove(entry)
+        if not queue:
+            del self.queues[entry.vmid]
+        elif was_head:
+            queue[0].ready.set()
+
+    async def _release_after(self, entry: LockEntry):
+        try:
+            await asyncio.wait_for(entry.hold, TASK_HOLD_TIMEOUT)
+        except Exception as e:
+            self.logger.warning(f"Waiting on '{entry.operation}' for VM {entry.vmid} ended early: {e}")
+        finally:
+            self._release(entry)
+
+    def position(self, entry: LockEntry) -> int:
+        queue = self.queues.get(entry.vmid, ())
+        return next((i for i, e in enumerate(queue) if e is entry), -1)
+
+    def queue(self, vmid: int) -> List[Dict[str, Any]]:
+        return [entry.as_dict(i) for i, entry in enumerate(self.queues.get(vmid, ()))]
+
+    def all_queues(self) -> Dict[int, List[Dict[str, Any]]]:
+        return {vmid: self.queue(vmid) for vmid in self.queues}
+
+    @contextlib.asynccontextmanager
+    async def hold(self, vmid: int, operation: str) -> AsyncIterator[LockEntry]:
+        entry = self._enqueue(vmid, operation)
+        try:
+            await entry.ready.wait()
+        except BaseException:
+            self._release(entry)
+            raise
+        entry.started_at = time.time()
+        try:
+            yield entry
+        finally:
+            if entry.hold is not None:
+                task = asyncio.create_task(self._release_after(entry))
+                self.release_tasks.add(task)
+                task.add_done_callback(self.release_tasks.discard)
+            else:
+                self._release(entry)
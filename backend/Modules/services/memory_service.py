@@ -0,0 +1,206 @@
+from Modules.logger import init_logger
+from Modules.proxmox_client import EndpointSet
+from fastapi import HTTPException
+from typing import Any, Deque, Dict, List, Optional, Tuple
+from collections import deque
+import asyncio
+import time
+
+MIB = 1024**2
+STATUS_CONCURRENCY = 8
+# Start reclaiming above this share of node RAM in use, give memory back below the lower mark
+PRESSURE_HIGH = 0.85
+PRESSURE_LOW = 0.70
+# Guest usage plus this share is left as the balloon target
+HEADROOM = 0.2
+# Rate limits: per-VM cooldown, largest single step and changes per node per pass
+VM_COOLDOWN = 300.0
+MAX_STEP_MIB = 1024
+MAX_CHANGES_PER_PASS = 10
+AUTO_INTERVAL = 60.0
+HISTORY_SIZE = 500
+
+
+class MemoryService:
+    """
+    Reads balloon statistics for running VMs, works out how much memory each
+    guest could give back, and moves balloon targets within per-VM bounds when
+    a node is under memory pressure. Every change is rate-limited and logged.
+    """
+
+    def __init__(self, log_file: str, endpoints: EndpointSet):
+        self.log_file = log_file
+        self.logger = init_logger(log_file, __name__)
+        self.endpoints = endpoints
+        # vmid -> {"min_mib", "max_mib"} overriding the config's balloon/memory
+        self.bounds: Dict[int, Dict[str, Optional[int]]] = {}
+        self.last_change: Dict[int, float] = {}
+        self.history: Deque[Dict[str, Any]] = deque(maxlen=HISTORY_SIZE)
+        self.auto_nodes: Dict[str, Tuple[str, str]] = {}
+        # node -> {"at", "reason"} for automatic balancing switched off because its ticket stopped working
+        self.auto_stopped: Dict[str, Dict[str, Any]] = {}
+
+    async def _request(self, method: str, path: str, csrf_token: str, ticket: str, node: str, **kwargs) -> Any:
+        response = await self.endpoints.request(
+            method, path, node=node,
+            headers={"CSRFPreventionToken": csrf_token}, cookies={"PVEAuthCookie": ticket}, **kwargs,
+        )
+        if response.status_code != 200:
+            raise HTTPException(status_code=response.status_code, detail=f"{method} {path} failed: {response.text}")
+        return response.json().get("data")
+
+    def set_bounds(self, vmid: int, min_mib: Optional[int], max_mib: Optional[int], memory_mib: int) -> Dict[str, Optional[int]]:
+        # memory_mib: the VM's configured memory, which no balloon target may exceed
+        if min_mib is not None and max_mib is not None and min_mib > max_mib:
+            raise HTTPException(status_code=400, detail="min_mib must not exceed max_mib")
+        for label, value in (("min_mib", min_mib), ("max_mib", max_mib)):
+            if value is not None and not 1 <= value <= memory_mib:
+                raise HTTPException(status_code=400, detail=f"{label} must be between 1 and the VM's memory ({memory_mib} MiB)")
+        self.bounds[vmid] = {"min_mib": min_mib, "max_mib": max_mib}
+        self.logger.info(f"Balloon bounds for VM {vmid} set to {self.bounds[vmid]}")
+        return self.bounds[vmid]
+
+    def _vm_entry(self, vmid: int, name: str, config: Dict[str, Any], status: Dict[str, Any]) -> Dict[str, Any]:
+        memory_mib = int(config.get("memory", 512))
+        balloon_mib = int(config.get("balloon", memory_mib))
+        info = status.get("ballooninfo") or {}
+        override = self.bounds.get(vmid, {})
+        min_mib = override.get("min_mib") or balloon_mib
+        max_mib = min(override.get("max_mib") or memory_mib, memory_mib)
+        actual_mib = info.get("actual", status.get("balloon", memory_mib * MIB)) // MIB
+        entry = {
+            "vmid": vmid,
+            "name": name,
+            "memory_mib": memory_mib,
+            "min_mib": min_mib,
+            "max_mib": max_mib,
+            "actual_mib": actual_mib,
+            "used_mib": None,
+            "target_mib": None,
+            "reclaimable_mib": 0,
+            # balloon: 0 turns the device off; without guest stats there is nothing to base a target on
+            "managed": balloon_mib > 0 and "total_mem" in info and "free_mem" in info,
+        }
+        if entry["managed"]:
+            used_mib = (info["total_mem"] - info["free_mem"]) // MIB
+            target = max(min_mib, min(max_mib, int(used_mib * (1 + HEADROOM))))
+            entry.update(used_mib=used_mib, target_mib=target, reclaimable_mib=max(0, actual_mib - target))
+        return entry
+
+    async def report(self, node: str, csrf_token: str, ticket: str) -> Dict[str, Any]:
+        node_status = await self._request("GET", f"/nodes/{node}/status", csrf_token, ticket, node)
+        vms = [
+            vm for vm in await self._request("GET", f"/nodes/{node}/qemu", csrf_token, ticket, node)
+            if vm.get("status") == "running"
+        ]
+        semaphore = asyncio.Semaphore(STATUS_CONCURRENCY)
+
+        async def fetch(vm: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+            path = f"/nodes/{node}/qemu/{vm['vmid']}"
+            async with semaphore:
+                try:
+                    config, status = await asyncio.gather(
+                        self._request("GET", f"{path}/config", csrf_token, ticket, node),
+                        self._request("GET", f"{path}/status/current", csrf_token, ticket, node),
+                    )
+                except HTTPException as e:
+                    self.logger.warning(f"Balloon stats for VM {vm['vmid']} unavailable: {e.detail}")
+                    return None
+            return self._vm_entry(vm["vmid"], vm.get("name"), config, status)
+
+        entries = [e for e in await asyncio.gather(*(fetch(vm) for vm in vms)) if e]
+        memory = node_status.get("memory", {})
+        total, used = memory.get("total") or 1, memory.get("used") or 0
+        return {
+            "node": node,
+            "total_mib": total // MIB,
+            "used_mib": used // MIB,
+            "pressure": round(used / total, 3),
+            "reclaimable_mib": sum(e["reclaimable_mib"] for e in entries if e["managed"]),
+            "vms": sorted(entries, key=lambda e: -e["reclaimable_mib"]),
+        }
+
+    def plan(self, report: Dict[str, Any]) -> List[Dict[str, Any]]:
+        now = time.monotonic()
+        managed = [
+            e for e in report["vms"]
+            if e["managed"] and now - self.last_change.get(e["vmid"], 0) >= VM_COOLDOWN
+        ]
+        changes = []
+        if report["pressure"] > PRESSURE_HIGH:
+            # Shrink the guests with the most idle memory first until the node is back under the mark
+            excess = report["used_mib"] - int(report["total_mib"] * PRESSURE_HIGH)
+            for e in managed:
+                if excess <= 0 or len(changes) >= MAX_CHANGES_PER_PASS:
+                    break
+                step = min(e["reclaimable_mib"], MAX_STEP_MIB, excess)
+                if step > 0:
+                    changes.append({"vmid": e["vmid"], "from_mib": e["actual_mib"], "to_mib": e["actual_mib"] - step})
+                    excess -= step
+        elif report["pressure"] < PRESSURE_LOW:
+            # Plenty of room again: let squeezed guests grow back towards their maximum
+            room = int(report["total_mib"] * PRESSURE_LOW) - report["used_mib"]
+            for e in sorted(managed, key=lambda e: e["actual_mib"] - e["max_mib"]):
+                if room <= 0 or len(changes) >= MAX_CHANGES_PER_PASS:
+                    break
+                step = min(e["max_mib"] - e["actual_mib"], MAX_STEP_MIB, room)
+                if step > 0:
+                    changes.append({"vmid": e["vmid"], "from_mib": e["actual_mib"], "to_mib": e["actual_mib"] + step})
+                    room -= step
+        return changes
+
+    async def rebalance(self, node: str, csrf_token: str, ticket: str, dry_run: bool = False) -> Dict[str, Any]:
+        report = await self.report(node, csrf_token, ticket)
+        changes = self.plan(report)
+        for change in changes:
+            change.update(node=node, at=time.time(), applied=False, error=None)
+            if dry_run:
+                continue
+            try:
+                # Sets the runtime balloon target only; the configured min/max stay untouched
+                await self._request(
+                    "POST", f"/nodes/{node}/qemu/{change['vmid']}/monitor", csrf_token, ticket, node,
+                    data={"command": f"balloon {change['to_mib']}"},
+                )
+                change["applied"] = True
+                self.last_change[change["vmid"]] = time.monotonic()
+                self.logger.info(
+                    f"Balloon target of VM {change['vmid']} on {node}: {change['from_mib']} -> {change['to_mib']} MiB "
+                    f"(node pressure {report['pressure']:.0%})"
+                )
+            except HTTPException as e:
+                change["error"] = e.detail
+                self.logger.warning(f"Setting balloon target of VM {change['vmid']} failed: {e.detail}")
+            self.history.append(change)
+        return {"node": node, "pressure": report["pressure"], "dry_run": dry_run, "changes": changes}
+
+    async def set_auto(self, node: str, enabled: bool, csrf_token: str, ticket: str) -> Dict[str, bool]:
+        # Automatic passes reuse the credentials of whoever enabled them, held in memory only,
+        # so they are checked first and the mode is switched off again once Proxmox rejects them
+        await self.endpoints.authorize(csrf_token, ticket, f"/nodes/{node}/qemu", node=node)
+        if enabled:
+            self.auto_nodes[node] = (csrf_token, ticket)
+        else:
+            self.auto_nodes.pop(node, None)
+        self.auto_stopped.pop(node, None)
+        self.logger.info(f"Automatic memory balancing on node {node} {'enabled' if enabled else 'disabled'}")
+        return {node: enabled for node in self.auto_nodes}
+
+    def _stop_auto(self, node: str, reason: str):
+        self.auto_nodes.pop(node, None)
+        self.auto_stopped[node] = {"at": time.time(), "reason": reason}
+        self.logger.warning(f"Automatic memory balancing on node {node} disabled: {reason}")
+
+    async def run(self, interval: float = AUTO_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            for node, (csrf_token, ticket) in list(self.auto_nodes.items()):
+                try:
+                    await self.rebalance(node, csrf_token, ticket)
+                except HTTPException as e:
+                    if e.status_code == 401:
+                        self._stop_auto(node, "The ticket it was enabled with has expired; enable it again")
+                    else:
+                        self.logger.warning(f"Memory balancing on node {node} failed: {e.detail}")
+                except Exception as e:
+                    self.logger.warning(f"Memory balancing on node {node} failed: {e}")
@@ -0,0 +1,232 @@
+from Modules.logger import init_logger
+from Modules.proxmox_client import EndpointSet
+from fastapi import HTTPException
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+import asyncio
+import time
+
+VM_FIELDS = ("cpu", "mem", "maxmem", "diskread", "diskwrite", "netin", "netout")
+NODE_FIELDS = ("cpu", "memused", "memtotal", "iowait", "loadavg", "netin", "netout")
+
+# One week of one-minute samples per VM or node
+RING_CAPACITY = 7 * 24 * 60
+COLLECT_INTERVAL = 300.0
+COLLECT_CONCURRENCY = 8
+# The "hour" RRD has one-minute steps; a new series is backfilled from the 30-minute "day" RRD
+LIVE_TIMEFRAME = "hour"
+BACKFILL_TIMEFRAME = "day"
+
+
+class RingBuffer:
+    """Fixed-size, time-ordered samples; the oldest rows are overwritten once full."""
+
+    __slots__ = ("fields", "times", "values", "head", "count")
+
+    def __init__(self, fields: Tuple[str, ...], capacity: int = RING_CAPACITY):
+        self.fields = fields
+        self.times = np.zeros(capacity, dtype=np.int64)
+        self.values = np.full((capacity, len(fields)), np.nan, dtype=np.float64)
+        self.head = 0
+        self.count = 0
+
+    @property
+    def last_time(self) -> int:
+        return int(self.times[self.head - 1]) if self.count else 0
+
+    def extend(self, rows: List[Dict[str, Any]]) -> int:
+        # RRD windows overlap between polls, so only rows newer than the last sample are kept
+        rows = sorted((r for r in rows if r.get("time", 0) > self.last_time), key=lambda r: r["time"])
+        if not rows:
+            return 0
+        capacity = len(self.times)
+        rows = rows[-capacity:]
+        times = np.fromiter((r["time"] for r in rows), dtype=np.int64, count=len(rows))
+        values = np.array(
+            [[r.get(f) if r.get(f) is not None else np.nan for f in self.fields] for r in rows], dtype=np.float64
+        )
+        slots = (self.head + np.arange(len(rows))) % capacity
+        self.times[slots] = times
+        self.values[slots] = values
+        self.head = int((self.head + len(rows)) % capacity)
+        self.count = min(self.count + len(rows), capacity)
+        return len(rows)
+
+    def window(self, start: Optional[int] = None, end: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        capacity = len(self.times)
+        order = (self.head - self.count + np.arange(self.count)) % capacity
+        times = self.times[order]
+        lo = np.searchsorted(times, start, side="left") if start is not None else 0
+        hi = np.searchsorted(times, end, side="right") if end is not None else len(times)
+        return times[lo:hi], self.values[order[lo:hi]]
+
+
+def lttb(times: np.ndarray, values: np.ndarray, threshold: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Largest-Triangle-Three-Buckets: keeps the points that preserve the visual shape."""
+    n = len(times)
+    if threshold >= n or threshold < 3:
+        return times, values
+    x = times.astype(np.float64)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    picked = np.empty(threshold, dtype=np.int64)
+    picked[0], picked[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        lo, hi = edges[i], max(edges[i + 1], edges[i] + 1)
+        next_lo, next_hi = edges[i + 1], edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[next_lo:max(next_hi, next_lo + 1)].mean()
+        avg_y = values[next_lo:max(next_hi, next_lo + 1)].mean()
+        # Triangle area against the previous pick and the next bucket's average, for all candidates at once
+        areas = np.abs((x[a] - avg_x) * (values[lo:hi] - values[a]) - (x[a] - x[lo:hi]) * (avg_y - values[a]))
+        a = lo + int(np.argmax(areas))
+        picked[i + 1] = a
+    return times[picked], values[picked]
+
+
+def minmax_buckets(times: np.ndarray, values: np.ndarray, buckets: int) -> Dict[str, List[Any]]:
+    # Equal-width time buckets reduced in one pass each with reduceat
+    if len(times) == 0:
+        return {"time": [], "min": [], "max": [], "avg": []}
+    edges = np.linspace(times[0], times[-1] + 1, min(buckets, len(times)) + 1)
+    starts = np.unique(np.searchsorted(times, edges[:-1], side="left"))
+    starts = starts[starts < len(times)]
+    counts = np.diff(np.append(starts, len(times)))
+    return {
+        "time": times[starts].tolist(),
+        "min": np.minimum.reduceat(values, starts).tolist(),
+        "max": np.maximum.reduceat(values, starts).tolist(),
+        "avg": (np.add.reduceat(values, starts) / counts).tolist(),
+    }
+
+
+class MetricsService:
+    """
+    Samples VM and node RRD data in the background into per-series ring
+    buffers, so chart requests are served from memory and downsampled to
+    the number of points the client can draw.
+    """
+
+    def __init__(self, log_file: str, endpoints: EndpointSet):
+        self.log_file = log_file
+        self.logger = init_logger(log_file, __name__)
+        self.endpoints = endpoints
+        # ("qemu", vmid) or ("node", name) -> ring
+        self.rings: Dict[Tuple[str, Any], RingBuffer] = {}
+        self.last_run: Optional[float] = None
+        # Collection needs a live ticket, kept in memory only: the accepted one that sees the most resources,
+        # so a narrower ticket never shrinks what is collected for everyone
+        self.credentials: Optional[Tuple[str, str]] = None
+        self.scope = 0
+        self.wake = asyncio.Event()
+
+    async def _rrddata(self, path: str, node: str, timeframe: str, csrf_token: str, ticket: str) -> List[Dict[str, Any]]:
+        response = await self.endpoints.request(
+            "GET", f"{path}/rrddata", node=node,
+            params={"timeframe": timeframe, "cf": "AVERAGE"},
+            headers={"CSRFPreventionToken": csrf_token}, cookies={"PVEAuthCookie": ticket},
+        )
+        if response.status_code != 200:
+            raise HTTPException(status_code=response.status_code, detail=f"Failed to fetch {path}/rrddata")
+        return response.json().get("data", [])
+
+    async def collect_once(self, csrf_token: str, ticket: str) -> Dict[str, int]:
+        response = await self.endpoints.request(
+            "GET", "/cluster/resources",
+            headers={"CSRFPreventionToken": csrf_token}, cookies={"PVEAuthCookie": ticket},
+        )
+        if response.status_code != 200:
+            raise HTTPException(status_code=response.status_code, detail="Failed to fetch cluster resources")
+        resources = response.json().get("data", [])
+
+        targets = {}
+        for r in resources:
+            if r.get("type") == "node" and r.get("status") == "online":
+                targets[("node", r["node"])] = (f"/nodes/{r['node']}", r["node"], NODE_FIELDS)
+            elif r.get("type") == "qemu" and not r.get("template"):
+                targets[("qemu", r["vmid"])] = (f"/nodes/{r['node']}/qemu/{r['vmid']}", r["node"], VM_FIELDS)
+        for key in self.rings.keys() - targets.keys():
+            del self.rings[key]
+
+        semaphore = asyncio.Semaphore(COLLECT_CONCURRENCY)
+
+        async def sample(key: Tuple[str, Any], path: str, node: str, fields: Tuple[str, ...]) -> int:
+            ring = self.rings.get(key)
+            timeframe = LIVE_TIMEFRAME if ring is not None and ring.count else BACKFILL_TIMEFRAME
+            async with semaphore:
+                rows = await self._rrddata(path, node, timeframe, csrf_token, ticket)
+            if ring is None:
+                ring = self.rings[key] = RingBuffer(fields)
+            return ring.extend(rows)
+
+        results = await asyncio.gather(*(sample(key, *target) for key, target in targets.items()), return_exceptions=True)
+        failed = [key for key, result in zip(targets, results) if isinstance(result, Exception)]
+        if failed:
+            self.logger.warning(f"RRD sampling failed for {len(failed)} series, e.g. {failed[:5]}")
+        self.last_run = time.time()
+        return {"series": len(targets), "samples": sum(r for r in results if isinstance(r, int)), "failed": len(failed)}
+
+    async def run(self, interval: float = COLLECT_INTERVAL):
+        while True:
+            if self.credentials:
+                try:
+                    stats = await self.collect_once(*self.credentials)
+                    self.logger.info(f"Metrics collected: {stats}")
+                except HTTPException as e:
+                    if e.status_code == 401:
+                        # Expired ticket: the next accepted caller takes over, whatever its scope
+                        self.credentials, self.scope = None, 0
+                        self.logger.warning("Metrics collection paused: the stored ticket has expired")
+                    else:
+                        self.logger.warning(f"Metrics collection failed: {e.detail}")
+                except Exception as e:
+                    self.logger.warning(f"Metrics collection failed: {e}")
+            self.wake.clear()
+            try:
+                await asyncio.wait_for(self.wake.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def remember(self, csrf_token: str, ticket: str, scope: int):
+        # Only call with credentials Proxmox accepted; scope is how many cluster resources they can see.
+        # The first credentials seen start collection right away instead of at the next interval
+        if self.credentials is None:
+            self.wake.set()
+        elif scope < self.scope:
+            return
+        self.credentials, self.scope = (csrf_token, ticket), scope
+
+    def series(
+        self, kind: str, key: Any, start: Optional[int] = None, end: Optional[int] = None,
+        points: int = 300, mode: str = "lttb", fields: Optional[List[str]] = None,
+    ) -> Dict[str, Any]:
+        ring = self.rings.get((kind, key))
+        if ring is None:
+            raise HTTPException(status_code=404, detail=f"No metrics collected yet for {kind} {key}")
+        fields = fields or list(ring.fields)
+        unknown = [f for f in fields if f not in ring.fields]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown metric fields: {unknown}")
+        if mode not in ("lttb", "minmax"):
+            raise HTTPException(status_code=400, detail="mode must be 'lttb' or 'minmax'")
+
+        times, values = ring.window(start, end)
+        series = {}
+        for field in fields:
+            column = values[:, ring.fields.index(field)]
+            valid = ~np.isnan(column)
+            t, v = times[valid], column[valid]
+            if mode == "lttb":
+                t, v = lttb(t, v, points)
+                series[field] = {"time": t.tolist(), "value": v.tolist()}
+            else:
+                series[field] = minmax_buckets(t, v, points)
+        return {
+            "kind": kind,
+            "id": key,
+            "mode": mode,
+            "start": int(times[0]) if len(times) else start,
+            "end": int(times[-1]) if len(times) else end,
+            "raw_points": int(len(times)),
+            "collected_at": self.last_run,
+            "series": series,
+        }
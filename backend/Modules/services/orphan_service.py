@@ -0,0 +1,319 @@
+from Modules.logger import init_logger
+from Modules.proxmox_client import EndpointSet
+from Modules.pve_config import parse_config, split_volid
+from Modules.digest import check_config_write
+from .catalog_service import CatalogService
+from fastapi import HTTPException
+from typing import Any, Dict, List, Optional, Set, Tuple
+from urllib.parse import quote
+import asyncio
+import time
+import re
+
+CONFIG_CONCURRENCY = 16
+RECLAIM_CONCURRENCY = 4
+# Configs younger than this are reused from the index instead of re-fetched
+CONFIG_MAX_AGE = 60.0
+
+_LXC_VOLUME_KEY = re.compile(r"^(rootfs|mp\d+|unused\d+)$")
+# Volume-bearing qemu keys that are not drives: EFI vars and TPM state
+_QEMU_EXTRA_VOLUME_KEY = re.compile(r"^(efidisk|tpmstate)\d+$")
+
+
+def volume_key(volid: str) -> Tuple[Optional[str], str]:
+    # Linked clones reference "base-100-disk-0/vm-101-disk-0"; storage listings only the last part
+    storage, volume = split_volid(volid)
+    return storage, (volume or "").rsplit("/", 1)[-1]
+
+
+class VMVolumes:
+    __slots__ = ("vmid", "node", "type", "digest", "fetched_at", "attached", "unused", "has_snapshots")
+
+    def __init__(self, vmid: int, node: str, vm_type: str, config: Dict[str, Any]):
+        self.vmid = vmid
+        self.node = node
+        self.type = vm_type
+        self.digest = config.get("digest")
+        self.fetched_at = time.monotonic()
+        # Volumes may still be referenced from snapshot sections, which /config does not return
+        self.has_snapshots = "parent" in config
+        self.attached: Dict[str, str] = {}
+        self.unused: Dict[str, str] = {}
+        if vm_type == "qemu":
+            parsed = parse_config(config)
+            # Every drive counts, cdroms included: a cloud-init drive is media=cdrom on a VM-owned
+            # volume. Only ISOs (owned by nobody) and "none"/"cdrom" placeholders are left out
+            self.attached = {
+                d.key: d.volid for d in parsed.disks
+                if d.volid and d.storage and not (d.volume or "").startswith("iso/")
+            }
+            for key, value in config.items():
+                if isinstance(value, str) and _QEMU_EXTRA_VOLUME_KEY.match(key):
+                    volid = value.split(",")[0].strip()
+                    volid = volid[len("file="):] if volid.startswith("file=") else volid
+                    if ":" in volid:
+                        self.attached[key] = volid
+            self.unused = {u.key: u.volid for u in parsed.unused}
+        else:
+            for key, value in config.items():
+                if isinstance(value, str) and _LXC_VOLUME_KEY.match(key):
+                    volid = value.split(",")[0].strip()
+                    if ":" in volid:
+                        (self.unused if key.startswith("unused") else self.attached)[key] = volid
+
+
+class OrphanService:
+    """
+    Finds volumes that no VM config references and unusedN entries left behind,
+    using a volid -> VM index built from all configs and kept up to date incrementally.
+    """
+
+    def __init__(self, log_file: str, endpoints: EndpointSet, catalog: CatalogService):
+        self.log_file = log_file
+        self.logger = init_logger(log_file, __name__)
+        self.endpoints = endpoints
+        self.catalog = catalog
+        self.vms: Dict[int, VMVolumes] = {}
+        self.stale: Set[int] = set()
+        self.last_report: Optional[Dict[str, Any]] = None
+
+    def mark_stale(self, vmid: int):
+        # Called when the backend changes a VM, so its config is re-read on the next scan
+        self.stale.add(vmid)
+
+    async def _get(self, path: str, csrf_token: str, ticket: str, node: Optional[str] = None, **params) -> Any:
+        response = await self.endpoints.request(
+            "GET", path, node=node, params=params or None,
+            headers={"CSRFPreventionToken": csrf_token}, cookies={"PVEAuthCookie": ticket},
+        )
+        if response.status_code != 200:
+            raise HTTPException(status_code=response.status_code, detail=f"Failed to fetch {path}: {response.text}")
+        return response.json().get("data")
+
+    async def refresh_index(self, csrf_token: str, ticket: str, max_age: float = CONFIG_MAX_AGE) -> Dict[str, int]:
+        resources = await self._get("/cluster/resources", csrf_token, ticket, type="vm")
+        current = {r["vmid"]: r for r in resources if r.get("type") in ("qemu", "lxc")}
+
+        for vmid in self.vms.keys() - current.keys():
+            del self.vms[vmid]
+
+        now = time.monotonic()
+        todo = [
+            r for vmid, r in current.items()
+            if vmid in self.stale
+            or vmid not in self.vms
+            or self.vms[vmid].node != r["node"]
+            or now - self.vms[vmid].fetched_at > max_age
+        ]
+        semaphore = asyncio.Semaphore(CONFIG_CONCURRENCY)
+
+        async def fetch(resource: Dict[str, Any]):
+            vmid, node, vm_type = resource["vmid"], resource["node"], resource["type"]
+            async with semaphore:
+                config = await self._get(f"/nodes/{node}/{vm_type}/{vmid}/config", csrf_token, ticket, node=node)
+            self.vms[vmid] = VMVolumes(vmid, node, vm_type, config or {})
+            self.stale.discard(vmid)
+
+        results = await asyncio.gather(*(fetch(r) for r in todo), return_exceptions=True)
+        failed = [r["vmid"] for r, result in zip(todo, results) if isinstance(result, Exception)]
+        if failed:
+            self.logger.warning(f"Could not refresh configs for VMs {failed}")
+        self.logger.info(f"Volume index refreshed: {len(todo)} of {len(current)} configs fetched")
+        return {"vms": len(current), "fetched": len(todo), "failed": len(failed), "failed_vmids": failed}
+
+    def _references(self) -> Dict[Tuple[Optional[str], str], List[Dict[str, Any]]]:
+        refs: Dict[Tuple[Optional[str], str], List[Dict[str, Any]]] = {}
+        for vm in self.vms.values():
+            for key, volid in vm.attached.items():
+                refs.setdefault(volume_key(volid), []).append({"vmid": vm.vmid, "key": key, "unused": False})
+            for key, volid in vm.unused.items():
+                refs.setdefault(volume_key(volid), []).append({"vmid": vm.vmid, "key": key, "unused": True})
+        return refs
+
+    async def scan(self, csrf_token: str, ticket: str, max_age: float = CONFIG_MAX_AGE) -> Dict[str, Any]:
+        started = time.monotonic()
+        index_stats = await self.refresh_index(csrf_token, ticket, max_age)
+        refs = self._references()
+
+        nodes = [n["node"] for n in await self._get("/nodes", csrf_token, ticket) if n.get("status") == "online"]
+        listings: Dict[str, Tuple[str, Dict[str, Any]]] = {}
+        for node in nodes:
+            storages = await asyncio.to_thread(self.catalog.get_storages, node, csrf_token, ticket)
+            for storage, info in storages.items():
+                if not info["active"] or not {"images", "rootdir"} & set(info["content"]):
+                    continue
+                # Shared storages list the same volumes from every node; scan them once
+                listing_key = storage if info["shared"] else f"{node}/{storage}"
+                listings.setdefault(listing_key, (node, info))
+
+        async def list_volumes(node: str, storage: str) -> List[Dict[str, Any]]:
+            items = await asyncio.to_thread(self.catalog.get_content, node, storage, csrf_token, ticket)
+            return [i for i in items if i.get("content") in ("images", "rootdir")]
+
+        contents = await asyncio.gather(
+            *(list_volumes(node, info["storage"]) for node, info in listings.values()),
+            return_exceptions=True,
+        )
+
+        orphans, unused, scanned = [], [], 0
+        for (node, info), items in zip(listings.values(), contents):
+            if isinstance(items, Exception):
+                self.logger.warning(f"Listing {info['storage']} on node {node} failed: {items}")
+                continue
+            for item in items:
+                scanned += 1
+                volid = item["volid"]
+                owner = self.vms.get(int(item["vmid"])) if str(item.get("vmid", "")).isdigit() else None
+                entry = {
+                    "volid": volid,
+                    "node": node,
+                    "storage": info["storage"],
+                    "size": item.get("size", 0),
+                    "owner_vmid": item.get("vmid"),
+                }
+                references = refs.get(volume_key(volid), [])
+                if not references:
+                    entry["owner_exists"] = owner is not None
+                    # Without the snapshot sections we cannot prove an owner's snapshots don't use it
+                    entry["reclaimable"] = owner is None or not owner.has_snapshots
+                    orphans.append(entry)
+                elif all(r["unused"] for r in references):
+                    entry["references"] = references
+                    entry["reclaimable"] = True
+                    unused.append(entry)
+
+        report = {
+            "orphans": orphans,
+            "unused": unused,
+            "orphan_bytes": sum(o["size"] for o in orphans),
+            "unused_bytes": sum(u["size"] for u in unused),
+            "scanned_volumes": scanned,
+            "index": index_stats,
+            # A VM whose config could not be read makes its volumes look orphaned
+            "complete": not index_stats["failed"],
+            "duration": round(time.monotonic() - started, 3),
+        }
+        self.last_report = report
+        self.logger.info(f"Orphan scan: {len(orphans)} orphaned, {len(unused)} unused of {scanned} volumes")
+        return report
+
+    async def _vmid_in_use(self, vmid: int, csrf_token: str, ticket: str) -> bool:
+        # nextid with an explicit id only succeeds when no guest has it, whatever the caller may see
+        response = await self.endpoints.request(
+            "GET", "/cluster/nextid", params={"vmid": vmid},
+            headers={"CSRFPreventionToken": csrf_token}, cookies={"PVEAuthCookie": ticket},
+        )
+        return response.status_code != 200
+
+    async def _recheck(
+        self, volids: List[str], known: Dict[str, Dict[str, Any]], csrf_token: str, ticket: str, force: bool,
+    ) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, str]]:
+        # The report may be old or built with someone else's ticket: re-read every config now
+        stats = await self.refresh_index(csrf_token, ticket, max_age=0)
+        if stats["failed"]:
+            raise HTTPException(
+                status_code=409, detail=f"Could not read the configs of VMs {stats['failed_vmids']}; nothing was deleted",
+            )
+        refs = self._references()
+        plan: Dict[str, Dict[str, Any]] = {}
+        skipped: Dict[str, str] = {}
+        blocked = []
+        for volid in volids:
+            entry = dict(known[volid])
+            references = refs.get(volume_key(volid), [])
+            if "references" in entry:
+                if not references or not all(r["unused"] for r in references):
+                    skipped[volid] = "No longer an unused entry"
+                    continue
+                entry["references"] = references
+            else:
+                if references:
+                    skipped[volid] = f"Now referenced by VM {references[0]['vmid']}"
+                    continue
+                owner_vmid = str(entry.get("owner_vmid") or "")
+                owner = self.vms.get(int(owner_vmid)) if owner_vmid.isdigit() else None
+                if owner is None and owner_vmid.isdigit() and await self._vmid_in_use(int(owner_vmid), csrf_token, ticket):
+                    skipped[volid] = f"Owner VM {owner_vmid} exists but its config is not visible to this ticket"
+                    continue
+                if owner is not None and owner.has_snapshots and not force:
+                    blocked.append(volid)
+                    continue
+            plan[volid] = entry
+        if blocked:
+            raise HTTPException(status_code=409, detail=f"May still be referenced by snapshots (use force): {blocked}")
+        return plan, skipped
+
+    async def reclaim(self, volids: List[str], csrf_token: str, ticket: str, force: bool = False) -> Dict[str, Any]:
+        if self.last_report is None:
+            raise HTTPException(status_code=409, detail="Run a scan before reclaiming")
+        if not self.last_report["complete"]:
+            raise HTTPException(
+                status_code=409,
+                detail=f"The last scan could not read every VM config ({self.last_report['index']['failed_vmids']}); rescan first",
+            )
+        known = {e["volid"]: e for e in self.last_report["orphans"] + self.last_report["unused"]}
+        missing = [v for v in volids if v not in known]
+        if missing:
+            raise HTTPException(status_code=400, detail=f"Not in the last scan report: {missing}")
+        known, skipped = await self._recheck(volids, known, csrf_token, ticket, force)
+        volids = list(known)
+
+        semaphore = asyncio.Semaphore(RECLAIM_CONCURRENCY)
+        results: Dict[str, Optional[str]] = dict(skipped)
+
+        async def destroy_orphan(entry: Dict[str, Any]):
+            storage, volume = split_volid(entry["volid"])
+            async with semaphore:
+                response = await self.endpoints.request(
+                    "DELETE", f"/nodes/{entry['node']}/storage/{storage}/content/{quote(volume, safe='')}",
+                    node=entry["node"],
+                    headers={"CSRFPreventionToken": csrf_token}, cookies={"PVEAuthCookie": ticket},
+                )
+            results[entry["volid"]] = None if response.status_code in (200, 204) else response.text
+
+        async def drop_unused(vmid: int, keys: List[str], entries: List[Dict[str, Any]]):
+            vm = self.vms[vmid]
+            # Removing an unusedN key destroys its volume; one write per VM, guarded by the scanned digest
+            data = {"delete": ",".join(keys)}
+            if vm.digest:
+                data["digest"] = vm.digest
+            async with semaphore:
+                response = await self.endpoints.request(
+                    "PUT", f"/nodes/{vm.node}/{vm.type}/{vmid}/config", node=vm.node, data=data,
+                    headers={"CSRFPreventionToken": csrf_token}, cookies={"PVEAuthCookie": ticket},
+                )
+            error = None
+            try:
+                check_config_write(response.status_code, response.text, self.logger)
+                if response.status_code != 200:
+                    error = response.text
+            except HTTPException as e:
+                error = e.detail
+            for entry in entries:
+                results[entry["volid"]] = error
+            self.mark_stale(vmid)
+
+        jobs = []
+        by_vm: Dict[int, Tuple[List[str], List[Dict[str, Any]]]] = {}
+        for volid in volids:
+            entry = known[volid]
+            if "references" in entry:
+                for ref in entry["references"]:
+                    keys, entries = by_vm.setdefault(ref["vmid"], ([], []))
+                    keys.append(ref["key"])
+                    if entry not in entries:
+                        entries.append(entry)
+            else:
+                jobs.append(destroy_orphan(entry))
+        jobs.extend(drop_unused(vmid, keys, entries) for vmid, (keys, entries) in by_vm.items())
+        await asyncio.gather(*jobs)
+
+        for node in {known[v]["node"] for v in volids}:
+            self.catalog.invalidate(node)
+        reclaimed = [v for v, error in results.items() if error is None]
+        self.logger.info(f"Reclaimed {len(reclaimed)} of {len(results)} volumes")
+        return {
+            "reclaimed": reclaimed,
+            "reclaimed_bytes": sum(known[v]["size"] for v in reclaimed),
+            "errors": {v: error for v, error in results.items() if error is not None},
+        }
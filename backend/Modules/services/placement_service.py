@@ -0,0 +1,199 @@
+from Modules.logger import init_logger
+from Modules.proxmox_client import EndpointSet
+from Modules.pve_config import GIB, parse_config, split_volid
+from fastapi import HTTPException
+from typing import Any, Dict, List, Optional
+import time
+
+MIB = 1024**2
+# Placements made through the backend count against a node until /cluster/resources shows them
+RESERVATION_TTL = 120.0
+# A stopped VM may be started again, so its allocation counts partially
+STOPPED_WEIGHT = 0.5
+MAX_MEMORY_LOAD = 0.95
+WEIGHTS = {"cpu_alloc": 0.25, "mem_alloc": 0.25, "cpu_load": 0.2, "mem_load": 0.2, "storage": 0.1}
+
+
+class NodeLoad:
+    __slots__ = ("node", "maxcpu", "maxmem", "cpu", "mem", "alloc_cpu", "alloc_mem", "storages")
+
+    def __init__(self, node: Dict[str, Any]):
+        self.node = node["node"]
+        self.maxcpu = node.get("maxcpu") or 1
+        self.maxmem = node.get("maxmem") or 1
+        self.cpu = node.get("cpu") or 0.0
+        self.mem = node.get("mem") or 0
+        self.alloc_cpu = 0.0
+        self.alloc_mem = 0.0
+        # storage id -> {"total", "used", "shared"}
+        self.storages: Dict[str, Dict[str, Any]] = {}
+
+    def add(self, cores: float, mem_bytes: float, disk_bytes: float = 0, storage: Optional[str] = None, running: bool = True):
+        self.alloc_cpu += cores
+        self.alloc_mem += mem_bytes
+        if running:
+            # A new guest's usage is unknown; assume it uses what it is given
+            self.cpu += cores / self.maxcpu
+            self.mem += mem_bytes
+        if storage in self.storages:
+            self.storages[storage]["used"] += disk_bytes
+
+    def score(self, cores: int, mem_bytes: int, disk_bytes: int = 0, storage: Optional[str] = None) -> Dict[str, Any]:
+        # Lower is better; None when the VM does not fit at all
+        metrics = {
+            "cpu_alloc": (self.alloc_cpu + cores) / self.maxcpu,
+            "mem_alloc": (self.alloc_mem + mem_bytes) / self.maxmem,
+            "cpu_load": self.cpu,
+            "mem_load": (self.mem + mem_bytes) / self.maxmem,
+            "storage": 0.0,
+        }
+        reason = None
+        if storage:
+            info = self.storages.get(storage)
+            if info is None:
+                reason = f"storage '{storage}' not available"
+            elif info["total"] - info["used"] < disk_bytes:
+                reason = f"storage '{storage}' has {(info['total'] - info['used']) / GIB:.1f} GB free"
+            else:
+                metrics["storage"] = (info["used"] + disk_bytes) / (info["total"] or 1)
+        if reason is None and metrics["mem_load"] > MAX_MEMORY_LOAD:
+            reason = "not enough free memory"
+        score = sum(WEIGHTS[k] * v for k, v in metrics.items())
+        return {
+            "node": self.node,
+            "score": None if reason else round(score, 4),
+            "reason": reason,
+            "metrics": {k: round(v, 3) for k, v in metrics.items()},
+        }
+
+
+class PlacementService:
+    """
+    Picks the node for new or moved VMs from one /cluster/resources snapshot,
+    scoring allocated vs physical CPU and RAM, current load and free space on
+    the target storage. Batches are placed one at a time against the running
+    totals so they spread across nodes.
+    """
+
+    def __init__(self, log_file: str, endpoints: EndpointSet):
+        self.log_file = log_file
+        self.logger = init_logger(log_file, __name__)
+        self.endpoints = endpoints
+        self.reservations: List[Dict[str, Any]] = []
+
+    async def load(self, csrf_token: str, ticket: str) -> Dict[str, NodeLoad]:
+        response = await self.endpoints.request(
+            "GET", "/cluster/resources",
+            headers={"CSRFPreventionToken": csrf_token}, cookies={"PVEAuthCookie": ticket},
+        )
+        if response.status_code != 200:
+            raise HTTPException(status_code=response.status_code, detail="Failed to fetch cluster resources")
+        resources = response.json().get("data", [])
+
+        nodes = {
+            r["node"]: NodeLoad(r) for r in resources
+            if r.get("type") == "node" and r.get("status") == "online"
+        }
+        for r in resources:
+            if r.get("type") == "storage" and r.get("node") in nodes and r.get("status") == "available":
+                nodes[r["node"]].storages[r["storage"]] = {
+                    "total": r.get("maxdisk") or 0,
+                    "used": r.get("disk") or 0,
+                    "shared": bool(r.get("shared")),
+                }
+        for r in resources:
+            if r.get("type") in ("qemu", "lxc") and not r.get("template") and r.get("node") in nodes:
+                weight = 1.0 if r.get("status") == "running" else STOPPED_WEIGHT
+                node = nodes[r["node"]]
+                node.alloc_cpu += weight * (r.get("maxcpu") or 0)
+                node.alloc_mem += weight * (r.get("maxmem") or 0)
+
+        now = time.monotonic()
+        self.reservations = [r for r in self.reservations if now - r["at"] < RESERVATION_TTL]
+        for r in self.reservations:
+            if r["node"] in nodes:
+                nodes[r["node"]].add(r["cores"], r["mem"], r["disk"], r["storage"])
+        return nodes
+
+    def _pick(
+        self, nodes: Dict[str, NodeLoad], cores: int, mem_bytes: int, disk_bytes: int,
+        storage: Optional[str], storages: Optional[List[str]], exclude: Optional[List[str]],
+        home: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        scores = []
+        for node in nodes.values():
+            if exclude and node.node in exclude:
+                continue
+            result = node.score(cores, mem_bytes, disk_bytes, storage)
+            # With a home node, local storages only count there since that is where the data is
+            missing = [
+                s for s in storages or []
+                if s not in node.storages or (home and not node.storages[s]["shared"] and node.node != home)
+            ]
+            if result["score"] is not None and missing:
+                result["score"], result["reason"] = None, f"storages {missing} not available"
+            scores.append(result)
+        candidates = sorted((s for s in scores if s["score"] is not None), key=lambda s: s["score"])
+        if not candidates:
+            reasons = {s["node"]: s["reason"] for s in scores}
+            raise HTTPException(status_code=409, detail=f"No node can take the VM: {reasons}")
+        return {"node": candidates[0]["node"], "candidates": scores}
+
+    async def place(
+        self, specs: List[Dict[str, Any]], csrf_token: str, ticket: str, reserve: bool = True,
+    ) -> List[Dict[str, Any]]:
+        """
+        Each spec has cores, memory (MiB) and optionally disk (GB), storage,
+        storages (all must exist on the node; with `home` set, local ones
+        only count on that node) and exclude (node names).
+        """
+        nodes = await self.load(csrf_token, ticket)
+        placements = []
+        for spec in specs:
+            cores, mem_bytes = spec["cores"], spec["memory"] * MIB
+            disk_bytes = (spec.get("disk") or 0) * GIB
+            storage = spec.get("storage")
+            choice = self._pick(
+                nodes, cores, mem_bytes, disk_bytes, storage, spec.get("storages"), spec.get("exclude"), spec.get("home"),
+            )
+            nodes[choice["node"]].add(cores, mem_bytes, disk_bytes, storage)
+            if reserve:
+                self.reservations.append({
+                    "node": choice["node"], "cores": cores, "mem": mem_bytes,
+                    "disk": disk_bytes, "storage": storage, "at": time.monotonic(),
+                })
+            placements.append(choice)
+        self.logger.info(f"Placed {len(specs)} VM(s) on {[p['node'] for p in placements]}")
+        return placements
+
+    async def choose(
+        self, csrf_token: str, ticket: str, cores: int, memory: int, disk: int = 0,
+        storage: Optional[str] = None, storages: Optional[List[str]] = None, exclude: Optional[List[str]] = None,
+        home: Optional[str] = None,
+    ) -> str:
+        spec = {
+            "cores": cores, "memory": memory, "disk": disk, "storage": storage,
+            "storages": storages, "exclude": exclude, "home": home,
+        }
+        return (await self.place([spec], csrf_token, ticket))[0]["node"]
+
+    def clone_spec(self, node: str, config: Dict[str, Any], full: bool, storage: Optional[str] = None) -> Dict[str, Any]:
+        # Size the clone from the source config; linked clones need the source storages on the target
+        disks = parse_config(config).data_disks
+        source_storages = sorted({d.storage for d in disks if d.storage})
+        spec = {
+            "cores": int(config.get("cores", 1)) * int(config.get("sockets", 1)),
+            "memory": int(config.get("memory", 512)),
+        }
+        if full and storage:
+            spec.update(disk=sum(d.size or 0 for d in disks) // GIB, storage=storage)
+        else:
+            spec.update(storages=source_storages, home=node)
+        return spec
+
+    def create_spec(self, vm_create) -> Dict[str, Any]:
+        spec = {"cores": vm_create.cpus, "memory": vm_create.ram, "disk": vm_create.disk_size, "storage": vm_create.storage}
+        if vm_create.source == "ISO":
+            iso_storage, _ = split_volid(vm_create.iso)
+            spec["storages"] = [iso_storage] if iso_storage else []
+        return spec
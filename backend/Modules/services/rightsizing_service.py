@@ -0,0 +1,176 @@
+from Modules.logger import init_logger
+from Modules.proxmox_client import EndpointSet
+from Modules.models import VMUpdateRequest
+from fastapi import HTTPException
+from typing import Any, Dict, List, Optional, Set, Tuple
+from datetime import date
+import numpy as np
+import asyncio
+import math
+
+# The week RRD with MAX consolidation keeps the short peaks that averages hide
+HISTORY_TIMEFRAME = "week"
+HISTORY_CF = "MAX"
+HISTORY_CONCURRENCY = 8
+PERCENTILE = 95
+HEADROOM = 0.25
+MEMORY_STEP_MIB = 256
+MIN_MEMORY_MIB = 512
+MIB = 1024**2
+
+
+class RightsizingService:
+    """
+    Suggests core and memory sizes from each VM's usage history. The history
+    of all VMs is reduced in one vectorized pass, and the report is cached per day.
+    """
+
+    def __init__(self, log_file: str, endpoints: EndpointSet):
+        self.log_file = log_file
+        self.logger = init_logger(log_file, __name__)
+        self.endpoints = endpoints
+        # Shared for the day; computed from the broadest ticket seen and filtered per caller
+        self.report: Optional[Dict[str, Any]] = None
+        self.report_scope = 0
+
+    async def _get(self, path: str, csrf_token: str, ticket: str, node: Optional[str] = None, **params) -> Any:
+        response = await self.endpoints.request(
+            "GET", path, node=node, params=params or None,
+            headers={"CSRFPreventionToken": csrf_token}, cookies={"PVEAuthCookie": ticket},
+        )
+        if response.status_code != 200:
+            raise HTTPException(status_code=response.status_code, detail=f"Failed to fetch {path}")
+        return response.json().get("data", [])
+
+    async def _history(self, vms: List[Dict[str, Any]], csrf_token: str, ticket: str) -> List[Optional[List[Dict[str, Any]]]]:
+        semaphore = asyncio.Semaphore(HISTORY_CONCURRENCY)
+
+        async def fetch(vm: Dict[str, Any]) -> Optional[List[Dict[str, Any]]]:
+            async with semaphore:
+                try:
+                    return await self._get(
+                        f"/nodes/{vm['node']}/qemu/{vm['vmid']}/rrddata", csrf_token, ticket, node=vm["node"],
+                        timeframe=HISTORY_TIMEFRAME, cf=HISTORY_CF,
+                    )
+                except Exception as e:
+                    self.logger.warning(f"No usage history for VM {vm['vmid']}: {e}")
+                    return None
+
+        return await asyncio.gather(*(fetch(vm) for vm in vms))
+
+    @staticmethod
+    def _matrix(histories: List[List[Dict[str, Any]]], field: str) -> np.ndarray:
+        # One row per VM, NaN-padded to the longest history
+        width = max((len(h) for h in histories), default=0)
+        matrix = np.full((len(histories), max(width, 1)), np.nan)
+        for row, history in enumerate(histories):
+            values = [r.get(field) for r in history]
+            matrix[row, :len(values)] = [v if v is not None else np.nan for v in values]
+        return matrix
+
+    def recommend(self, vms: List[Dict[str, Any]], histories: List[List[Dict[str, Any]]]) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        vcpus = np.array([vm.get("maxcpu", 1) for vm in vms], dtype=np.float64)
+        maxmem = np.array([vm.get("maxmem", 0) for vm in vms], dtype=np.float64)
+
+        # rrd "cpu" is a fraction of all vCPUs; scale to cores before taking percentiles
+        with np.errstate(all="ignore"):
+            cpu_p = np.nanpercentile(self._matrix(histories, "cpu") * vcpus[:, None], PERCENTILE, axis=1)
+            mem_p = np.nanpercentile(self._matrix(histories, "mem"), PERCENTILE, axis=1)
+
+        rec_vcpus = np.maximum(1, np.ceil(cpu_p * (1 + HEADROOM)))
+        rec_mem_mib = np.maximum(MIN_MEMORY_MIB, np.ceil(mem_p * (1 + HEADROOM) / MIB / MEMORY_STEP_MIB) * MEMORY_STEP_MIB)
+        # Never suggest growing beyond what is allocated; no history means no suggestion
+        unknown = np.isnan(cpu_p) | np.isnan(mem_p)
+        rec_vcpus = np.where(unknown, vcpus, np.minimum(rec_vcpus, vcpus))
+        rec_mem_mib = np.where(unknown, maxmem / MIB, np.minimum(rec_mem_mib, maxmem / MIB))
+        return cpu_p, mem_p, rec_vcpus, rec_mem_mib
+
+    @staticmethod
+    def _visible(report: Dict[str, Any], vmids: Optional[Set[int]], nodes: Optional[Set[str]]) -> Dict[str, Any]:
+        if vmids is None:
+            return report
+        return dict(
+            report,
+            recommendations=[r for r in report["recommendations"] if r["vmid"] in vmids],
+            nodes={name: info for name, info in report["nodes"].items() if nodes is not None and name in nodes},
+        )
+
+    async def get_report(
+        self, csrf_token: str, ticket: str, refresh: bool = False,
+        vmids: Optional[Set[int]] = None, nodes: Optional[Set[str]] = None,
+    ) -> Dict[str, Any]:
+        # vmids/nodes: what the caller may see; None returns the whole report
+        today = date.today().isoformat()
+        if not refresh and self.report and self.report["day"] == today:
+            return self._visible(self.report, vmids, nodes)
+
+        resources = await self._get("/cluster/resources", csrf_token, ticket)
+        vms = [r for r in resources if r.get("type") == "qemu" and not r.get("template")]
+        nodes = {r["node"]: r for r in resources if r.get("type") == "node"}
+        self.logger.info(f"Computing right-sizing recommendations for {len(vms)} VMs")
+
+        fetched = await self._history(vms, csrf_token, ticket)
+        histories = [h or [] for h in fetched]
+        cpu_p, mem_p, rec_vcpus, rec_mem_mib = self.recommend(vms, histories)
+
+        recommendations = []
+        freed: Dict[str, Dict[str, float]] = {}
+        for i, vm in enumerate(vms):
+            vcpus, mem_mib = int(vm.get("maxcpu", 1)), int(vm.get("maxmem", 0) // MIB)
+            cores_saved = vcpus - int(rec_vcpus[i])
+            mem_saved = mem_mib - int(rec_mem_mib[i])
+            recommendations.append({
+                "vmid": vm["vmid"],
+                "node": vm["node"],
+                "name": vm.get("name"),
+                "samples": len(histories[i]),
+                "vcpus": vcpus,
+                "memory_mib": mem_mib,
+                f"cpu_p{PERCENTILE}_cores": None if math.isnan(cpu_p[i]) else round(float(cpu_p[i]), 3),
+                f"mem_p{PERCENTILE}_mib": None if math.isnan(mem_p[i]) else round(float(mem_p[i]) / MIB, 1),
+                "recommended_vcpus": int(rec_vcpus[i]),
+                "recommended_memory_mib": int(rec_mem_mib[i]),
+                "change": cores_saved > 0 or mem_saved > 0,
+            })
+            node = freed.setdefault(vm["node"], {"cores": 0, "memory_mib": 0})
+            node["cores"] += cores_saved
+            node["memory_mib"] += mem_saved
+
+        capacity = {}
+        for name, saved in freed.items():
+            info = nodes.get(name, {})
+            capacity[name] = {
+                "cores_freed": saved["cores"],
+                "memory_freed_mib": saved["memory_mib"],
+                # Share of the node's physical capacity that is currently allocated but unused
+                "cpu_fraction": round(saved["cores"] / info["maxcpu"], 3) if info.get("maxcpu") else None,
+                "memory_fraction": round(saved["memory_mib"] * MIB / info["maxmem"], 3) if info.get("maxmem") else None,
+            }
+
+        report = {
+            "day": today,
+            "percentile": PERCENTILE,
+            "headroom": HEADROOM,
+            "recommendations": sorted(recommendations, key=lambda r: (not r["change"], r["vmid"])),
+            "nodes": capacity,
+        }
+        # A narrower ticket's refresh is answered but does not replace the shared report
+        if self.report is None or self.report["day"] != today or len(resources) >= self.report_scope:
+            self.report, self.report_scope = report, len(resources)
+        return self._visible(report, vmids, nodes)
+
+    def get_recommendation(self, vmid: int) -> Dict[str, Any]:
+        if self.report is None:
+            raise HTTPException(status_code=409, detail="No recommendations computed yet")
+        for rec in self.report["recommendations"]:
+            if rec["vmid"] == vmid:
+                return rec
+        raise HTTPException(status_code=404, detail=f"No recommendation for VM {vmid}")
+
+    def as_update(self, rec: Dict[str, Any], config: Dict[str, Any]) -> VMUpdateRequest:
+        # The update path sets cores per socket, so spread the vCPU count over the configured sockets
+        sockets = int(config.get("sockets", 1) or 1)
+        return VMUpdateRequest(
+            cpus=max(1, math.ceil(rec["recommended_vcpus"] / sockets)),
+            ram=rec["recommended_memory_mib"],
+        )
@@ -0,0 +1,270 @@
+from Modules.logger import init_logger
+from Modules.proxmox_client import EndpointSet
+from Modules.pve_config import parse_config
+from .orphan_service import VMVolumes
+from .agent_service import AgentService
+from fastapi import HTTPException
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+from bisect import bisect_left, bisect_right
+import asyncio
+import time
+import re
+
+FETCH_CONCURRENCY = 16
+REFRESH_INTERVAL = 30.0
+# Configs and agent data older than this are re-read even if nothing marked them stale
+MAX_AGE = 300.0
+MAX_RESULTS = 50
+
+_LXC_HWADDR = re.compile(r"(?:^|,)hwaddr=([0-9A-Fa-f:]{17})")
+_CONFIG_IP = re.compile(r"(?:^|,)ip6?=([0-9A-Fa-f:.]+)(?:/\d+)?(?=,|$)")
+_MATCH_RANK = {"exact": 0, "prefix": 1, "substring": 2}
+
+
+def config_terms(vm_type: str, config: Dict[str, Any]) -> Dict[str, List[str]]:
+    # Searchable values per field from a qemu or lxc config
+    fields: Dict[str, List[str]] = {
+        "name": [config.get("name") or config.get("hostname") or ""],
+        "tags": [t for t in re.split(r"[;,\s]+", config.get("tags") or "") if t],
+        "mac": [],
+        "ip": [],
+        "volid": [],
+    }
+    if vm_type == "qemu":
+        fields["mac"] = [nic.mac for nic in parse_config(config).nics if nic.mac]
+    for key, value in config.items():
+        if not isinstance(value, str):
+            continue
+        if vm_type == "lxc" and key.startswith("net"):
+            fields["mac"] += _LXC_HWADDR.findall(value)
+        # Static addresses: lxc netN, cloud-init ipconfigN
+        if key.startswith("ipconfig") or (vm_type == "lxc" and key.startswith("net")):
+            fields["ip"] += _CONFIG_IP.findall(value)
+    volumes = VMVolumes(0, "", vm_type, config)
+    fields["volid"] = list(volumes.attached.values()) + list(volumes.unused.values())
+    return fields
+
+
+class SearchService:
+    """
+    In-memory index over VM names, tags, IPs, MACs and disk volids. Terms are
+    kept sorted for prefix lookups and joined into one string for substring
+    scans, rebuilt lazily after changes. Fed by a background refresh and by
+    any config or agent data the VM listing already fetched.
+    """
+
+    def __init__(self, log_file: str, endpoints: EndpointSet):
+        self.log_file = log_file
+        self.logger = init_logger(log_file, __name__)
+        self.endpoints = endpoints
+        self.agent_service = AgentService(log_file)
+        # vmid -> {"vmid", "node", "type", "status", "fields": {field: [values]}, "config_at", "agent_at"}
+        self.docs: Dict[int, Dict[str, Any]] = {}
+        # lowercased term -> {(vmid, field)}
+        self.postings: Dict[str, Set[Tuple[int, str]]] = {}
+        self.stale: Set[int] = set()
+        # The accepted ticket that sees the most resources; a narrower one never replaces it
+        self.credentials: Optional[Tuple[str, str]] = None
+        self.scope = 0
+        self.wake = asyncio.Event()
+        self._terms: List[str] = []
+        self._offsets: List[int] = []
+        self._blob = ""
+        self._dirty = False
+
+    def remember(self, csrf_token: str, ticket: str, scope: int):
+        # Only call with credentials Proxmox accepted; scope is how many cluster resources they can see.
+        # The first credentials seen start indexing right away instead of at the next interval
+        if self.credentials is None:
+            self.wake.set()
+        elif scope < self.scope:
+            return
+        self.credentials, self.scope = (csrf_token, ticket), scope
+
+    def mark_stale(self, vmid: int):
+        self.stale.add(vmid)
+
+    def _doc(self, vmid: int, node: str, vm_type: str) -> Dict[str, Any]:
+        doc = self.docs.setdefault(vmid, {"vmid": vmid, "fields": {}, "status": None, "config_at": 0.0, "agent_at": 0.0})
+        doc.update(node=node, type=vm_type)
+        return doc
+
+    def _set_field(self, doc: Dict[str, Any], field: str, values: Iterable[str]):
+        values = sorted({v for v in values if v})
+        if doc["fields"].get(field) == values:
+            return
+        posting = (doc["vmid"], field)
+        for value in doc["fields"].get(field, []):
+            term = value.lower()
+            entries = self.postings.get(term)
+            if entries:
+                entries.discard(posting)
+                if not entries:
+                    del self.postings[term]
+        for value in values:
+            self.postings.setdefault(value.lower(), set()).add(posting)
+        doc["fields"][field] = values
+        self._dirty = True
+
+    def update_config(self, vmid: int, node: str, vm_type: str, config: Dict[str, Any]):
+        doc = self._doc(vmid, node, vm_type)
+        for field, values in config_terms(vm_type, config).items():
+            self._set_field(doc, field, values)
+        doc["config_at"] = time.monotonic()
+        self.stale.discard(vmid)
+
+    def update_agent_ips(self, vmid: int, node: str, ips: List[str]):
+        doc = self._doc(vmid, node, self.docs.get(vmid, {}).get("type", "qemu"))
+        self._set_field(doc, "agent_ip", ips)
+        doc["agent_at"] = time.monotonic()
+
+    def remove(self, vmid: int):
+        doc = self.docs.get(vmid)
+        if doc is None:
+            return
+        for field in list(doc["fields"]):
+            self._set_field(doc, field, [])
+        del self.docs[vmid]
+
+    def _rebuild(self):
+        if not self._dirty:
+            return
+        self._terms = sorted(self.postings)
+        self._offsets, position = [], 0
+        for term in self._terms:
+            self._offsets.append(position)
+            position += len(term) + 1
+        self._blob = "\n".join(self._terms)
+        self._dirty = False
+
+    def search(self, q: str, limit: int = MAX_RESULTS, visible: Optional[Set[int]] = None) -> Dict[str, Any]:
+        started = time.perf_counter()
+        query = " ".join(q.lower().split())
+        if not query:
+            raise HTTPException(status_code=400, detail="Empty search query")
+        self._rebuild()
+
+        matched: Dict[str, str] = {}
+        start = bisect_left(self._terms, query)
+        for term in self._terms[start:]:
+            if not term.startswith(query):
+                break
+            matched[term] = "exact" if term == query else "prefix"
+        position = self._blob.find(query)
+        while position != -1:
+            i = bisect_right(self._offsets, position) - 1
+            term = self._terms[i]
+            matched.setdefault(term, "substring")
+            # Continue from the next term so each one is reported once
+            position = self._blob.find(query, self._offsets[i] + len(term) + 1)
+
+        hits: Dict[int, Dict[str, Any]] = {}
+        for term, kind in matched.items():
+            for vmid, field in self.postings.get(term, ()):
+                if visible is not None and vmid not in visible:
+                    continue
+                doc = self.docs[vmid]
+                hit = hits.setdefault(vmid, {
+                    "vmid": vmid,
+                    "node": doc["node"],
+                    "type": doc["type"],
+                    "name": (doc["fields"].get("name") or [None])[0],
+                    "status": doc["status"],
+                    "rank": _MATCH_RANK[kind],
+                    "matches": [],
+                })
+                value = next((v for v in doc["fields"][field] if v.lower() == term), term)
+                hit["matches"].append({"field": field, "value": value, "match": kind})
+                hit["rank"] = min(hit["rank"], _MATCH_RANK[kind])
+
+        results = sorted(hits.values(), key=lambda h: (h["rank"], h["vmid"]))
+        for hit in results:
+            del hit["rank"]
+        return {
+            "query": query,
+            "total": len(results),
+            "results": results[:limit],
+            "indexed": len(self.docs) if visible is None else len(visible & self.docs.keys()),
+            "took_ms": round((time.perf_counter() - started) * 1000, 3),
+        }
+
+    async def _get(self, path: str, csrf_token: str, ticket: str, node: Optional[str] = None, **params) -> Any:
+        response = await self.endpoints.request(
+            "GET", path, node=node, params=params or None,
+            headers={"CSRFPreventionToken": csrf_token}, cookies={"PVEAuthCookie": ticket},
+        )
+        if response.status_code != 200:
+            raise HTTPException(status_code=response.status_code, detail=f"Failed to fetch {path}: {response.text}")
+        return response.json().get("data")
+
+    async def refresh(self, csrf_token: str, ticket: str, max_age: float = MAX_AGE, prune: bool = True) -> Dict[str, int]:
+        # Only the stored (broadest) credentials prune: a narrower ticket's listing just leaves VMs out.
+        # Visibility is enforced per query, not by what is indexed
+        resources = await self._get("/cluster/resources", csrf_token, ticket, type="vm")
+        current = {r["vmid"]: r for r in resources if r.get("type") in ("qemu", "lxc")}
+        if prune:
+            for vmid in self.docs.keys() - current.keys():
+                self.remove(vmid)
+
+        now = time.monotonic()
+        configs, agents = [], []
+        for vmid, r in current.items():
+            doc = self.docs.get(vmid)
+            if doc is not None:
+                doc["status"] = r.get("status")
+            fresh = doc is not None and doc["node"] == r["node"]
+            if not fresh or vmid in self.stale or now - doc["config_at"] > max_age:
+                configs.append(r)
+            # Only running qemu guests have an agent to ask
+            if r["type"] == "qemu" and r.get("status") == "running" and (not fresh or now - doc["agent_at"] > max_age):
+                agents.append(r)
+            elif doc is not None and r.get("status") != "running" and doc["fields"].get("agent_ip"):
+                self.update_agent_ips(vmid, r["node"], [])
+        semaphore = asyncio.Semaphore(FETCH_CONCURRENCY)
+
+        async def fetch_config(r: Dict[str, Any]):
+            async with semaphore:
+                config = await self._get(f"/nodes/{r['node']}/{r['type']}/{r['vmid']}/config", csrf_token, ticket, node=r["node"])
+            self.update_config(r["vmid"], r["node"], r["type"], config or {})
+            self.docs[r["vmid"]]["status"] = r.get("status")
+
+        async def fetch_agent(r: Dict[str, Any]):
+            async with semaphore:
+                try:
+                    data = await self._get(
+                        f"/nodes/{r['node']}/qemu/{r['vmid']}/agent/network-get-interfaces", csrf_token, ticket, node=r["node"],
+                    )
+                except HTTPException:
+                    # No agent installed or not answering; remember that for a while instead of asking every pass
+                    data = None
+            self.update_agent_ips(r["vmid"], r["node"], self.agent_service.list_ip_addresses(data))
+
+        # Configs first so agent-only documents get their node and type from the config pass
+        results = await asyncio.gather(*(fetch_config(r) for r in configs), return_exceptions=True)
+        results += await asyncio.gather(*(fetch_agent(r) for r in agents), return_exceptions=True)
+        failed = sum(isinstance(r, Exception) for r in results)
+        if failed:
+            self.logger.warning(f"Search index refresh: {failed} fetches failed")
+        return {"vms": len(current), "configs": len(configs), "agents": len(agents), "failed": failed}
+
+    async def run(self, interval: float = REFRESH_INTERVAL):
+        while True:
+            if self.credentials:
+                try:
+                    stats = await self.refresh(*self.credentials)
+                    if stats["configs"] or stats["agents"]:
+                        self.logger.info(f"Search index refreshed: {stats}")
+                except HTTPException as e:
+                    if e.status_code == 401:
+                        # Expired ticket: wait for the next search to bring a fresh one
+                        self.credentials, self.scope = None, 0
+                        self.logger.warning("Search index refresh paused: the stored ticket has expired")
+                    else:
+                        self.logger.warning(f"Search index refresh failed: {e.detail}")
+                except Exception as e:
+                    self.logger.warning(f"Search index refresh failed: {e}")
+            self.wake.clear()
+            try:
+                await asyncio.wait_for(self.wake.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
@@ -1,20 +1,103 @@
 from Modules.logger import init_logger
-from typing import List, Dict, Any
+from Modules.proxmox_client import PROXMOX_BASE_URL
+from .catalog_service import CatalogService
+from .task_registry import TaskRegistry
+from typing import List, Dict, Any, Optional, Set
 from fastapi import HTTPException
+import contextlib
 import requests
 import urllib3
+import asyncio
+import httpx
+import time
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-PROXMOX_BASE_URL = "https://pve.home.lab:8006/api2/json"
+
+# Trees are also re-read after this long, to pick up changes made outside the backend
+TREE_TTL = 300.0
+
+
+class SnapshotTreeCache:
+    """
+    Snapshot trees per VM. The backend drops a VM's entry when it creates,
+    deletes or rolls back a snapshot, and does not cache again until that task ends.
+    Shared by all callers: routes check the caller's access before reading it.
+    """
+
+    def __init__(self, registry: Optional[TaskRegistry] = None):
+        self.registry = registry
+        self.entries: Dict[int, Dict[str, Any]] = {}
+        self.pending: Dict[int, str] = {}
+
+    def _settled(self, vmid: int) -> bool:
+        upid = self.pending.get(vmid)
+        if upid is None:
+            return True
+        task = self.registry.get(upid) if self.registry else None
+        if task is not None and task["status"] == "running":
+            return False
+        # The task ended, so anything cached while it ran is outdated
+        self.pending.pop(vmid, None)
+        self.entries.pop(vmid, None)
+        return True
+
+    def get(self, node: str, vmid: int) -> Optional[Dict[str, Any]]:
+        if not self._settled(vmid):
+            return None
+        entry = self.entries.get(vmid)
+        # A tree read on another node predates a migration
+        if entry is None or entry["node"] != node or time.monotonic() - entry["fetched_at"] > TREE_TTL:
+            return None
+        return entry["tree"]
+
+    def put(self, node: str, vmid: int, tree: Dict[str, Any]):
+        if self._settled(vmid):
+            self.entries[vmid] = {"node": node, "fetched_at": time.monotonic(), "tree": tree}
+
+    def invalidate(self, vmid: int, upid: Optional[str] = None):
+        self.entries.pop(vmid, None)
+        if isinstance(upid, str) and upid.startswith("UPID:") and self.registry:
+            self.pending[vmid] = upid
+
+
+def build_snapshot_tree(vmid: int, snapshots: List[Dict[str, Any]], sizes: Optional[Dict[str, int]] = None) -> Dict[str, Any]:
+    # Proxmox lists snapshots flat with a parent name; "current" marks where the VM is now
+    sizes = sizes or {}
+    nodes = {
+        snap["name"]: {
+            "name": snap["name"],
+            "parent": snap.get("parent"),
+            "description": snap.get("description", ""),
+            "snaptime": snap.get("snaptime"),
+            "vmstate": bool(snap.get("vmstate")),
+            "size": sizes.get(snap["name"]),
+            "current": snap["name"] == "current",
+            "children": [],
+        }
+        for snap in snapshots
+    }
+    roots = []
+    for node in sorted(nodes.values(), key=lambda n: (n["current"], n["snaptime"] or 0)):
+        parent = nodes.get(node["parent"])
+        (parent["children"] if parent else roots).append(node)
+    current = nodes.get("current")
+    return {
+        "vmid": vmid,
+        "current_parent": current["parent"] if current else None,
+        "count": len(nodes) - (1 if current else 0),
+        "tree": roots,
+    }
 
 
 class SnapshotService:
-    def __init__(self, log_file: str):
+    def __init__(self, log_file: str, catalog: Optional[CatalogService] = None, trees: Optional[SnapshotTreeCache] = None):
         self.session = requests.Session()
         self.session.verify = False
 
         self.log_file = log_file
         self.logger = init_logger(log_file, __name__)
+        self.catalog = catalog
+        self.trees = trees if trees is not None else SnapshotTreeCache()
 
     def set_auth_cookie(self, ticket: str):
         self.session.cookies.set("PVEAuthCookie", ticket)
@@ -35,10 +118,103 @@ class SnapshotService:
         self.logger.debug(f"Snapshots fetched: {snapshots}")
 
         return [
-            {"name": snap["name"], "description": snap.get("description", ""), "snaptime": snap.get("snaptime")}
+            {
+                "name": snap["name"],
+                "description": snap.get("description", ""),
+                "snaptime": snap.get("snaptime"),
+                "parent": snap.get("parent"),
+                "vmstate": bool(snap.get("vmstate")),
+            }
             for snap in snapshots if snap["name"] != "current"
         ]
 
+    def state_sizes(self, node: str, vmid: int, snapshots: List[Dict[str, Any]], csrf_token: str, ticket: str) -> Dict[str, int]:
+        # Only RAM state volumes (vm-<vmid>-state-<snap>) show up with a size in storage listings
+        names = [s["name"] for s in snapshots if s.get("vmstate")]
+        if not names or self.catalog is None:
+            return {}
+        try:
+            images = self.catalog.find_content(node, "images", csrf_token, ticket)
+        except HTTPException as e:
+            self.logger.warning(f"Could not list images on node {node} for snapshot sizes: {e.detail}")
+            return {}
+        sizes = {}
+        for item in images:
+            volume = item.get("volid", "").split(":", 1)[-1].rsplit("/", 1)[-1]
+            for name in names:
+                if volume.split(".")[0] == f"vm-{vmid}-state-{name}":
+                    sizes[name] = item.get("size")
+        return sizes
+
+    def get_snapshot_tree(self, node: str, vmid: int, csrf_token: str, ticket: str) -> Dict[str, Any]:
+        tree = self.trees.get(node, vmid)
+        if tree is not None:
+            return tree
+
+        self.logger.info(f"Fetching snapshot tree for VM {vmid} on node {node}")
+        self.set_auth_cookie(ticket)
+        response = self.session.get(
+            f"{PROXMOX_BASE_URL}/nodes/{node}/qemu/{vmid}/snapshot",
+            headers={"CSRFPreventionToken": csrf_token}
+        )
+        if response.status_code != 200:
+            raise HTTPException(status_code=response.status_code, detail="Failed to fetch snapshots")
+        snapshots = response.json()["data"]
+
+        tree = build_snapshot_tree(vmid, snapshots, self.state_sizes(node, vmid, snapshots, csrf_token, ticket))
+        self.trees.put(node, vmid, tree)
+        return tree
+
+    async def get_snapshot_trees(
+        self, node: str, vmids: List[int], csrf_token: str, ticket: str,
+        api_url: str = PROXMOX_BASE_URL, client: Optional[httpx.AsyncClient] = None,
+        visible: Optional[Set[int]] = None,
+    ) -> Dict[int, Dict[str, Any]]:
+        # visible: VMs on the node the caller may see; others are never answered from the shared cache
+        trees: Dict[int, Dict[str, Any]] = {}
+        missing = []
+        for vmid in dict.fromkeys(vmids):
+            if visible is not None and vmid not in visible:
+                trees[vmid] = {"vmid": vmid, "error": f"VM {vmid} not found on node {node}"}
+                continue
+            tree = self.trees.get(node, vmid)
+            if tree is not None:
+                trees[vmid] = tree
+            else:
+                missing.append(vmid)
+        if not missing:
+            return trees
+
+        self.logger.info(f"Fetching snapshot trees for VMs {missing} on node {node}")
+        headers = {"CSRFPreventionToken": csrf_token}
+        cookies = {"PVEAuthCookie": ticket}
+        client_ctx = httpx.AsyncClient(verify=False, timeout=10.0) if client is None else contextlib.nullcontext(client)
+        async with client_ctx as client:
+            async def fetch(vmid: int) -> List[Dict[str, Any]]:
+                r = await client.get(f"{api_url}/nodes/{node}/qemu/{vmid}/snapshot", headers=headers, cookies=cookies)
+                if r.status_code != 200:
+                    raise HTTPException(status_code=r.status_code, detail=f"Failed to fetch snapshots of VM {vmid}")
+                return r.json()["data"]
+
+            results = await asyncio.gather(*(fetch(vmid) for vmid in missing), return_exceptions=True)
+
+        fetched = {vmid: r for vmid, r in zip(missing, results) if not isinstance(r, Exception)}
+        # The catalog caches the node's image listing, so this reads storage once for all VMs
+        sizes = {
+            vmid: await asyncio.to_thread(self.state_sizes, node, vmid, snaps, csrf_token, ticket)
+            for vmid, snaps in fetched.items() if any(s.get("vmstate") for s in snaps)
+        }
+
+        for vmid, result in zip(missing, results):
+            if isinstance(result, Exception):
+                detail = result.detail if isinstance(result, HTTPException) else str(result)
+                trees[vmid] = {"vmid": vmid, "error": detail}
+                continue
+            tree = build_snapshot_tree(vmid, result, sizes.get(vmid))
+            self.trees.put(node, vmid, tree)
+            trees[vmid] = tree
+        return trees
+
     def create_snapshot(self, node: str, vmid: int, snapname: str, description: str, vmstate: int, csrf_token: str, ticket: str) -> str:
         self.logger.info(f"Creating snapshot '{snapname}' for VM {vmid} on node {node}")
         self.set_auth_cookie(ticket)
@@ -54,7 +230,9 @@ class SnapshotService:
             self.logger.debug(f"Response status code: {response.status_code}")
             response.raise_for_status()
 
-            return response.json()["data"]
+            upid = response.json()["data"]
+            self.trees.invalidate(vmid, upid)
+            return upid
         
         except requests.exceptions.HTTPError as http_err:
             self.logger.error(f"HTTP error occurred: {http_err}")
@@ -89,7 +267,9 @@ class SnapshotService:
             self.logger.error(f"Failed to revert snapshot '{snapname}': {response.text}")
             raise HTTPException(status_code=response.status_code, detail=f"Failed to revert snapshot {snapname}")
         
-        return response.json()["data"]
+        upid = response.json()["data"]
+        self.trees.invalidate(vmid, upid)
+        return upid
 
     def delete_snapshot(self, node: str, vmid: int, snapname: str, csrf_token: str, ticket: str) -> str:
         self.logger.info(f"Deleting snapshot '{snapname}' for VM {vmid} on node {node}")
@@ -104,4 +284,6 @@ class SnapshotService:
             self.logger.error(f"Failed to delete snapshot '{snapname}': {response.text}")
             raise HTTPException(status_code=response.status_code, detail=f"Failed to delete snapshot {snapname}")
         
-        return response.json()["data"]
+        upid = response.json()["data"]
+        self.trees.invalidate(vmid, upid)
+        return upid
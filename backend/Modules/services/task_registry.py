@@ -0,0 +1,188 @@
+from Modules.logger import init_logger
+from Modules.proxmox_client import EndpointSet
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import threading
+import json
+import asyncio
+import sqlite3
+import time
+
+POLL_INTERVAL = 3.0
+POLL_LIMIT = 500
+STATUS_CONCURRENCY = 8
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    upid TEXT PRIMARY KEY,
+    node TEXT NOT NULL,
+    vmid INTEGER,
+    type TEXT,
+    user TEXT,
+    status TEXT NOT NULL DEFAULT 'running',
+    exitstatus TEXT,
+    starttime INTEGER,
+    endtime INTEGER,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tasks_status_node ON tasks (status, node);
+CREATE INDEX IF NOT EXISTS tasks_vmid ON tasks (vmid);
+"""
+
+
+def parse_upid(upid: str) -> Dict[str, Any]:
+    # UPID:{node}:{pid}:{pstart}:{starttime}:{type}:{id}:{user}:
+    parts = upid.split(":")
+    if len(parts) < 8 or parts[0] != "UPID":
+        raise ValueError(f"Invalid UPID: {upid}")
+    return {
+        "node": parts[1],
+        "starttime": int(parts[4], 16),
+        "type": parts[5],
+        "vmid": int(parts[6]) if parts[6].isdigit() else None,
+        "user": parts[7],
+    }
+
+
+class TaskRegistry:
+    """
+    Local record of every Proxmox task the backend starts. Open tasks are
+    refreshed with one /nodes/{node}/tasks listing per node per interval instead
+    of a status call per UPID, and finished tasks stay in the table for auditing.
+    """
+
+    def __init__(self, log_file: str, db_path: str, endpoints: EndpointSet):
+        self.log_file = log_file
+        self.logger = init_logger(log_file, __name__)
+        self.endpoints = endpoints
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(SCHEMA)
+        # Polling needs a live ticket; the most recent one seen per node is kept in memory only
+        self.credentials: Dict[str, Tuple[str, str]] = {}
+
+    def record(self, upid: str, csrf_token: str, ticket: str, vmid: Optional[int] = None) -> Dict[str, Any]:
+        info = parse_upid(upid)
+        now = time.time()
+        self.credentials[info["node"]] = (csrf_token, ticket)
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT OR IGNORE INTO tasks (upid, node, vmid, type, user, starttime, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (upid, info["node"], vmid if vmid is not None else info["vmid"], info["type"],
+                 info["user"], info["starttime"], now, now),
+            )
+        self.logger.info(f"Tracking task {upid}")
+        return self.get(upid)
+
+    def get(self, upid: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            row = self.db.execute("SELECT * FROM tasks WHERE upid = ?", (upid,)).fetchone()
+        return dict(row) if row else None
+
+    def list_tasks(
+        self, status: Optional[str] = None, node: Optional[str] = None, vmid: Optional[int] = None,
+        user: Optional[str] = None, limit: int = 100, offset: int = 0,
+        visible: Optional[Iterable[int]] = None, owner: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        # visible/owner restrict the listing to tasks on those VMs or started by that user
+        clauses, params = [], []
+        for column, value in (("status", status), ("node", node), ("vmid", vmid), ("user", user)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        if visible is not None:
+            clauses.append("(vmid IN (SELECT value FROM json_each(?)) OR user = ?)")
+            params += [json.dumps(sorted(visible)), owner]
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self.lock:
+            rows = self.db.execute(
+                f"SELECT * FROM tasks {where} ORDER BY starttime DESC LIMIT ? OFFSET ?",
+                (*params, limit, offset),
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def _open_tasks(self) -> Dict[str, List[sqlite3.Row]]:
+        with self.lock:
+            rows = self.db.execute("SELECT upid, node, starttime FROM tasks WHERE status = 'running'").fetchall()
+        by_node: Dict[str, List[sqlite3.Row]] = {}
+        for row in rows:
+            by_node.setdefault(row["node"], []).append(row)
+        return by_node
+
+    async def poll_node(self, node: str, open_tasks: List[sqlite3.Row]):
+        if node not in self.credentials:
+            return
+        csrf_token, ticket = self.credentials[node]
+        response = await self.endpoints.request(
+            "GET",
+            f"/nodes/{node}/tasks",
+            node=node,
+            params={"source": "all", "since": min(t["starttime"] for t in open_tasks), "limit": POLL_LIMIT},
+            headers={"CSRFPreventionToken": csrf_token},
+            cookies={"PVEAuthCookie": ticket},
+        )
+        if response.status_code != 200:
+            self.logger.warning(f"Task listing for node {node} failed: {response.status_code} {response.text}")
+            return
+
+        wanted = {t["upid"] for t in open_tasks}
+        now = time.time()
+        entries = response.json().get("data", [])
+        finished = [
+            (entry["status"], entry.get("endtime"), now, entry["upid"])
+            for entry in entries
+            if entry.get("upid") in wanted and entry.get("status")
+        ]
+        # On a busy node the listing is cut at POLL_LIMIT rows and older open tasks fall off it;
+        # those are asked about one by one so waits and locks depending on them still end
+        missing = wanted - {entry.get("upid") for entry in entries}
+        if missing:
+            semaphore = asyncio.Semaphore(STATUS_CONCURRENCY)
+
+            async def status(upid: str) -> Optional[Dict[str, Any]]:
+                async with semaphore:
+                    r = await self.endpoints.request(
+                        "GET", f"/nodes/{node}/tasks/{upid}/status", node=node,
+                        headers={"CSRFPreventionToken": csrf_token}, cookies={"PVEAuthCookie": ticket},
+                    )
+                return r.json().get("data") if r.status_code == 200 else None
+
+            results = await asyncio.gather(*(status(upid) for upid in missing), return_exceptions=True)
+            finished += [
+                (data.get("exitstatus"), data.get("endtime"), now, upid)
+                for upid, data in zip(missing, results)
+                if isinstance(data, dict) and data.get("status") == "stopped"
+            ]
+        if finished:
+            with self.lock, self.db:
+                self.db.executemany(
+                    "UPDATE tasks SET status = 'stopped', exitstatus = ?, endtime = ?, updated_at = ? WHERE upid = ?",
+                    finished,
+                )
+            self.logger.info(f"{len(finished)} task(s) finished on node {node}")
+
+    async def poll_once(self):
+        open_tasks = self._open_tasks()
+        results = await asyncio.gather(
+            *(self.poll_node(node, tasks) for node, tasks in open_tasks.items()),
+            return_exceptions=True,
+        )
+        for node, result in zip(open_tasks, results):
+            if isinstance(result, Exception):
+                self.logger.warning(f"Task poll for node {node} failed: {result}")
+
+    async def run(self, interval: float = POLL_INTERVAL):
+        while True:
+            await self.poll_once()
+            await asyncio.sleep(interval)
+
+    async def wait(self, upid: str, timeout: float = 600.0, interval: float = 1.0) -> Optional[Dict[str, Any]]:
+        # Reads the local store only; the bulk poller is what talks to Proxmox
+        deadline = time.monotonic() + timeout
+        while True:
+            task = self.get(upid)
+            if task is None or task["status"] != "running" or time.monotonic() >= deadline:
+                return task
+            await asyncio.sleep(interval)
@@ -1,12 +1,14 @@
 from Modules.logger import init_logger
+from Modules.proxmox_client import PROXMOX_BASE_URL
 from fastapi import HTTPException
 from typing import Dict, Any
 import requests
 import urllib3
+import asyncio
+import httpx
 
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-PROXMOX_BASE_URL = "https://pve.home.lab:8006/api2/json"
 
 
 class TaskService:
@@ -34,3 +36,23 @@ class TaskService:
             raise HTTPException(status_code=response.status_code, detail="Failed to fetch task status")
         
         return response.json()["data"]
+
+
+async def wait_for_task(
+    client: httpx.AsyncClient, node: str, upid: str, headers: Dict[str, str], cookies: Dict[str, str],
+    timeout: float = 60.0, api_url: str = PROXMOX_BASE_URL,
+) -> Dict[str, Any]:
+    # Poll the task with a short, growing interval so quick tasks return almost immediately
+    deadline = asyncio.get_running_loop().time() + timeout
+    delay = 0.1
+    while True:
+        response = await client.get(f"{api_url}/nodes/{node}/tasks/{upid}/status", headers=headers, cookies=cookies)
+        if response.status_code != 200:
+            raise HTTPException(status_code=response.status_code, detail=f"Failed to fetch task status: {response.text}")
+        data = response.json().get("data", {})
+        if data.get("status") == "stopped":
+            return data
+        if asyncio.get_running_loop().time() + delay > deadline:
+            raise HTTPException(status_code=504, detail=f"Task {upid} did not finish within {timeout}s")
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 1.0)
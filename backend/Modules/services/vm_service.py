@@ -1,21 +1,111 @@
 from Modules.models import VMCreateRequest, VMUpdateRequest, VMCloneRequest
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Set, Tuple
 from .agent_service import AgentService
+from Modules.digest import check_config_write
 from Modules.logger import init_logger
+from Modules.proxmox_client import PROXMOX_BASE_URL
+from Modules.pve_config import GIB, parse_config
+from Modules.profiles import disk_format, disk_options, get_profile, join_options
 from fastapi import HTTPException
 import requests
 import urllib3
+import contextlib
 import asyncio
 import httpx
-import re
+import base64
+import json
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-PROXMOX_BASE_URL = "https://pve.home.lab:8006/api2/json"
+
+# Per-section upstream timeouts (seconds) for the aggregated detail view.
+# Guest agent calls block until the agent answers, so they get a shorter leash.
+DETAIL_SECTION_TIMEOUTS = {
+    "config": 5.0,
+    "status": 5.0,
+    "snapshots": 5.0,
+    "pending": 5.0,
+    "agent_network": 3.0,
+    "agent_fsinfo": 3.0,
+}
+
+
+# Fields of the VM listing and the stage that produces them: "list" comes with the single
+# /nodes/{node}/qemu call, "config" costs a config and status read per VM, "agent" two guest agent calls
+VM_LIST_FIELDS = {
+    "vmid": "list",
+    "name": "list",
+    "status": "list",
+    "tags": "list",
+    "template": "list",
+    "uptime": "list",
+    "cpu": "list",
+    "mem": "list",
+    "maxmem": "list",
+    "maxdisk": "list",
+    "cpus": "config",
+    "ram": "config",
+    "os": "config",
+    "num_hdd": "config",
+    "hdd_sizes": "config",
+    "ip_address": "agent",
+    "hdd_free": "agent",
+}
+
+
+def encode_cursor(key: Tuple[Any, ...], sort: str) -> str:
+    # Opaque to clients: the sort it belongs to plus the last row's sort key
+    return base64.urlsafe_b64encode(json.dumps({"sort": sort, "key": list(key)}).encode()).decode()
+
+
+def decode_cursor(cursor: str, sort: str) -> Tuple[Any, ...]:
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Malformed cursor")
+    if not isinstance(data, dict) or not isinstance(data.get("key"), list):
+        raise HTTPException(status_code=400, detail="Malformed cursor")
+    if data.get("sort") != sort:
+        raise HTTPException(status_code=400, detail="Cursor belongs to a different sort order")
+    return tuple(data["key"])
+
+
+def sort_config(config: Dict[str, Any]) -> Dict[str, Any]:
+    # Sort NICs and Disks by their numeric suffix: net0, scsi0, virtio1, sata2, ide3
+    def sort_key(item):
+        key = item[0]
+        patterns = ("net", "scsi", "virtio", "sata", "ide")
+        for p in patterns:
+            if key.startswith(p) and key[len(p):].isdigit():
+                return (0, p, int(key[len(p):]))
+        return (1, key, 0)  # Non-matching keys go later, sorted by name
+
+    return dict(sorted(config.items(), key=sort_key))
+
+
+def summarize_config(vmid: int, config: Dict[str, Any]) -> Dict[str, Any]:
+    # HDD sizes for summary
+    disks = [d.size_text for d in parse_config(config).data_disks if d.size_text]
+
+    return {
+        "vmid": vmid,
+        "name": config.get("name", f"VM {vmid}"),
+        "cores": config.get("cores", 0),
+        "memory": config.get("memory", 0),
+        "ostype": config.get("ostype", "unknown"),
+        "hdd_sizes": ", ".join(disks) if disks else "N/A",
+        "num_hdd": len(disks),
+        "hdd_free": "N/A",
+        "ip_address": "N/A",
+    }
+
 
 class VMService:
-    def __init__(self, log_file: str):
+    def __init__(self, log_file: str, catalog=None, search=None):
         self.log_file = log_file
         self.logger = init_logger(log_file, __name__)
+        self.catalog = catalog
+        # Optional search index fed with whatever configs and agent data this service reads anyway
+        self.search = search
         self.agent_service = AgentService(self.log_file)
         self.session = requests.Session()
         self.session.verify = False
@@ -54,69 +144,224 @@ class VMService:
         
         return response.json().get("data", {}).get("status", "")
 
-    async def get_vms(self, node: str, csrf_token: str, ticket: str) -> List[Dict[str, Any]]:
-        self.logger.info(f"Fetching VMs on node {node}")
-        base_url = f"{PROXMOX_BASE_URL}/nodes/{node}/qemu"
+    async def _fetch_vm_list(
+        self, client: httpx.AsyncClient, base_url: str, headers: Dict[str, str], cookies: Dict[str, str], strict: bool,
+    ) -> List[Dict[str, Any]]:
+        try:
+            r = await client.get(base_url, headers=headers, cookies=cookies)
+            r.raise_for_status()
+            return r.json().get("data", [])
+        except Exception as e:
+            self.logger.error(f"Failed to fetch base VM list: {str(e)}")
+            if not strict:
+                return []
+            if isinstance(e, httpx.HTTPStatusError):
+                raise HTTPException(status_code=e.response.status_code, detail=f"Failed to list VMs: {e.response.text}")
+            raise
+
+    async def _enrich_vm(
+        self, client: httpx.AsyncClient, node: str, vm: Dict[str, Any], stages: Set[str],
+        csrf_token: str, ticket: str, api_url: str,
+    ) -> Dict[str, Any]:
+        vmid = vm["vmid"]
+        base_url = f"{api_url}/nodes/{node}/qemu/{vmid}"
         headers = {"CSRFPreventionToken": csrf_token}
         cookies = {"PVEAuthCookie": ticket}
 
-        async with httpx.AsyncClient(verify=False, timeout=10.0) as client:
-            try:
-                r = await client.get(base_url, headers=headers, cookies=cookies)
-                r.raise_for_status()
-                vms = r.json().get("data", [])
-            except Exception as e:
-                self.logger.error(f"Failed to fetch base VM list: {str(e)}")
-                return []
+        try:
+            status = vm.get("status", "stopped")
+            if "config" in stages:
+                config_res, status_res = await asyncio.gather(
+                    client.get(f"{base_url}/config", headers=headers, cookies=cookies),
+                    client.get(f"{base_url}/status/current", headers=headers, cookies=cookies)
+                )
+
+                config = config_res.json().get("data", {})
+                status_data = status_res.json().get("data", {})
+                status = status_data.get("status", "stopped")
+
+                disks = [d.size_text for d in parse_config(config).data_disks if d.size_text]
+                if self.search and config:
+                    self.search.update_config(vmid, node, "qemu", config)
+
+                vm.update({
+                    "cpus": int(config.get("cores", 0)),
+                    "ram": int(config.get("memory", 0)),
+                    "name": config.get("name", f"VM {vmid}"),
+                    "status": status,
+                    "os": "Windows" if "win" in config.get("ostype", "").lower() else "Linux",
+                    "num_hdd": len(disks),
+                    "hdd_sizes": ", ".join(disks) if disks else "N/A",
+                })
+
+            if "agent" in stages:
+                vm.update({"ip_address": "N/A", "hdd_free": "N/A"})
+                if status == "running":
+                    net_task = self.agent_service.execute_agent_command(
+                        client, node, vmid, "network-get-interfaces", csrf_token, ticket, api_url
+                    )
+                    fs_task = self.agent_service.get_fsinfo(client, node, vmid, csrf_token, ticket, api_url)
+                    interfaces, vm["hdd_free"] = await asyncio.gather(net_task, fs_task)
+                    vm["ip_address"] = self.agent_service.format_ip_addresses(interfaces)
+                    if self.search and interfaces is not None:
+                        self.search.update_agent_ips(vmid, node, self.agent_service.list_ip_addresses(interfaces))
 
-            async def fetch_vm_data(vm):
-                vmid = vm["vmid"]
-                config_url = f"{base_url}/{vmid}/config"
-                status_url = f"{base_url}/{vmid}/status/current"
+        except Exception as e:
+            self.logger.warning(f"Error enriching VM {vmid}: {str(e)}")
 
-                try:
-                    config_res, status_res = await asyncio.gather(
-                        client.get(config_url, headers=headers, cookies=cookies),
-                        client.get(status_url, headers=headers, cookies=cookies)
-                    )
+        return vm
 
-                    config = config_res.json().get("data", {})
-                    status_data = status_res.json().get("data", {})
-                    status = status_data.get("status", "stopped")
-
-                    disks = []
-                    for k, v in config.items():
-                        if any(k.startswith(p) for p in ("ide", "sata", "scsi", "virtio")) and "cdrom" not in v:
-                            match = re.search(r"size=(\d+[KMGT]?)", v)
-                            if match:
-                                disks.append(match.group(1))
-
-                    vm.update({
-                        "cpus": int(config.get("cores", 0)),
-                        "ram": int(config.get("memory", 0)),
-                        "name": config.get("name", f"VM {vmid}"),
-                        "status": status,
-                        "os": "Windows" if "win" in config.get("ostype", "").lower() else "Linux",
-                        "num_hdd": len(disks),
-                        "hdd_sizes": ", ".join(disks) if disks else "N/A",
-                        "ip_address": "N/A",
-                        "hdd_free": "N/A",
-                    })
-
-                    if status == "running":
-                        ip_task = self.agent_service.get_ip_addresses(client, node, vmid, csrf_token, ticket)
-                        fs_task = self.agent_service.get_fsinfo(client, node, vmid, csrf_token, ticket)
-                        ip_address, hdd_free = await asyncio.gather(ip_task, fs_task)
-                        vm["ip_address"] = ip_address
-                        vm["hdd_free"] = hdd_free
+    async def get_vms(
+        self, node: str, csrf_token: str, ticket: str, strict: bool = False,
+        api_url: str = PROXMOX_BASE_URL, client: Optional[httpx.AsyncClient] = None,
+    ) -> List[Dict[str, Any]]:
+        self.logger.info(f"Fetching VMs on node {node}")
+        headers = {"CSRFPreventionToken": csrf_token}
+        cookies = {"PVEAuthCookie": ticket}
 
-                except Exception as e:
-                    self.logger.warning(f"Error enriching VM {vmid}: {str(e)}")
+        # A pooled client from the caller is reused as-is; otherwise open a short-lived one
+        client_ctx = httpx.AsyncClient(verify=False, timeout=10.0) if client is None else contextlib.nullcontext(client)
+        async with client_ctx as client:
+            vms = await self._fetch_vm_list(client, f"{api_url}/nodes/{node}/qemu", headers, cookies, strict)
+            stages = {"config", "agent"}
+            return await asyncio.gather(*(
+                self._enrich_vm(client, node, vm, stages, csrf_token, ticket, api_url) for vm in vms
+            ))
+
+    async def query_vms(
+        self, node: str, csrf_token: str, ticket: str, fields: Optional[List[str]] = None,
+        status: Optional[str] = None, name: Optional[str] = None, sort: str = "vmid",
+        limit: Optional[int] = None, cursor: Optional[str] = None,
+        api_url: str = PROXMOX_BASE_URL, client: Optional[httpx.AsyncClient] = None,
+    ) -> Dict[str, Any]:
+        """
+        Listing with projection, filtering and keyset pagination. Filters run on
+        the base /qemu listing before any enrichment, and only the stages the
+        requested fields (or the sort key) need are run, only for the returned page.
+        """
+        descending = sort.startswith("-")
+        sort_field = sort.lstrip("-")
+        wanted = set(fields) if fields else set(VM_LIST_FIELDS)
+        unknown = (wanted | {sort_field}) - set(VM_LIST_FIELDS)
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields {sorted(unknown)}. Available: {list(VM_LIST_FIELDS)}")
+        # Plain case-insensitive substring: a caller-supplied regex could backtrack for seconds per VM
+        name_part = name.lower() if name else None
+        after = decode_cursor(cursor, sort) if cursor else None
+
+        stages = {VM_LIST_FIELDS[f] for f in wanted} - {"list"}
+        sort_stage = VM_LIST_FIELDS[sort_field]
+        headers = {"CSRFPreventionToken": csrf_token}
+        cookies = {"PVEAuthCookie": ticket}
 
-                return vm
+        client_ctx = httpx.AsyncClient(verify=False, timeout=10.0) if client is None else contextlib.nullcontext(client)
+        async with client_ctx as client:
+            async def enrich(vms: List[Dict[str, Any]], needed: Set[str]) -> List[Dict[str, Any]]:
+                if not needed:
+                    return vms
+                return list(await asyncio.gather(*(
+                    self._enrich_vm(client, node, vm, needed, csrf_token, ticket, api_url) for vm in vms
+                )))
+
+            vms = await self._fetch_vm_list(client, f"{api_url}/nodes/{node}/qemu", headers, cookies, strict=True)
+            vms = [
+                vm for vm in vms
+                if (status is None or vm.get("status") == status)
+                and (name_part is None or name_part in (vm.get("name") or "").lower())
+            ]
+            # Sorting on an enriched field means enriching that stage for every match first
+            if sort_stage != "list":
+                vms = await enrich(vms, {sort_stage})
+                stages.discard(sort_stage)
+
+            def key(vm: Dict[str, Any]) -> Tuple[Any, ...]:
+                value = vm.get(sort_field)
+                return (value is None, value if value is not None else 0, vm["vmid"])
+
+            vms.sort(key=key, reverse=descending)
+            if after is not None:
+                try:
+                    vms = [vm for vm in vms if (key(vm) < after if descending else key(vm) > after)]
+                except TypeError:
+                    raise HTTPException(status_code=400, detail="Cursor does not match this listing")
+            next_cursor = None
+            if limit is not None and len(vms) > limit:
+                vms = vms[:limit]
+                next_cursor = encode_cursor(key(vms[-1]), sort)
+            vms = await enrich(vms, stages)
+
+        wanted.add("vmid")
+        return {"items": [{k: vm.get(k) for k in VM_LIST_FIELDS if k in wanted} for vm in vms], "next_cursor": next_cursor}
+
+    async def get_vm_detail(
+        self, node: str, vmid: int, csrf_token: str, ticket: str,
+        api_url: str = PROXMOX_BASE_URL, client: Optional[httpx.AsyncClient] = None,
+    ) -> Dict[str, Any]:
+        self.logger.info(f"Fetching aggregated detail for VM {vmid} on node {node}")
+        base_url = f"{api_url}/nodes/{node}/qemu/{vmid}"
+        headers = {"CSRFPreventionToken": csrf_token}
+        cookies = {"PVEAuthCookie": ticket}
 
-            enriched_vms = await asyncio.gather(*(fetch_vm_data(vm) for vm in vms))
-            return enriched_vms
+        client_ctx = (
+            httpx.AsyncClient(verify=False, timeout=max(DETAIL_SECTION_TIMEOUTS.values()))
+            if client is None else contextlib.nullcontext(client)
+        )
+        async with client_ctx as client:
+            async def fetch(path: str) -> Any:
+                r = await client.get(f"{base_url}/{path}", headers=headers, cookies=cookies)
+                if r.status_code != 200:
+                    raise HTTPException(status_code=r.status_code, detail=r.text.strip() or r.reason_phrase)
+                return r.json().get("data")
+
+            async def run_section(name: str, path: str):
+                timeout = DETAIL_SECTION_TIMEOUTS[name]
+                try:
+                    return name, {"data": await asyncio.wait_for(fetch(path), timeout), "error": None}
+                except asyncio.TimeoutError:
+                    self.logger.warning(f"Detail section '{name}' for VM {vmid} timed out after {timeout}s")
+                    return name, {"data": None, "error": f"Timed out after {timeout}s"}
+                except HTTPException as e:
+                    self.logger.warning(f"Detail section '{name}' for VM {vmid} failed: {e.detail}")
+                    return name, {"data": None, "error": e.detail}
+                except Exception as e:
+                    self.logger.warning(f"Detail section '{name}' for VM {vmid} failed: {e}")
+                    return name, {"data": None, "error": str(e)}
+
+            results = dict(await asyncio.gather(
+                run_section("config", "config"),
+                run_section("status", "status/current"),
+                run_section("snapshots", "snapshot"),
+                run_section("pending", "pending"),
+                run_section("agent_network", "agent/network-get-interfaces"),
+                run_section("agent_fsinfo", "agent/get-fsinfo"),
+            ))
+
+        config = results["config"]["data"]
+        if config is not None:
+            config = sort_config(config)
+            results["config"]["data"] = config
+
+        status = (results["status"]["data"] or {}).get("status")
+        if status is not None and status != "running":
+            # The agent calls were issued blind; report the real reason instead of the upstream 500
+            for name in ("agent_network", "agent_fsinfo"):
+                results[name] = {"data": None, "error": f"VM is {status}"}
+
+        snapshots = results["snapshots"]["data"]
+        if snapshots is not None:
+            results["snapshots"]["data"] = [
+                {"name": snap["name"], "description": snap.get("description", ""), "snaptime": snap.get("snaptime")}
+                for snap in snapshots if snap["name"] != "current"
+            ]
+
+        summary = summarize_config(vmid, config or {})
+        summary["status"] = status or "unknown"
+        if results["agent_network"]["data"] is not None:
+            summary["ip_address"] = self.agent_service.format_ip_addresses(results["agent_network"]["data"])
+        if results["agent_fsinfo"]["data"] is not None:
+            summary["hdd_free"] = self.agent_service.format_fsinfo(results["agent_fsinfo"]["data"])
+
+        return {"node": node, "summary": summary, **results}
 
     def vm_action(self, node: str, vmid: int, action: str, csrf_token: str, ticket: str) -> Any:
         self.logger.info(f"Performing action '{action}' on VM {vmid} on node {node}")
@@ -144,15 +389,28 @@ class VMService:
 
         return response.json().get("data")
 
-    def create_vm(self, node: str, vm_create: VMCreateRequest, csrf_token: str, ticket: str) -> Any:
-        self.logger.info(f"Creating VM on node {node} with request: {vm_create}")
+    def next_vmid(self, ticket: str) -> int:
         self.session.cookies.set("PVEAuthCookie", ticket)
-
         resp_id = self.session.get(f"{PROXMOX_BASE_URL}/cluster/nextid")
-        self.logger.info(f"Next VMID response status code: {resp_id.status_code}")
         resp_id.raise_for_status()
-        vmid = resp_id.json().get("data")
+        return int(resp_id.json().get("data"))
 
+    def _storage_type(self, node: str, storage: Optional[str], csrf_token: str, ticket: str) -> Optional[str]:
+        if not self.catalog or not storage:
+            return None
+        return self.catalog.get_storage(node, storage, csrf_token, ticket).get("type")
+
+    def create_vm(self, node: str, vm_create: VMCreateRequest, csrf_token: str, ticket: str) -> Any:
+        self.logger.info(f"Creating VM on node {node} with request: {vm_create}")
+        profile = get_profile(vm_create.profile)
+        if self.catalog:
+            # Reject bad storage or media before Proxmox starts a task
+            self.catalog.check_capacity(node, vm_create.storage, vm_create.disk_size * GIB, csrf_token, ticket)
+            if vm_create.source == "ISO":
+                self.catalog.check_volume(node, vm_create.iso, csrf_token, ticket)
+        vmid = self.next_vmid(ticket)
+
+        fmt = disk_format(self._storage_type(node, vm_create.storage, csrf_token, ticket))
         data = {
             "vmid": vmid,
             "name": vm_create.name,
@@ -161,11 +419,12 @@ class VMService:
             "net0": "virtio,bridge=vmbr0",
             "agent": 1,
             "ostype": "l26",
-            "scsi0": "local-lvm:32"
+            "scsi0": f"{vm_create.storage}:{vm_create.disk_size},{join_options(disk_options(profile, 'scsi', fmt))}",
+            **profile["vm"],
         }
 
         if vm_create.source == "ISO":
-            data["ide2"] = "local:iso/ubuntu-22.04.3-live-server-amd64.iso,media=cdrom"
+            data["ide2"] = f"{vm_create.iso},media=cdrom"
             data["boot"] = "order=ide2;scsi0;net0"
         else:
             data["boot"] = "order=scsi0;net0"
@@ -181,11 +440,16 @@ class VMService:
 
         return response.json().get("data")
 
-    def update_vm_config(self, node: str, vmid: int, updates: VMUpdateRequest, csrf_token: str, ticket: str) -> str:
+    def update_vm_config(
+        self, node: str, vmid: int, updates: VMUpdateRequest, csrf_token: str, ticket: str,
+        digest: Optional[str] = None, allow_pending: bool = False,
+    ) -> str:
+        # With allow_pending, CPU/RAM changes on a running VM are hot-plugged where the VM allows it
+        # and otherwise left by Proxmox as pending changes for the next boot
         self.logger.info(f"Updating VM {vmid} on node {node} with updates: {updates}")
         headers = self.set_auth_headers(csrf_token, ticket)
 
-        if (updates.cpus is not None or updates.ram is not None) and \
+        if (updates.cpus is not None or updates.ram is not None) and not allow_pending and \
            self.get_vm_status(node, vmid, csrf_token, ticket) == "running":
             self.logger.error("Cannot update CPU or RAM while VM is running")
             raise HTTPException(status_code=400, detail="Cannot update CPU or RAM while VM is running")
@@ -200,6 +464,8 @@ class VMService:
 
         if not data:
             raise HTTPException(status_code=400, detail="No valid updates provided")
+        if digest:
+            data["digest"] = digest
 
         response = self.session.post(
             f"{PROXMOX_BASE_URL}/nodes/{node}/qemu/{vmid}/config",
@@ -207,6 +473,7 @@ class VMService:
             headers=headers
         )
         self.logger.info(f"VM update response status code: {response.status_code}")
+        check_config_write(response.status_code, response.text, self.logger)
 
         if response.status_code != 200:
             err = response.text
@@ -220,11 +487,18 @@ class VMService:
 
     def clone_vm(self, node: str, vmid: int, clone_req: VMCloneRequest, csrf_token: str, ticket: str) -> Optional[str]:
         self.logger.info(f"Cloning VM {vmid} on node {node} with request: {clone_req}")
+        if clone_req.profile:
+            get_profile(clone_req.profile)
+        if self.catalog and clone_req.storage:
+            # Linked clones share the base image; only full clones need the space up front
+            size = 0
+            if clone_req.full:
+                source = parse_config(self.get_vm_config(node, vmid, ticket))
+                size = sum(d.size or 0 for d in source.data_disks)
+            self.catalog.check_capacity(clone_req.target, clone_req.storage, size, csrf_token, ticket)
         self.session.cookies.set("PVEAuthCookie", ticket)
 
-        resp_id = self.session.get(f"{PROXMOX_BASE_URL}/cluster/nextid")
-        resp_id.raise_for_status()
-        new_id = resp_id.json().get("data")
+        new_id = clone_req.newid if clone_req.newid is not None else self.next_vmid(ticket)
 
         payload: Dict[str, Any] = {
             "newid": new_id,
@@ -234,6 +508,10 @@ class VMService:
         }
         if clone_req.storage:
             payload["storage"] = clone_req.storage
+            # Full copies can change format; block storages take raw only
+            fmt = disk_format(self._storage_type(clone_req.target, clone_req.storage, csrf_token, ticket))
+            if clone_req.full and fmt:
+                payload["format"] = fmt
 
         response = self.session.post(
             f"{PROXMOX_BASE_URL}/nodes/{node}/qemu/{vmid}/clone",
@@ -247,6 +525,30 @@ class VMService:
             self.logger.error(f"Failed to clone VM {vmid}: {response.text}")
             return None
 
+    def apply_profile(self, node: str, vmid: int, profile_name: Optional[str], csrf_token: str, ticket: str) -> Optional[str]:
+        # Rewrites the VM-level settings and every data disk's options, keeping each disk's volume and format
+        profile = get_profile(profile_name)
+        config = self.get_vm_config(node, vmid, ticket)
+        data: Dict[str, Any] = dict(profile["vm"])
+        for disk in parse_config(config).data_disks:
+            if not disk.volid:
+                continue
+            options = dict(disk.options)
+            options.update(disk_options(profile, disk.controller))
+            data[disk.key] = f"{disk.volid},{join_options(options)}"
+        data["digest"] = config.get("digest")
+        self.logger.info(f"Applying profile '{profile_name}' to VM {vmid} on node {node}: {data}")
+
+        response = self.session.post(
+            f"{PROXMOX_BASE_URL}/nodes/{node}/qemu/{vmid}/config",
+            data=data,
+            headers=self.set_auth_headers(csrf_token, ticket)
+        )
+        check_config_write(response.status_code, response.text, self.logger)
+        if response.status_code != 200:
+            raise HTTPException(status_code=response.status_code, detail=response.text)
+        return response.json().get("data")
+
     def delete_vm(self, node: str, vmid: int, csrf_token: str, ticket: str) -> str:
         self.logger.info(f"Deleting VM {vmid} on node {node}")
         headers = self.set_auth_headers(csrf_token, ticket)
@@ -261,7 +563,7 @@ class VMService:
         
         return response.json().get("data")
 
-    def modify_vm_network(self, node: str, vmid: int, net: Optional[dict], delete: Optional[str], csrf_token: str, ticket: str) -> str:
+    def modify_vm_network(self, node: str, vmid: int, net: Optional[dict], delete: Optional[str], csrf_token: str, ticket: str, digest: Optional[str] = None) -> str:
         self.logger.info(f"Modifying network for VM {vmid} on node {node} with net={net}, delete={delete}")
         headers = self.set_auth_headers(csrf_token, ticket)
 
@@ -270,12 +572,15 @@ class VMService:
             params["delete"] = delete
         if net:
             params.update(net)
+        if digest:
+            params["digest"] = digest
 
         response = self.session.put(
             f"{PROXMOX_BASE_URL}/nodes/{node}/qemu/{vmid}/config",
             data=params,
             headers=headers
         )
+        check_config_write(response.status_code, response.text, self.logger)
 
         if response.status_code != 200:
             raise HTTPException(status_code=response.status_code, detail=response.text)
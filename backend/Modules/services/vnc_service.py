@@ -1,13 +1,12 @@
 # vnc_service.py
 
 from Modules.logger import init_logger
+from Modules.proxmox_client import PROXMOX_BASE_URL
 from fastapi import HTTPException
 import requests
 import urllib3
-import os
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-PROXMOX_BASE_URL = f"https://{os.getenv('PROXMOX_HOST', 'pve.home.lab')}:8006/api2/json"
 
 
 class VNCService:
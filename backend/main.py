@@ -1,15 +1,20 @@
-from fastapi import FastAPI, Depends, HTTPException, WebSocket, WebSocketDisconnect, Query, Body
+from fastapi import FastAPI, Depends, HTTPException, WebSocket, WebSocketDisconnect, Query, Body, Header, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from urllib.parse import unquote
 from fastapi.middleware.cors import CORSMiddleware
 from urllib.parse import quote_plus
 from pydantic import BaseModel
+from typing import List, Optional, Set
 import websockets
+import httpx
 import uvicorn
 import asyncio
+import inspect
+import json
 import ssl
 import os
-import re
 
+from Modules.digest import make_etag, digest_from_etag, etag_matches
 from Modules.logger import init_logger
 from Modules.models import (
     LoginRequest,
@@ -18,13 +23,37 @@ from Modules.models import (
     VMUpdateRequest,
     VMCloneRequest,
     VMDiskAddRequest,
+    VMDisksAddRequest,
+    OrphanReclaimRequest,
+    FleetSnapshotRequest,
+    RetentionPolicy,
+    FleetExecRequest,
+    PlacementRequest,
+    BackupRequest,
+    BalloonBounds,
 )
 from Modules.services.auth_service import AuthService
-from Modules.services.vm_service import VMService
-from Modules.services.snapshot_service import SnapshotService
+from Modules.services.vm_service import VMService, sort_config, summarize_config
+from Modules.services.snapshot_service import SnapshotService, SnapshotTreeCache
 from Modules.services.disk_service import DiskService
 from Modules.services.task_service import TaskService
 from Modules.services.vnc_service import VNCService
+from Modules.services.event_service import EventService
+from Modules.services.cluster_service import ClusterService
+from Modules.services.task_registry import TaskRegistry
+from Modules.services.lock_manager import VMLockManager
+from Modules.services.catalog_service import CatalogService
+from Modules.services.orphan_service import OrphanService
+from Modules.services.fleet_snapshot_service import FleetSnapshotService
+from Modules.services.agent_service import AgentService
+from Modules.services.metrics_service import MetricsService
+from Modules.services.rightsizing_service import RightsizingService
+from Modules.services.placement_service import PlacementService
+from Modules.services.evacuation_service import EvacuationService
+from Modules.services.backup_service import BackupService
+from Modules.services.memory_service import MemoryService
+from Modules.services.search_service import SearchService
+from Modules.proxmox_client import ProxmoxClientPool, EndpointSet
 
 class DiskExpandRequest(BaseModel):
     new_size: int  # GB
@@ -37,6 +66,8 @@ if not os.path.exists(log_file):
         pass
 logger = init_logger(log_file, __name__)
 
+task_db = os.path.join(os.path.dirname(__file__), 'tasks.db')
+
 # Pydantic model for snapshot requests
 class SnapRequest(BaseModel):
     snapname: str
@@ -53,6 +84,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-Cursor"],
 )
 
 # Include console routers
@@ -61,30 +93,221 @@ from Modules.routes.console import router as console_router
 app.include_router(console_router)
 # app.include_router(console_ws_router)
 
+# Shared storage/ISO catalog used to validate requests before work is submitted
+catalog_service = CatalogService(log_file=log_file)
+
 # Dependency providers
 def get_auth_service() -> AuthService:
     return AuthService(log_file=log_file)
 
 
 def get_vm_service() -> VMService:
-    return VMService(log_file=log_file)
+    return VMService(log_file=log_file, catalog=catalog_service, search=search_service)
 
 
 def get_snapshot_service() -> SnapshotService:
-    return SnapshotService(log_file=log_file)
+    return SnapshotService(log_file=log_file, catalog=catalog_service, trees=snapshot_trees)
 
 
 def get_disk_service() -> DiskService:
-    return DiskService(log_file=log_file)
+    return DiskService(log_file=log_file, catalog=catalog_service)
+
+
+def get_catalog_service() -> CatalogService:
+    return catalog_service
 
 
 def get_task_service() -> TaskService:
     return TaskService(log_file=log_file)
 
 
+def get_agent_service() -> AgentService:
+    return AgentService(log_file=log_file)
+
+
 def get_vnc_service() -> VNCService:
     return VNCService(log_file=log_file)
 
+
+# Pooled upstream connections, one client per node endpoint, with reads
+# load-balanced over the healthy cluster members
+proxmox_pool = ProxmoxClientPool()
+proxmox_endpoints = EndpointSet(proxmox_pool, log_file=log_file)
+cluster_service = ClusterService(log_file=log_file, endpoints=proxmox_endpoints)
+
+# Shared across requests: one upstream poller per node feeds every subscriber
+event_service = EventService(log_file=log_file, endpoints=proxmox_endpoints)
+
+
+# Every UPID the backend starts is recorded and polled in bulk per node
+task_registry = TaskRegistry(log_file=log_file, db_path=task_db, endpoints=proxmox_endpoints)
+
+
+def get_event_service() -> EventService:
+    return event_service
+
+
+def get_task_registry() -> TaskRegistry:
+    return task_registry
+
+
+# Snapshot trees per VM, kept until the backend changes that VM's snapshots
+snapshot_trees = SnapshotTreeCache(registry=task_registry)
+
+
+def track_task(upid, node: str, csrf_token: str, ticket: str, vmid: Optional[int] = None):
+    if isinstance(upid, str) and upid.startswith("UPID:"):
+        try:
+            task_registry.record(upid, csrf_token, ticket, vmid)
+        except Exception as e:
+            # Tracking is best effort; never fail the operation that already started
+            logger.warning(f"Failed to record task {upid} on node {node}: {e}")
+    return upid
+
+
+def guest_ids(resources: Optional[List[dict]]) -> Set[int]:
+    # VMIDs in a caller's /cluster/resources; Proxmox only lists the guests that ticket may see
+    return {r["vmid"] for r in resources or [] if r.get("type") in ("qemu", "lxc")}
+
+
+# Operations on one VM are serialized; different VMs proceed in parallel
+vm_locks = VMLockManager(log_file=log_file)
+
+
+async def run_locked(vmid: int, operation: str, node: str, csrf_token: str, ticket: str, call):
+    async with vm_locks.hold(vmid, operation) as entry:
+        result = call()
+        if inspect.isawaitable(result):
+            result = await result
+        upid = result.get("upid") if isinstance(result, dict) else result
+        track_task(upid, node, csrf_token, ticket, vmid)
+        orphan_service.mark_stale(vmid)
+        search_service.mark_stale(vmid)
+        if isinstance(upid, str) and upid.startswith("UPID:"):
+            # Proxmox holds its own VM lock until the task ends, so ours must too
+            entry.release_after(task_registry.wait(upid))
+        return result
+
+
+profile_tasks = set()
+
+
+async def apply_profile_after(upid: str, node: str, vmid: int, profile: str, csrf_token: str, ticket: str, svc: VMService):
+    # Clone settings can only be rewritten once the copy exists and Proxmox has dropped its lock
+    task = await task_registry.wait(upid, timeout=4 * 3600.0)
+    if not task or task["status"] == "running" or task["exitstatus"] != "OK":
+        logger.warning(f"Not applying profile '{profile}' to VM {vmid}: task {upid} did not succeed")
+        return
+    try:
+        async with vm_locks.hold(vmid, "apply_profile"):
+            await asyncio.to_thread(svc.apply_profile, node, vmid, profile, csrf_token, ticket)
+        logger.info(f"Applied profile '{profile}' to VM {vmid} on node {node}")
+    except Exception as e:
+        detail = e.detail if isinstance(e, HTTPException) else str(e)
+        logger.warning(f"Applying profile '{profile}' to VM {vmid} failed: {detail}")
+
+
+def get_cluster_service() -> ClusterService:
+    return cluster_service
+
+
+# The volid index is kept between scans so only changed VMs are re-read
+orphan_service = OrphanService(log_file=log_file, endpoints=proxmox_endpoints, catalog=catalog_service)
+
+
+def get_orphan_service() -> OrphanService:
+    return orphan_service
+
+
+fleet_snapshots = FleetSnapshotService(
+    log_file=log_file, endpoints=proxmox_endpoints, cluster=cluster_service,
+    registry=task_registry, locks=vm_locks, trees=snapshot_trees,
+)
+
+
+def get_fleet_snapshot_service() -> FleetSnapshotService:
+    return fleet_snapshots
+
+
+# RRD samples for every VM and node, collected in the background and served from memory
+metrics_service = MetricsService(log_file=log_file, endpoints=proxmox_endpoints)
+
+
+def get_metrics_service() -> MetricsService:
+    return metrics_service
+
+
+# Recommendations are recomputed at most once a day unless a refresh is asked for
+rightsizing_service = RightsizingService(log_file=log_file, endpoints=proxmox_endpoints)
+
+
+def get_rightsizing_service() -> RightsizingService:
+    return rightsizing_service
+
+
+# Shared so placements made moments apart see each other's reservations
+placement_service = PlacementService(log_file=log_file, endpoints=proxmox_endpoints)
+
+
+def get_placement_service() -> PlacementService:
+    return placement_service
+
+
+evacuation_service = EvacuationService(
+    log_file=log_file, endpoints=proxmox_endpoints, placement=placement_service,
+    registry=task_registry, locks=vm_locks,
+)
+
+
+def get_evacuation_service() -> EvacuationService:
+    return evacuation_service
+
+
+# Backup runs are recorded next to the task table
+backup_service = BackupService(
+    log_file=log_file, db_path=task_db, endpoints=proxmox_endpoints, cluster=cluster_service,
+    registry=task_registry, locks=vm_locks,
+)
+
+
+def get_backup_service() -> BackupService:
+    return backup_service
+
+
+memory_service = MemoryService(log_file=log_file, endpoints=proxmox_endpoints)
+
+
+def get_memory_service() -> MemoryService:
+    return memory_service
+
+
+# Names, tags, IPs, MACs and volids of every VM, refreshed incrementally in the background
+search_service = SearchService(log_file=log_file, endpoints=proxmox_endpoints)
+
+
+def get_search_service() -> SearchService:
+    return search_service
+
+
+background_tasks = []
+
+
+@app.on_event("startup")
+async def start_background_tasks():
+    background_tasks.append(asyncio.create_task(proxmox_endpoints.run_health_checks()))
+    background_tasks.append(asyncio.create_task(task_registry.run()))
+    background_tasks.append(asyncio.create_task(fleet_snapshots.run()))
+    background_tasks.append(asyncio.create_task(metrics_service.run()))
+    background_tasks.append(asyncio.create_task(memory_service.run()))
+    background_tasks.append(asyncio.create_task(search_service.run()))
+
+
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    for task in background_tasks:
+        task.cancel()
+    await proxmox_pool.close()
+
 # Endpoints
 
 @app.post("/login")
@@ -92,8 +315,6 @@ async def login(
     login_data: LoginRequest,
     auth: AuthService = Depends(get_auth_service),
 ):
-    from fastapi.responses import JSONResponse
-    
     # Authenticate with Proxmox
     auth_response = auth.login(login_data.username, login_data.password)
     
@@ -128,14 +349,84 @@ async def login(
     
     return response
 
+@app.get("/cluster/nodes")
+async def list_nodes(
+    csrf_token: str,
+    ticket: str,
+    refresh: bool = False,
+    svc: ClusterService = Depends(get_cluster_service),
+):
+    # The node list is cached for everyone, so check this caller before answering from it
+    await proxmox_endpoints.authorize(csrf_token, ticket, "/cluster/status")
+    return await svc.get_nodes(csrf_token, ticket, refresh)
+
+@app.get("/cluster/endpoints")
+async def list_endpoints(
+    csrf_token: str,
+    ticket: str,
+):
+    await proxmox_endpoints.authorize(csrf_token, ticket)
+    return [endpoint.as_dict() for endpoint in proxmox_endpoints.endpoints.values()]
+
+@app.get("/vms")
+async def list_cluster_vms(
+    csrf_token: str,
+    ticket: str,
+    svc: ClusterService = Depends(get_cluster_service),
+):
+    return await svc.get_all_vms(csrf_token, ticket)
+
 @app.get("/vms/{node}")
 async def list_vms(
     node: str,
     csrf_token: str,
     ticket: str,
+    response: Response,
+    fields: Optional[str] = None,
+    status: Optional[str] = None,
+    name: Optional[str] = Query(None, alias="name~"),
+    sort: str = "vmid",
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    cursor: Optional[str] = None,
     svc: VMService = Depends(get_vm_service),
 ):
-    return await svc.get_vms(node, csrf_token, ticket)
+    # fields is comma-separated; the next page's cursor comes back in X-Next-Cursor
+    tried = set()
+    while True:
+        try:
+            # Strict listing so upstream failures reach the lease and the next endpoint is tried
+            async with proxmox_endpoints.lease(node, tried) as endpoint:
+                tried.add(endpoint.url)
+                client = proxmox_endpoints.client(endpoint)
+                if not any((fields, status, name, limit, cursor)) and sort == "vmid":
+                    return await svc.get_vms(node, csrf_token, ticket, strict=True, api_url=endpoint.url, client=client)
+                result = await svc.query_vms(
+                    node, csrf_token, ticket, fields=[f.strip() for f in fields.split(",") if f.strip()] if fields else None,
+                    status=status, name=name, sort=sort, limit=limit, cursor=cursor, api_url=endpoint.url, client=client,
+                )
+            break
+        except httpx.TransportError as e:
+            if len(tried) >= len(proxmox_endpoints.endpoints):
+                raise HTTPException(status_code=502, detail=f"No Proxmox endpoint reachable for node {node}: {e}")
+    if result["next_cursor"]:
+        response.headers["X-Next-Cursor"] = result["next_cursor"]
+    return result["items"]
+
+@app.get("/vms/{node}/events")
+async def vm_events(
+    node: str,
+    csrf_token: str,
+    ticket: str,
+    request: Request,
+    svc: EventService = Depends(get_event_service),
+):
+    # Server-Sent Events: an initial "snapshot", then "update"/"added"/"removed" diffs
+    await svc.authorize(node, csrf_token, ticket)
+    return StreamingResponse(
+        svc.stream(node, csrf_token, ticket, request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 @app.get("/task/{node}/{upid}")
 async def get_task_status(
@@ -147,6 +438,467 @@ async def get_task_status(
 ):
     return svc.get_task_status(node, upid, csrf_token, ticket)
 
+@app.get("/tasks")
+async def list_tasks(
+    csrf_token: str,
+    ticket: str,
+    status: Optional[str] = None,
+    node: Optional[str] = None,
+    vmid: Optional[int] = None,
+    user: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+    registry: TaskRegistry = Depends(get_task_registry),
+):
+    # Anyone may read /cluster/tasks, so without Sys.Audit only the caller's VMs and own tasks are listed
+    privileges = await proxmox_endpoints.authorize(csrf_token, ticket, "/access/permissions", params={"path": "/"})
+    if any((p or {}).get("Sys.Audit") for p in (privileges or {}).values()):
+        return registry.list_tasks(status, node, vmid, user, limit, offset)
+    visible = guest_ids(await proxmox_endpoints.authorize(csrf_token, ticket, "/cluster/resources"))
+    # PVE:<userid>:<hex time>::<signature>
+    owner = ticket.split(":")[1] if ticket.startswith("PVE:") else None
+    return registry.list_tasks(status, node, vmid, user, limit, offset, visible=visible, owner=owner)
+
+@app.get("/tasks/{upid}")
+async def get_tracked_task(
+    upid: str,
+    csrf_token: str,
+    ticket: str,
+    registry: TaskRegistry = Depends(get_task_registry),
+):
+    # UPID:<node>:...; reading the task upstream proves the caller may see it
+    parts = upid.split(":")
+    if len(parts) < 3 or parts[0] != "UPID":
+        raise HTTPException(status_code=400, detail="Malformed UPID")
+    await proxmox_endpoints.authorize(csrf_token, ticket, f"/nodes/{parts[1]}/tasks/{upid}/status", node=parts[1])
+    task = registry.get(upid)
+    if task is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    return task
+
+@app.get("/locks")
+async def list_vm_locks(
+    csrf_token: str,
+    ticket: str,
+):
+    await proxmox_endpoints.authorize(csrf_token, ticket)
+    return vm_locks.all_queues()
+
+@app.get("/vm/{node}/qemu/{vmid}/queue")
+async def get_vm_queue(
+    node: str,
+    vmid: int,
+    csrf_token: str,
+    ticket: str,
+):
+    await proxmox_endpoints.authorize(csrf_token, ticket, f"/nodes/{node}/qemu/{vmid}/status/current", node=node)
+    return vm_locks.queue(vmid)
+
+@app.get("/storage/{node}")
+async def list_storages(
+    node: str,
+    csrf_token: str,
+    ticket: str,
+    refresh: bool = False,
+    svc: CatalogService = Depends(get_catalog_service),
+):
+    return list(svc.get_storages(node, csrf_token, ticket, refresh).values())
+
+@app.get("/storage/{node}/isos")
+async def list_isos(
+    node: str,
+    csrf_token: str,
+    ticket: str,
+    svc: CatalogService = Depends(get_catalog_service),
+):
+    return svc.find_content(node, "iso", csrf_token, ticket)
+
+@app.get("/storage/{node}/ct-templates")
+async def list_container_templates(
+    node: str,
+    csrf_token: str,
+    ticket: str,
+    svc: CatalogService = Depends(get_catalog_service),
+):
+    return svc.find_content(node, "vztmpl", csrf_token, ticket)
+
+@app.get("/storage/{node}/{storage}/content")
+async def list_storage_content(
+    node: str,
+    storage: str,
+    csrf_token: str,
+    ticket: str,
+    content: Optional[str] = None,
+    refresh: bool = False,
+    svc: CatalogService = Depends(get_catalog_service),
+):
+    return svc.get_content(node, storage, csrf_token, ticket, content, refresh)
+
+@app.get("/orphans")
+async def scan_orphans(
+    csrf_token: str,
+    ticket: str,
+    max_age: float = 60.0,
+    svc: OrphanService = Depends(get_orphan_service),
+):
+    return await svc.scan(csrf_token, ticket, max_age)
+
+@app.post("/orphans/reclaim")
+async def reclaim_orphans(
+    csrf_token: str,
+    ticket: str,
+    req: OrphanReclaimRequest,
+    svc: OrphanService = Depends(get_orphan_service),
+):
+    return await svc.reclaim(req.volids, csrf_token, ticket, req.force)
+
+@app.post("/fleet/snapshots")
+async def create_fleet_snapshot(
+    csrf_token: str,
+    ticket: str,
+    req: FleetSnapshotRequest,
+    svc: FleetSnapshotService = Depends(get_fleet_snapshot_service),
+):
+    return await svc.snapshot(
+        csrf_token, ticket, req.vmids, req.tag, req.pool, req.snapname, req.description, req.vmstate,
+    )
+
+@app.post("/fleet/exec")
+async def run_fleet_exec(
+    csrf_token: str,
+    ticket: str,
+    req: FleetExecRequest,
+    svc: AgentService = Depends(get_agent_service),
+):
+    if not req.command:
+        raise HTTPException(status_code=400, detail="Command cannot be empty")
+    vms = await cluster_service.select_vms(csrf_token, ticket, req.vmids, req.tag, req.pool)
+
+    async def results():
+        # Newline-delimited JSON, one line per VM as soon as its command finishes
+        async for result in svc.run_fleet_exec(
+            proxmox_endpoints, vms, req.command, csrf_token, ticket,
+            req.input_data, req.timeout, max(1, req.concurrency),
+        ):
+            yield json.dumps(result) + "\n"
+
+    return StreamingResponse(results(), media_type="application/x-ndjson", headers={"X-Accel-Buffering": "no"})
+
+@app.get("/fleet/jobs/{job_id}")
+async def get_fleet_job(
+    job_id: int,
+    csrf_token: str,
+    ticket: str,
+    svc: FleetSnapshotService = Depends(get_fleet_snapshot_service),
+):
+    # Jobs are shared; a caller only sees the VMs of it their ticket can see
+    visible = guest_ids(await proxmox_endpoints.authorize(csrf_token, ticket, "/cluster/resources"))
+    return svc.get_job(job_id, visible)
+
+@app.get("/fleet/retention")
+async def list_retention_policies(
+    csrf_token: str,
+    ticket: str,
+    svc: FleetSnapshotService = Depends(get_fleet_snapshot_service),
+):
+    await proxmox_endpoints.authorize(csrf_token, ticket)
+    return list(svc.policies.values())
+
+@app.put("/fleet/retention")
+async def set_retention_policy(
+    csrf_token: str,
+    ticket: str,
+    policy: RetentionPolicy,
+    svc: FleetSnapshotService = Depends(get_fleet_snapshot_service),
+):
+    return await svc.set_policy(policy.model_dump(), csrf_token, ticket)
+
+@app.delete("/fleet/retention/{name}")
+async def delete_retention_policy(
+    name: str,
+    csrf_token: str,
+    ticket: str,
+    svc: FleetSnapshotService = Depends(get_fleet_snapshot_service),
+):
+    await proxmox_endpoints.authorize(csrf_token, ticket, "/cluster/resources")
+    svc.delete_policy(name)
+    return {"message": f"Retention policy '{name}' deleted"}
+
+@app.post("/fleet/retention/{name}/run")
+async def run_retention_policy(
+    name: str,
+    csrf_token: str,
+    ticket: str,
+    dry_run: bool = False,
+    svc: FleetSnapshotService = Depends(get_fleet_snapshot_service),
+):
+    await proxmox_endpoints.authorize(csrf_token, ticket, "/cluster/resources")
+    if name not in svc.policies:
+        raise HTTPException(status_code=404, detail=f"Retention policy '{name}' not found")
+    return await svc.prune(svc.policies[name], csrf_token, ticket, dry_run)
+
+@app.get("/metrics/{node}")
+async def get_node_metrics(
+    node: str,
+    csrf_token: str,
+    ticket: str,
+    start: Optional[int] = None,
+    end: Optional[int] = None,
+    points: int = Query(300, ge=3, le=5000),
+    mode: str = "lttb",
+    fields: Optional[str] = None,
+    svc: MetricsService = Depends(get_metrics_service),
+):
+    resources = await proxmox_endpoints.authorize(csrf_token, ticket, "/cluster/resources")
+    if not any(r.get("type") == "node" and r.get("node") == node for r in resources or []):
+        raise HTTPException(status_code=404, detail=f"Node {node} not found")
+    svc.remember(csrf_token, ticket, len(resources))
+    return svc.series("node", node, start, end, points, mode, fields.split(",") if fields else None)
+
+@app.get("/metrics/{node}/qemu/{vmid}")
+async def get_vm_metrics(
+    node: str,
+    vmid: int,
+    csrf_token: str,
+    ticket: str,
+    start: Optional[int] = None,
+    end: Optional[int] = None,
+    points: int = Query(300, ge=3, le=5000),
+    mode: str = "lttb",
+    fields: Optional[str] = None,
+    svc: MetricsService = Depends(get_metrics_service),
+):
+    resources = await proxmox_endpoints.authorize(csrf_token, ticket, "/cluster/resources")
+    if vmid not in guest_ids(resources):
+        raise HTTPException(status_code=404, detail=f"VM {vmid} not found")
+    svc.remember(csrf_token, ticket, len(resources))
+    return svc.series("qemu", vmid, start, end, points, mode, fields.split(",") if fields else None)
+
+@app.get("/recommendations")
+async def get_recommendations(
+    csrf_token: str,
+    ticket: str,
+    refresh: bool = False,
+    svc: RightsizingService = Depends(get_rightsizing_service),
+):
+    # The report is shared, so each caller only sees the VMs and nodes their ticket can
+    resources = await proxmox_endpoints.authorize(csrf_token, ticket, "/cluster/resources")
+    nodes = {r["node"] for r in resources or [] if r.get("type") == "node"}
+    return await svc.get_report(csrf_token, ticket, refresh, guest_ids(resources), nodes)
+
+@app.post("/recommendations/{vmid}/apply")
+async def apply_recommendation(
+    vmid: int,
+    csrf_token: str,
+    ticket: str,
+    svc: RightsizingService = Depends(get_rightsizing_service),
+    vm_svc: VMService = Depends(get_vm_service),
+):
+    rec = svc.get_recommendation(vmid)
+    # The report may predate a migration; write to wherever the VM lives now
+    resources = await proxmox_endpoints.authorize(csrf_token, ticket, "/cluster/resources")
+    current = next((r for r in resources or [] if r.get("type") == "qemu" and r.get("vmid") == vmid), None)
+    if current is None:
+        raise HTTPException(status_code=404, detail=f"VM {vmid} not found")
+    node = current["node"]
+    config = vm_svc.get_vm_config(node, vmid, ticket)
+    updates = svc.as_update(rec, config)
+    # Same path as a manual edit, guarded by the digest of the config the sizes were applied to.
+    # Running VMs are the usual target: Proxmox hot-plugs what it can and keeps the rest pending
+    result = await run_locked(
+        vmid, "update_config", node, csrf_token, ticket,
+        lambda: vm_svc.update_vm_config(node, vmid, updates, csrf_token, ticket, config.get("digest"), allow_pending=True),
+    )
+    pending = []
+    if current.get("status") == "running":
+        response = await proxmox_endpoints.request(
+            "GET", f"/nodes/{node}/qemu/{vmid}/pending", node=node,
+            headers={"CSRFPreventionToken": csrf_token}, cookies={"PVEAuthCookie": ticket},
+        )
+        if response.status_code == 200:
+            pending = sorted(
+                e["key"] for e in response.json().get("data") or []
+                if e.get("key") in ("cores", "memory") and "pending" in e
+            )
+        else:
+            # Unknown, so assume the worst rather than claim the new sizes are live
+            pending = ["cores", "memory"]
+    return {
+        "vmid": vmid,
+        "node": node,
+        "applied": updates.model_dump(exclude_none=True),
+        "pending": pending,
+        "reboot_required": bool(pending),
+        "message": f"Pending until the VM is rebooted: {', '.join(pending)}" if pending else "Applied",
+        "result": result,
+    }
+
+@app.post("/placement")
+async def plan_placement(
+    csrf_token: str,
+    ticket: str,
+    req: PlacementRequest,
+    svc: PlacementService = Depends(get_placement_service),
+):
+    return await svc.place([spec.model_dump() for spec in req.vms], csrf_token, ticket, req.reserve)
+
+@app.post("/nodes/{node}/evacuate")
+async def evacuate_node(
+    node: str,
+    csrf_token: str,
+    ticket: str,
+    concurrency: int = Query(2, ge=1, le=16),
+    bwlimit: Optional[int] = Query(None, ge=1, description="Per-migration limit in KiB/s"),
+    max_retries: int = Query(2, ge=0, le=10),
+    include_stopped: bool = True,
+    svc: EvacuationService = Depends(get_evacuation_service),
+):
+    return await svc.evacuate(node, csrf_token, ticket, concurrency, bwlimit, max_retries, include_stopped)
+
+@app.get("/evacuations/{job_id}")
+async def get_evacuation(
+    job_id: int,
+    csrf_token: str,
+    ticket: str,
+    svc: EvacuationService = Depends(get_evacuation_service),
+):
+    visible = guest_ids(await proxmox_endpoints.authorize(csrf_token, ticket, "/cluster/resources"))
+    return svc.get_job(job_id, visible)
+
+@app.post("/backups")
+async def start_backup(
+    csrf_token: str,
+    ticket: str,
+    req: BackupRequest,
+    svc: BackupService = Depends(get_backup_service),
+):
+    return await svc.backup(
+        csrf_token, ticket, req.storage, req.vmids, req.tag, req.pool, req.mode, req.compress, req.bwlimit,
+    )
+
+@app.get("/backups/jobs/{job_id}")
+async def get_backup_job(
+    job_id: int,
+    csrf_token: str,
+    ticket: str,
+    svc: BackupService = Depends(get_backup_service),
+):
+    visible = guest_ids(await proxmox_endpoints.authorize(csrf_token, ticket, "/cluster/resources"))
+    return svc.get_job(job_id, visible)
+
+@app.get("/backups/runs")
+async def list_backup_runs(
+    csrf_token: str,
+    ticket: str,
+    vmid: Optional[int] = None,
+    storage: Optional[str] = None,
+    status: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+    svc: BackupService = Depends(get_backup_service),
+):
+    await proxmox_endpoints.authorize(csrf_token, ticket, "/cluster/resources")
+    return svc.list_runs(vmid, storage, status, limit, offset)
+
+@app.get("/backups/storages")
+async def list_backup_queues(
+    csrf_token: str,
+    ticket: str,
+    svc: BackupService = Depends(get_backup_service),
+):
+    await proxmox_endpoints.authorize(csrf_token, ticket, "/storage")
+    return {storage: queue.as_dict() for storage, queue in svc.queues.items()}
+
+@app.put("/backups/storages/{storage}")
+async def set_backup_concurrency(
+    storage: str,
+    csrf_token: str,
+    ticket: str,
+    concurrency: int = Query(..., ge=1, le=32),
+    svc: BackupService = Depends(get_backup_service),
+):
+    await proxmox_endpoints.authorize(csrf_token, ticket, f"/storage/{storage}")
+    return await svc.set_storage_limit(storage, concurrency)
+
+@app.get("/memory/history")
+async def get_memory_history(
+    csrf_token: str,
+    ticket: str,
+    svc: MemoryService = Depends(get_memory_service),
+):
+    visible = guest_ids(await proxmox_endpoints.authorize(csrf_token, ticket, "/cluster/resources"))
+    return [change for change in svc.history if change["vmid"] in visible]
+
+@app.put("/memory/{node}/bounds/{vmid}")
+async def set_balloon_bounds(
+    node: str,
+    vmid: int,
+    csrf_token: str,
+    ticket: str,
+    bounds: BalloonBounds,
+    svc: MemoryService = Depends(get_memory_service),
+):
+    # Bounds are applied later with someone else's ticket, so the caller must be allowed to change the VM's memory
+    config = await proxmox_endpoints.authorize(csrf_token, ticket, f"/nodes/{node}/qemu/{vmid}/config", node=node)
+    privileges = await proxmox_endpoints.authorize(csrf_token, ticket, "/access/permissions", params={"path": f"/vms/{vmid}"})
+    if not any((p or {}).get("VM.Config.Memory") for p in (privileges or {}).values()):
+        raise HTTPException(status_code=403, detail=f"Permission check failed (/vms/{vmid}, VM.Config.Memory)")
+    return svc.set_bounds(vmid, bounds.min_mib, bounds.max_mib, int(config.get("memory", 512)))
+
+@app.get("/memory/{node}")
+async def get_memory_report(
+    node: str,
+    csrf_token: str,
+    ticket: str,
+    svc: MemoryService = Depends(get_memory_service),
+):
+    report = await svc.report(node, csrf_token, ticket)
+    return {
+        **report, "plan": svc.plan(report), "auto": node in svc.auto_nodes,
+        "auto_stopped": svc.auto_stopped.get(node),
+    }
+
+@app.post("/memory/{node}/rebalance")
+async def rebalance_memory(
+    node: str,
+    csrf_token: str,
+    ticket: str,
+    dry_run: bool = False,
+    svc: MemoryService = Depends(get_memory_service),
+):
+    return await svc.rebalance(node, csrf_token, ticket, dry_run)
+
+@app.put("/memory/{node}/auto")
+async def set_memory_auto(
+    node: str,
+    csrf_token: str,
+    ticket: str,
+    enabled: bool,
+    svc: MemoryService = Depends(get_memory_service),
+):
+    return await svc.set_auto(node, enabled, csrf_token, ticket)
+
+@app.get("/search")
+async def search_vms(
+    q: str,
+    csrf_token: str,
+    ticket: str,
+    limit: int = Query(50, ge=1, le=500),
+    refresh: bool = False,
+    svc: SearchService = Depends(get_search_service),
+):
+    # The index is shared, so answers are limited to the guests this ticket can see,
+    # and only a ticket Proxmox accepted is kept for background refreshes
+    resources = await proxmox_endpoints.authorize(csrf_token, ticket, "/cluster/resources")
+    svc.remember(csrf_token, ticket, len(resources or []))
+    # Answered from memory; only the very first query (or an explicit refresh) waits for Proxmox
+    prune = svc.credentials == (csrf_token, ticket)
+    if refresh:
+        await svc.refresh(csrf_token, ticket, max_age=0, prune=prune)
+    elif not svc.docs:
+        await svc.refresh(csrf_token, ticket, prune=prune)
+    return svc.search(q, limit, guest_ids(resources))
+
 @app.get("/vm/{node}/qemu/{vmid}/status")
 async def get_vm_status(
     node: str,
@@ -163,50 +915,47 @@ async def get_vm_config(
     vmid: int,
     csrf_token: str,
     ticket: str,
+    if_none_match: Optional[str] = Header(None),
     svc: VMService = Depends(get_vm_service),
 ):
     try:
         config = svc.get_vm_config(node, vmid, ticket)
+        status = svc.get_vm_status(node, vmid, csrf_token, ticket)
+        etag = make_etag(config.get("digest"), status)
+        headers = {"ETag": etag} if etag else {}
+
+        # Unchanged since the client's copy: skip the sort/parse work entirely
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers=headers)
 
-        # ✅ Sort NICs and Disks by their numeric suffix
-        def sort_key(item):
-            key = item[0]
-            # Patterns to sort: net0, scsi0, virtio1, sata2, ide3
-            patterns = ("net", "scsi", "virtio", "sata", "ide")
-            for p in patterns:
-                if key.startswith(p) and key[len(p):].isdigit():
-                    return (0, p, int(key[len(p):]))
-            return (1, key, 0)  # Non-matching keys go later, sorted by name
-
-        sorted_config = dict(sorted(config.items(), key=sort_key))
-
-        # HDD sizes for summary
-        disks = []
-        for key, value in sorted_config.items():
-            if any(key.startswith(prefix) for prefix in ("ide", "sata", "scsi", "virtio")) and isinstance(value, str):
-                if "cdrom" not in value:
-                    m = re.search(r'size=(\d+[KMGT]?)', value)
-                    if m:
-                        disks.append(m.group(1))
-
-        return {
-            "vmid": vmid,
-            "name": sorted_config.get("name", f"VM {vmid}"),
-            "cores": sorted_config.get("cores", 0),
-            "memory": sorted_config.get("memory", 0),
-            "ostype": sorted_config.get("ostype", "unknown"),
-            "hdd_sizes": ", ".join(disks) if disks else "N/A",
-            "num_hdd": len(disks),
-            "hdd_free": "N/A",
-            "ip_address": "N/A",
-            "status": svc.get_vm_status(node, vmid, csrf_token, ticket),
-            "config": sorted_config,
-        }
+        sorted_config = sort_config(config)
+
+        return JSONResponse(
+            content={
+                **summarize_config(vmid, sorted_config),
+                "status": status,
+                "config": sorted_config,
+            },
+            headers=headers,
+        )
     except HTTPException as e:
         raise HTTPException(status_code=e.status_code, detail=f"Failed to fetch VM config: {e.detail}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Unexpected error: {e}")
 
+@app.get("/vm/{node}/qemu/{vmid}/detail")
+async def get_vm_detail(
+    node: str,
+    vmid: int,
+    csrf_token: str,
+    ticket: str,
+    svc: VMService = Depends(get_vm_service),
+):
+    async with proxmox_endpoints.lease(node) as endpoint:
+        return await svc.get_vm_detail(
+            node, vmid, csrf_token, ticket, api_url=endpoint.url, client=proxmox_endpoints.client(endpoint)
+        )
+
 @app.post("/vm/{node}/qemu/{vmid}/update_config")
 async def update_vm_config(
     node: str,
@@ -214,10 +963,15 @@ async def update_vm_config(
     updates: VMUpdateRequest,
     csrf_token: str,
     ticket: str,
+    digest: Optional[str] = None,
+    if_match: Optional[str] = Header(None),
     svc: VMService = Depends(get_vm_service),
 ):
     try:
-        return svc.update_vm_config(node, vmid, updates, csrf_token, ticket)
+        return await run_locked(
+            vmid, "update_config", node, csrf_token, ticket,
+            lambda: svc.update_vm_config(node, vmid, updates, csrf_token, ticket, digest or digest_from_etag(if_match)),
+        )
     except HTTPException as e:
         raise HTTPException(status_code=e.status_code, detail=f"Failed to update VM config: {e.detail}")
     except Exception as e:
@@ -233,6 +987,35 @@ async def list_snapshots(
 ):
     return svc.get_snapshots(node, vmid, csrf_token, ticket)
 
+@app.get("/vm/{node}/qemu/{vmid}/snapshots/tree")
+async def get_snapshot_tree(
+    node: str,
+    vmid: int,
+    csrf_token: str,
+    ticket: str,
+    svc: SnapshotService = Depends(get_snapshot_service),
+):
+    # Trees are cached for all callers, so the caller's own access is checked first
+    await proxmox_endpoints.authorize(csrf_token, ticket, f"/nodes/{node}/qemu/{vmid}/snapshot", node=node)
+    return svc.get_snapshot_tree(node, vmid, csrf_token, ticket)
+
+@app.get("/vms/{node}/snapshots/trees")
+async def get_snapshot_trees(
+    node: str,
+    csrf_token: str,
+    ticket: str,
+    vmids: List[int] = Query(...),
+    svc: SnapshotService = Depends(get_snapshot_service),
+):
+    # One listing tells which of the VMs on this node the caller may see
+    listed = await proxmox_endpoints.authorize(csrf_token, ticket, f"/nodes/{node}/qemu", node=node)
+    visible = {int(vm["vmid"]) for vm in listed or []}
+    async with proxmox_endpoints.lease(node) as endpoint:
+        return await svc.get_snapshot_trees(
+            node, vmids, csrf_token, ticket, api_url=endpoint.url, client=proxmox_endpoints.client(endpoint),
+            visible=visible,
+        )
+
 @app.post("/vm/{node}/qemu/{vmid}/clone")
 async def clone_vm(
     node: str,
@@ -241,8 +1024,25 @@ async def clone_vm(
     csrf_token: str,
     ticket: str,
     svc: VMService = Depends(get_vm_service),
+    placement: PlacementService = Depends(get_placement_service),
 ):
-    return svc.clone_vm(node, vmid, clone_req, csrf_token, ticket)
+    if clone_req.target == "auto":
+        spec = placement.clone_spec(node, svc.get_vm_config(node, vmid, ticket), clone_req.full, clone_req.storage)
+        target = await placement.choose(csrf_token, ticket, **spec)
+        clone_req = clone_req.model_copy(update={"target": target})
+    if clone_req.profile and clone_req.newid is None:
+        clone_req = clone_req.model_copy(update={"newid": svc.next_vmid(ticket)})
+    upid = await run_locked(
+        vmid, "clone", node, csrf_token, ticket,
+        lambda: svc.clone_vm(node, vmid, clone_req, csrf_token, ticket),
+    )
+    if clone_req.profile and upid:
+        task = asyncio.create_task(apply_profile_after(
+            upid, clone_req.target, clone_req.newid, clone_req.profile, csrf_token, ticket, svc,
+        ))
+        profile_tasks.add(task)
+        task.add_done_callback(profile_tasks.discard)
+    return upid
 
 @app.post("/vm/{node}/qemu/{vmid}/snapshot")
 async def create_snapshot(
@@ -255,14 +1055,17 @@ async def create_snapshot(
 ):
     if not snap_request.snapname.strip():
         raise HTTPException(status_code=400, detail="Snapshot name cannot be empty")
-    return svc.create_snapshot(
-        node,
-        vmid,
-        snap_request.snapname.strip(),
-        snap_request.description,
-        snap_request.vmstate,
-        csrf_token,
-        ticket,
+    return await run_locked(
+        vmid, "snapshot", node, csrf_token, ticket,
+        lambda: svc.create_snapshot(
+            node,
+            vmid,
+            snap_request.snapname.strip(),
+            snap_request.description,
+            snap_request.vmstate,
+            csrf_token,
+            ticket,
+        ),
     )
 
 @app.post("/vm/{node}/qemu/{vmid}/snapshot/{snapname}/revert")
@@ -274,7 +1077,10 @@ async def revert_snapshot(
     ticket: str,
     svc: SnapshotService = Depends(get_snapshot_service),
 ):
-    return svc.revert_snapshot(node, vmid, snapname, csrf_token, ticket)
+    return await run_locked(
+        vmid, "rollback", node, csrf_token, ticket,
+        lambda: svc.revert_snapshot(node, vmid, snapname, csrf_token, ticket),
+    )
 
 @app.delete("/vm/{node}/qemu/{vmid}/snapshot/{snapname}")
 async def delete_snapshot(
@@ -285,7 +1091,10 @@ async def delete_snapshot(
     ticket: str,
     svc: SnapshotService = Depends(get_snapshot_service),
 ):
-    return svc.delete_snapshot(node, vmid, snapname, csrf_token, ticket)
+    return await run_locked(
+        vmid, "delsnapshot", node, csrf_token, ticket,
+        lambda: svc.delete_snapshot(node, vmid, snapname, csrf_token, ticket),
+    )
 
 @app.post("/vm/{node}/qemu/{vmid}/vncproxy")
 async def get_vnc_proxy(
@@ -311,8 +1120,11 @@ async def create_vm(
     csrf_token: str,
     ticket: str,
     svc: VMService = Depends(get_vm_service),
+    placement: PlacementService = Depends(get_placement_service),
 ):
-    return svc.create_vm(node, vm_create, csrf_token, ticket)
+    if node == "auto":
+        node = await placement.choose(csrf_token, ticket, **placement.create_spec(vm_create))
+    return track_task(svc.create_vm(node, vm_create, csrf_token, ticket), node, csrf_token, ticket)
 
 @app.post("/vm/{node}/qemu/{vmid}/add-disk")
 async def add_disk(
@@ -321,9 +1133,32 @@ async def add_disk(
     req: VMDiskAddRequest,
     csrf_token: str,
     ticket: str,
+    digest: Optional[str] = None,
+    if_match: Optional[str] = Header(None),
+    svc: DiskService = Depends(get_disk_service),
+):
+    return await run_locked(
+        vmid, "add_disk", node, csrf_token, ticket,
+        lambda: svc.add_disk(node, vmid, req, csrf_token, ticket, digest or digest_from_etag(if_match)),
+    )
+
+@app.post("/vm/{node}/qemu/{vmid}/disks")
+async def add_disks(
+    node: str,
+    vmid: int,
+    req: VMDisksAddRequest,
+    csrf_token: str,
+    ticket: str,
+    digest: Optional[str] = None,
+    if_match: Optional[str] = Header(None),
     svc: DiskService = Depends(get_disk_service),
 ):
-    return svc.add_disk(node, vmid, req, csrf_token, ticket)
+    if not req.disks:
+        raise HTTPException(status_code=400, detail="No disks requested")
+    return await run_locked(
+        vmid, "add_disk", node, csrf_token, ticket,
+        lambda: svc.add_disks(node, vmid, req.disks, csrf_token, ticket, digest or digest_from_etag(if_match)),
+    )
 
 @app.delete("/vm/{node}/qemu/{vmid}/disk/{disk_key}")
 async def delete_disk(
@@ -332,9 +1167,30 @@ async def delete_disk(
     disk_key: str,
     csrf_token: str,
     ticket: str,
+    digest: Optional[str] = None,
+    if_match: Optional[str] = Header(None),
     svc: DiskService = Depends(get_disk_service),
 ):
-    return svc.delete_disk(node, vmid, disk_key, csrf_token, ticket)
+    return await run_locked(
+        vmid, "delete_disk", node, csrf_token, ticket,
+        lambda: svc.delete_disk(node, vmid, disk_key, csrf_token, ticket, digest or digest_from_etag(if_match)),
+    )
+
+@app.delete("/vm/{node}/qemu/{vmid}/disks")
+async def delete_disks(
+    node: str,
+    vmid: int,
+    csrf_token: str,
+    ticket: str,
+    keys: List[str] = Query(...),
+    digest: Optional[str] = None,
+    if_match: Optional[str] = Header(None),
+    svc: DiskService = Depends(get_disk_service),
+):
+    return await run_locked(
+        vmid, "delete_disk", node, csrf_token, ticket,
+        lambda: svc.delete_disks(node, vmid, keys, csrf_token, ticket, digest or digest_from_etag(if_match)),
+    )
 
 @app.post("/vm/{node}/qemu/{vmid}/activate-unused-disk/{unused_key}")
 async def activate_unused_disk(
@@ -344,9 +1200,17 @@ async def activate_unused_disk(
     csrf_token: str,
     ticket: str,
     target_controller: str = "scsi",
+    profile: Optional[str] = None,
+    digest: Optional[str] = None,
+    if_match: Optional[str] = Header(None),
     svc: DiskService = Depends(get_disk_service),
 ):
-    return await svc.activate_unused_disk(node, vmid, unused_key, target_controller, csrf_token, ticket)
+    return await run_locked(
+        vmid, "activate_disk", node, csrf_token, ticket,
+        lambda: svc.activate_unused_disk(
+            node, vmid, unused_key, target_controller, csrf_token, ticket, digest or digest_from_etag(if_match), profile
+        ),
+    )
 
 @app.delete("/vm/{node}/qemu/{vmid}")
 async def delete_vm(
@@ -356,7 +1220,10 @@ async def delete_vm(
     ticket: str,
     svc: VMService = Depends(get_vm_service),
 ):
-    return svc.delete_vm(node, vmid, csrf_token, ticket)
+    return await run_locked(
+        vmid, "delete_vm", node, csrf_token, ticket,
+        lambda: svc.delete_vm(node, vmid, csrf_token, ticket),
+    )
 
 @app.post("/vm/{node}/qemu/{vmid}/{action}")
 async def control_vm(
@@ -365,7 +1232,10 @@ async def control_vm(
     action: str,
     csrf_token: str,
     ticket: str,
+    wait: Optional[str] = None,
+    timeout: int = Query(120, ge=1, le=600),
     svc: VMService = Depends(get_vm_service),
+    agent: AgentService = Depends(get_agent_service),
 ):
     # Convert hibernate to suspend
     if action == "hibernate":
@@ -373,7 +1243,19 @@ async def control_vm(
 
     if action not in ["start", "stop", "shutdown", "reboot", "suspend", "resume"]:
         raise HTTPException(status_code=400, detail="Invalid action")
-    return svc.vm_action(node, vmid, action, csrf_token, ticket)
+    if wait is not None and (wait != "agent" or action not in ["start", "reboot", "resume"]):
+        raise HTTPException(status_code=400, detail="wait=agent is only supported for start, reboot and resume")
+    upid = await run_locked(
+        vmid, action, node, csrf_token, ticket,
+        lambda: svc.vm_action(node, vmid, action, csrf_token, ticket),
+    )
+    if wait != "agent":
+        return upid
+    # Answer once the guest is reachable, so clients need not poll /vms for the IP
+    async with proxmox_endpoints.lease(node) as endpoint:
+        return await agent.wait_until_ready(
+            proxmox_endpoints.client(endpoint), node, vmid, upid, csrf_token, ticket, timeout, endpoint.url,
+        )
 
 @app.websocket("/ws/console/{node}/{vmid}")
 async def websocket_console(
@@ -454,9 +1336,14 @@ async def expand_disk(
     req: DiskExpandRequest,
     csrf_token: str,
     ticket: str,
+    digest: Optional[str] = None,
+    if_match: Optional[str] = Header(None),
     svc: DiskService = Depends(get_disk_service),
 ):
-    return svc.expand_disk(node, vmid, disk_key, req.new_size, csrf_token, ticket)
+    return await run_locked(
+        vmid, "expand_disk", node, csrf_token, ticket,
+        lambda: svc.expand_disk(node, vmid, disk_key, req.new_size, csrf_token, ticket, digest or digest_from_etag(if_match)),
+    )
 
 @app.delete("/vm/{node}/qemu/{vmid}/network")
 async def remove_network_interface(
@@ -465,12 +1352,24 @@ async def remove_network_interface(
     nic: str = Query(...),
     csrf_token: str = Query(...),
     ticket: str = Query(...),
+    digest: Optional[str] = None,
+    if_match: Optional[str] = Header(None),
     svc: VMService = Depends(get_vm_service)
 ):
     if not nic:
         raise HTTPException(status_code=400, detail="NIC name is required")
     try:
-        return svc.modify_vm_network(node, vmid, net=None, delete=nic, csrf_token=csrf_token, ticket=ticket)
+        return await run_locked(
+            vmid, "network", node, csrf_token, ticket,
+            lambda: svc.modify_vm_network(
+                node, vmid, net=None, delete=nic, csrf_token=csrf_token, ticket=ticket,
+                digest=digest or digest_from_etag(if_match),
+            ),
+        )
+    except HTTPException as e:
+        if e.status_code == 412:
+            raise
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
@@ -481,10 +1380,22 @@ async def update_network_interface(
     config: dict = Body(...),
     csrf_token: str = Query(...),
     ticket: str = Query(...),
+    digest: Optional[str] = None,
+    if_match: Optional[str] = Header(None),
     svc: VMService = Depends(get_vm_service)
 ):
     try:
-        return svc.modify_vm_network(node, vmid, net=config, delete=None, csrf_token=csrf_token, ticket=ticket)
+        return await run_locked(
+            vmid, "network", node, csrf_token, ticket,
+            lambda: svc.modify_vm_network(
+                node, vmid, net=config, delete=None, csrf_token=csrf_token, ticket=ticket,
+                digest=digest or digest_from_etag(if_match),
+            ),
+        )
+    except HTTPException as e:
+        if e.status_code == 412:
+            raise
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
@@ -0,0 +1,6 @@
+import pytest
+
+
+@pytest.fixture
+def log_file(tmp_path):
+    return str(tmp_path / "test.log")
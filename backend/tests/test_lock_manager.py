@@ -0,0 +1,74 @@
+import asyncio
+
+from Modules.services.lock_manager import VMLockManager
+
+
+def test_operations_on_one_vm_run_in_fifo_order(log_file):
+    locks = VMLockManager(log_file)
+    order = []
+
+    async def operation(name: str, delay: float):
+        async with locks.hold(100, name):
+            order.append(f"{name} start")
+            await asyncio.sleep(delay)
+            order.append(f"{name} end")
+
+    async def main():
+        first = asyncio.create_task(operation("first", 0.02))
+        await asyncio.sleep(0)
+        # Queued behind "first"; the shorter one must still wait its turn
+        second = asyncio.create_task(operation("second", 0.0))
+        third = asyncio.create_task(operation("third", 0.0))
+        await asyncio.sleep(0)
+        assert [e["operation"] for e in locks.queue(100)] == ["first", "second", "third"]
+        assert [e["running"] for e in locks.queue(100)] == [True, False, False]
+        await asyncio.gather(first, second, third)
+
+    asyncio.run(main())
+    assert order == ["first start", "first end", "second start", "second end", "third start", "third end"]
+    assert locks.all_queues() == {}
+
+
+def test_different_vms_run_in_parallel(log_file):
+    locks = VMLockManager(log_file)
+
+    async def main():
+        async with locks.hold(100, "a"):
+            # Would deadlock if VM 101 waited on VM 100's lock
+            async with locks.hold(101, "b"):
+                assert set(locks.all_queues()) == {100, 101}
+
+    asyncio.run(asyncio.wait_for(main(), 1))
+
+
+def test_cancelled_waiter_leaves_the_queue(log_file):
+    locks = VMLockManager(log_file)
+
+    async def main():
+        async with locks.hold(100, "running"):
+            waiter = asyncio.create_task(locks.hold(100, "waiting").__aenter__())
+            await asyncio.sleep(0)
+            assert len(locks.queue(100)) == 2
+            waiter.cancel()
+            await asyncio.gather(waiter, return_exceptions=True)
+            assert [e["operation"] for e in locks.queue(100)] == ["running"]
+        assert locks.queue(100) == []
+
+    asyncio.run(main())
+
+
+def test_release_after_keeps_the_vm_locked_until_the_task_ends(log_file):
+    locks = VMLockManager(log_file)
+
+    async def main():
+        task_done = asyncio.Event()
+        async with locks.hold(100, "start") as entry:
+            entry.release_after(task_done.wait())
+        await asyncio.sleep(0)
+        assert [e["operation"] for e in locks.queue(100)] == ["start"]
+        task_done.set()
+        await asyncio.sleep(0.01)
+        assert locks.queue(100) == []
+        assert not locks.release_tasks
+
+    asyncio.run(main())
@@ -0,0 +1,70 @@
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from Modules.services.memory_service import MAX_CHANGES_PER_PASS, MAX_STEP_MIB, MIB, MemoryService
+
+
+def vm(vmid, actual, reclaimable=0, max_mib=8192, managed=True):
+    return {
+        "vmid": vmid, "actual_mib": actual, "reclaimable_mib": reclaimable,
+        "max_mib": max_mib, "managed": managed,
+    }
+
+
+def report(used_mib, vms, total_mib=100_000):
+    return {"total_mib": total_mib, "used_mib": used_mib, "pressure": used_mib / total_mib, "vms": vms}
+
+
+@pytest.fixture
+def svc(log_file):
+    return MemoryService(log_file, endpoints=None)
+
+
+def test_no_changes_between_the_marks(svc):
+    assert svc.plan(report(80_000, [vm(1, 4096, reclaimable=2048)])) == []
+
+
+def test_high_pressure_shrinks_only_the_excess(svc):
+    # 90% used, 85% mark: 5000 MiB to give back
+    changes = svc.plan(report(90_000, [vm(1, 8192, reclaimable=4000), vm(2, 8192, reclaimable=4000)]))
+    assert [(c["vmid"], c["from_mib"] - c["to_mib"]) for c in changes] == [(1, MAX_STEP_MIB), (2, MAX_STEP_MIB)]
+    small = svc.plan(report(85_500, [vm(1, 8192, reclaimable=4000)]))
+    assert [(c["vmid"], c["to_mib"]) for c in small] == [(1, 8192 - 500)]
+
+
+def test_unmanaged_and_cooling_down_vms_are_left_alone(svc):
+    svc.last_change[2] = time.monotonic()
+    vms = [vm(1, 8192, reclaimable=4000, managed=False), vm(2, 8192, reclaimable=4000), vm(3, 8192, reclaimable=100)]
+    assert [c["vmid"] for c in svc.plan(report(95_000, vms))] == [3]
+
+
+def test_low_pressure_grows_the_most_squeezed_first(svc):
+    vms = [vm(1, 7000, max_mib=8192), vm(2, 2048, max_mib=8192), vm(3, 8192, max_mib=8192)]
+    changes = svc.plan(report(50_000, vms))
+    assert [(c["vmid"], c["to_mib"]) for c in changes] == [(2, 2048 + MAX_STEP_MIB), (1, 7000 + MAX_STEP_MIB)]
+
+
+def test_changes_per_pass_are_capped(svc):
+    vms = [vm(i, 8192, reclaimable=4000) for i in range(MAX_CHANGES_PER_PASS + 5)]
+    assert len(svc.plan(report(99_000, vms))) == MAX_CHANGES_PER_PASS
+
+
+def test_vm_entry_targets_usage_plus_headroom_within_bounds(svc):
+    config = {"memory": "8192", "balloon": "2048"}
+    status = {"ballooninfo": {"actual": 8192 * MIB, "total_mem": 8000 * MIB, "free_mem": 6000 * MIB}}
+    entry = svc._vm_entry(100, "web", config, status)
+    assert entry["managed"] and entry["used_mib"] == 2000
+    assert entry["target_mib"] == 2400 and entry["reclaimable_mib"] == 8192 - 2400
+    # Without guest statistics there is nothing to base a target on
+    assert not svc._vm_entry(100, "web", config, {"ballooninfo": {"actual": 8192 * MIB}})["managed"]
+    assert not svc._vm_entry(100, "web", dict(config, balloon="0"), status)["managed"]
+
+
+def test_set_bounds_validates_against_memory(svc):
+    assert svc.set_bounds(100, 1024, 4096, 8192) == {"min_mib": 1024, "max_mib": 4096}
+    for min_mib, max_mib in ((4096, 1024), (1024, 16384), (0, None)):
+        with pytest.raises(HTTPException) as e:
+            svc.set_bounds(100, min_mib, max_mib, 8192)
+        assert e.value.status_code == 400
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from Modules.services.metrics_service import RingBuffer, lttb, minmax_buckets
+
+
+def test_lttb_returns_input_when_already_small():
+    t, v = np.arange(5), np.arange(5.0)
+    out_t, out_v = lttb(t, v, 10)
+    assert out_t is t and out_v is v
+    # Below three points there is no triangle to rank
+    assert len(lttb(np.arange(100), np.arange(100.0), 2)[0]) == 100
+
+
+def test_lttb_keeps_endpoints_and_order():
+    t = np.arange(1000)
+    v = np.sin(t / 50.0)
+    out_t, out_v = lttb(t, v, 50)
+    assert len(out_t) == 50
+    assert out_t[0] == 0 and out_t[-1] == 999
+    assert np.all(np.diff(out_t) > 0)
+    np.testing.assert_array_equal(out_v, v[out_t])
+
+
+def test_lttb_keeps_a_spike():
+    t = np.arange(1000)
+    v = np.zeros(1000)
+    v[437] = 100.0
+    out_t, _ = lttb(t, v, 20)
+    assert 437 in out_t
+
+
+def test_minmax_buckets_reduce_each_bucket():
+    t = np.arange(10)
+    v = np.array([1, 5, 2, 8, 3, 3, 9, 0, 4, 6], dtype=float)
+    out = minmax_buckets(t, v, 2)
+    assert out["time"] == [0, 5]
+    assert out["min"] == [1, 0]
+    assert out["max"] == [8, 9]
+    assert out["avg"] == pytest.approx([3.8, 4.4])
+
+
+def test_minmax_buckets_with_fewer_points_than_buckets():
+    out = minmax_buckets(np.array([10, 20]), np.array([1.0, 2.0]), 100)
+    assert out["time"] == [10, 20]
+    assert out["min"] == out["max"] == out["avg"] == [1.0, 2.0]
+    assert minmax_buckets(np.array([], dtype=np.int64), np.array([]), 10) == {"time": [], "min": [], "max": [], "avg": []}
+
+
+def test_ring_buffer_wraps_and_skips_overlapping_rows():
+    ring = RingBuffer(("cpu",), capacity=4)
+    assert ring.extend([{"time": t, "cpu": t / 10} for t in (1, 2, 3)]) == 3
+    # RRD windows overlap: rows not newer than the last sample are dropped
+    assert ring.extend([{"time": t, "cpu": t / 10} for t in (2, 3, 4, 5, 6)]) == 3
+    times, values = ring.window()
+    assert times.tolist() == [3, 4, 5, 6]
+    assert values[:, 0].tolist() == pytest.approx([0.3, 0.4, 0.5, 0.6])
+    assert ring.window(4, 5)[0].tolist() == [4, 5]
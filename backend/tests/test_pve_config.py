@@ -0,0 +1,37 @@
+import pytest
+
+from Modules.pve_config import DRIVE_SLOTS, free_slots
+
+
+def test_free_slots_skips_used_indexes():
+    config = {"scsi0": "local-lvm:vm-100-disk-0", "scsi2": "local-lvm:vm-100-disk-1", "net0": "virtio"}
+    assert free_slots(config, "scsi", 3) == ["scsi1", "scsi3", "scsi4"]
+
+
+def test_free_slots_ignores_other_controllers_and_non_numeric_keys():
+    config = {"sata0": "x", "scsihw": "virtio-scsi-single", "virtio0": "y"}
+    assert free_slots(config, "scsi", 1) == ["scsi0"]
+    assert free_slots(config, "sata", 1) == ["sata1"]
+
+
+def test_free_slots_honours_start():
+    assert free_slots({}, "virtio", 2, start=5) == ["virtio5", "virtio6"]
+
+
+@pytest.mark.parametrize("controller", sorted(DRIVE_SLOTS))
+def test_free_slots_fills_a_bus_to_its_limit(controller):
+    limit = DRIVE_SLOTS[controller]
+    assert free_slots({}, controller, limit)[-1] == f"{controller}{limit - 1}"
+    with pytest.raises(ValueError, match="Not enough free"):
+        free_slots({}, controller, limit + 1)
+
+
+def test_free_slots_full_ide_bus():
+    config = {f"ide{i}": "none,media=cdrom" for i in range(DRIVE_SLOTS["ide"])}
+    with pytest.raises(ValueError):
+        free_slots(config, "ide", 1)
+
+
+def test_free_slots_rejects_unknown_controller():
+    with pytest.raises(ValueError, match="Unknown controller"):
+        free_slots({}, "nvme", 1)
@@ -0,0 +1,44 @@
+from datetime import datetime
+
+from Modules.services.fleet_snapshot_service import retention_plan
+
+NOW = datetime(2026, 3, 10, 12, 0).timestamp()
+HOUR = 3600
+DAY = 24 * HOUR
+
+
+def snap(name: str, age: float):
+    return {"name": name, "snaptime": int(NOW - age)}
+
+
+def names(snapshots):
+    return [s["name"] for s in snapshots]
+
+
+def test_keep_last_only():
+    snapshots = [snap(f"s{i}", i * HOUR) for i in range(5)]
+    assert names(retention_plan(snapshots, keep_last=2, keep_daily=0, now=NOW)) == ["s2", "s3", "s4"]
+
+
+def test_keep_daily_keeps_newest_snapshot_per_day():
+    # Two snapshots on each of the last three days
+    snapshots = [snap(f"d{day}-{n}", day * DAY + n * HOUR) for day in range(3) for n in range(2)]
+    doomed = retention_plan(snapshots, keep_last=0, keep_daily=3, now=NOW)
+    assert names(doomed) == ["d0-1", "d1-1", "d2-1"]
+
+
+def test_days_outside_the_window_are_deleted():
+    snapshots = [snap("today", HOUR), snap("old", 10 * DAY)]
+    assert names(retention_plan(snapshots, keep_last=0, keep_daily=2, now=NOW)) == ["old"]
+
+
+def test_rules_combine_and_input_order_does_not_matter():
+    snapshots = [snap("old", 10 * DAY), snap("new", HOUR), snap("yesterday", DAY), snap("older", 11 * DAY)]
+    doomed = retention_plan(snapshots, keep_last=1, keep_daily=2, now=NOW)
+    # Newest first, like the keep decisions
+    assert names(doomed) == ["old", "older"]
+
+
+def test_nothing_to_delete():
+    assert retention_plan([], keep_last=3, keep_daily=7, now=NOW) == []
+    assert retention_plan([snap("only", HOUR)], keep_last=1, keep_daily=0, now=NOW) == []
@@ -0,0 +1,86 @@
+import pytest
+from fastapi import HTTPException
+
+from Modules.services.search_service import SearchService, config_terms
+
+
+@pytest.fixture
+def svc(log_file):
+    svc = SearchService(log_file, endpoints=None)
+    svc.update_config(100, "pve1", "qemu", {
+        "name": "web", "tags": "prod;frontend",
+        "net0": "virtio=BC:24:11:AA:BB:01,bridge=vmbr0",
+        "ipconfig0": "ip=10.0.0.5/24,gw=10.0.0.1",
+        "scsi0": "local-lvm:vm-100-disk-0,size=32G",
+    })
+    svc.update_config(101, "pve1", "qemu", {"name": "webserver", "tags": "prod"})
+    svc.update_config(102, "pve2", "lxc", {
+        "hostname": "myweb", "net0": "name=eth0,hwaddr=BC:24:11:AA:BB:02,ip=dhcp",
+        "rootfs": "local-zfs:subvol-102-disk-0,size=8G",
+    })
+    return svc
+
+
+def vmids(result):
+    return [hit["vmid"] for hit in result["results"]]
+
+
+def test_exact_before_prefix_before_substring(svc):
+    result = svc.search("web")
+    assert vmids(result) == [100, 101, 102]
+    assert [hit["matches"][0]["match"] for hit in result["results"]] == ["exact", "prefix", "substring"]
+
+
+def test_query_is_case_and_whitespace_insensitive(svc):
+    assert vmids(svc.search("  WEB  ")) == [100, 101, 102]
+    assert svc.search("bc:24:11:aa:bb:01")["results"][0]["matches"] == [
+        {"field": "mac", "value": "BC:24:11:AA:BB:01", "match": "exact"},
+    ]
+
+
+def test_substring_reports_each_term_once_and_not_across_terms(svc):
+    result = svc.search("disk-0")
+    assert vmids(result) == [100, 102]
+    assert all(len(hit["matches"]) == 1 for hit in result["results"])
+    # Terms are joined into one string; a query spanning two neighbours must not match
+    svc._rebuild()
+    for left, right in zip(svc._terms, svc._terms[1:]):
+        spanning = left[-2:] + right[:2]
+        if not any(spanning in term for term in svc._terms):
+            assert svc.search(spanning)["total"] == 0
+
+
+def test_last_and_first_terms_are_found(svc):
+    svc._rebuild()
+    assert svc.search(svc._terms[0])["total"] >= 1
+    assert svc.search(svc._terms[-1][1:])["total"] >= 1
+
+
+def test_visible_limits_results(svc):
+    result = svc.search("web", visible={101})
+    assert vmids(result) == [101] and result["indexed"] == 1
+
+
+def test_updates_and_removal_reindex(svc):
+    svc.update_config(101, "pve1", "qemu", {"name": "mail"})
+    assert vmids(svc.search("webserver")) == []
+    assert vmids(svc.search("mail")) == [101]
+    svc.remove(100)
+    assert vmids(svc.search("10.0.0.5")) == []
+
+
+def test_limit_and_empty_query(svc):
+    assert len(svc.search("web", limit=1)["results"]) == 1
+    assert svc.search("web", limit=1)["total"] == 3
+    with pytest.raises(HTTPException):
+        svc.search("   ")
+
+
+def test_config_terms():
+    terms = config_terms("qemu", {
+        "efidisk0": "local-lvm:vm-1-disk-1,efitype=4m",
+        "ide2": "local-lvm:vm-1-cloudinit,media=cdrom",
+        "ipconfig0": "ip=dhcp,ip6=fd00::5/64",
+    })
+    assert sorted(terms["volid"]) == ["local-lvm:vm-1-cloudinit", "local-lvm:vm-1-disk-1"]
+    assert terms["ip"] == ["fd00::5"]
@@ -0,0 +1,92 @@
+import asyncio
+import base64
+import json
+
+import httpx
+import pytest
+from fastapi import HTTPException
+
+from Modules.services.vm_service import VMService, decode_cursor, encode_cursor
+
+API = "https://pve.test:8006/api2/json"
+VMS = [
+    {"vmid": 100, "name": "web-1", "status": "running", "mem": 300},
+    {"vmid": 101, "name": "db-1", "status": "running", "mem": 900},
+    {"vmid": 102, "name": "Web-2", "status": "stopped", "mem": None},
+    {"vmid": 103, "name": "cache", "status": "running", "mem": 300},
+    {"vmid": 104, "name": "web-3", "status": "running", "mem": 500},
+]
+
+
+def test_cursor_round_trip():
+    key = (False, 300, 100)
+    assert decode_cursor(encode_cursor(key, "-mem"), "-mem") == key
+
+
+@pytest.mark.parametrize("payload", [b"[1, 2]", b'"key"', b'{"sort": "vmid"}', b'{"sort": "vmid", "key": 5}', b"not json"])
+def test_malformed_cursor_is_a_400(payload):
+    with pytest.raises(HTTPException) as e:
+        decode_cursor(base64.urlsafe_b64encode(payload).decode(), "vmid")
+    assert e.value.status_code == 400
+
+
+def test_cursor_from_another_sort_is_a_400():
+    with pytest.raises(HTTPException) as e:
+        decode_cursor(encode_cursor((False, "a", 1), "name"), "vmid")
+    assert e.value.status_code == 400
+
+
+def query(log_file, **kwargs):
+    def handler(request: httpx.Request) -> httpx.Response:
+        assert request.url.path == "/api2/json/nodes/pve1/qemu"
+        return httpx.Response(200, json={"data": [dict(vm) for vm in VMS]})
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            return await VMService(log_file).query_vms("pve1", "csrf", "ticket", api_url=API, client=client, **kwargs)
+
+    return asyncio.run(run())
+
+
+def pages(log_file, limit, **kwargs):
+    seen, cursor = [], None
+    while True:
+        page = query(log_file, limit=limit, cursor=cursor, **kwargs)
+        seen.append([vm["vmid"] for vm in page["items"]])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return seen
+
+
+@pytest.mark.parametrize("sort, expected", [
+    ("vmid", [100, 101, 102, 103, 104]),
+    ("-vmid", [104, 103, 102, 101, 100]),
+    # Ties on the sort value fall back to vmid; missing values sort last ascending
+    ("mem", [100, 103, 104, 101, 102]),
+    ("-mem", [102, 101, 104, 103, 100]),
+])
+def test_keyset_pages_cover_every_vm_once(log_file, sort, expected):
+    assert sum(pages(log_file, 2, sort=sort, fields=["vmid", "mem"]), []) == expected
+    assert pages(log_file, 2, sort=sort)[0] == expected[:2]
+
+
+def test_filters_and_projection(log_file):
+    page = query(log_file, name="WEB", status="running", fields=["name"])
+    assert page == {"items": [{"vmid": 100, "name": "web-1"}, {"vmid": 104, "name": "web-3"}], "next_cursor": None}
+
+
+def test_name_filter_is_literal(log_file):
+    # Regex metacharacters match themselves instead of being compiled
+    assert query(log_file, name="web-.")["items"] == []
+    assert query(log_file, name="(a+)+$")["items"] == []
+
+
+def test_unknown_field_is_a_400(log_file):
+    with pytest.raises(HTTPException) as e:
+        query(log_file, fields=["secret"])
+    assert e.value.status_code == 400
+
+
+def test_cursor_is_opaque_json(log_file):
+    cursor = query(log_file, limit=1)["next_cursor"]
+    assert json.loads(base64.urlsafe_b64decode(cursor)) == {"sort": "vmid", "key": [False, 100, 100]}